@@ -1,10 +1,24 @@
 // ===== API Service for Database Operations =====
 const API = {
     baseUrl: '',
+    pageSize: 200,
+
+    // Last response per endpoint, revalidated with If-None-Match / If-Modified-Since
+    responseCache: new Map(),
 
     async get(endpoint) {
         try {
-            const response = await fetch(`${this.baseUrl}/api/${endpoint}`);
+            const cached = this.responseCache.get(endpoint);
+            const headers = {};
+            if (cached) {
+                if (cached.etag) headers['If-None-Match'] = cached.etag;
+                if (cached.lastModified) headers['If-Modified-Since'] = cached.lastModified;
+            }
+            // no-store: validators are handled here, not by the browser's HTTP cache
+            const response = await fetch(`${this.baseUrl}/api/${endpoint}`, { headers, cache: 'no-store' });
+            if (response.status === 304 && cached) {
+                return structuredClone(cached.data);
+            }
             if (!response.ok) {
                 console.error(`GET ${endpoint} failed with status: ${response.status}`);
                 return [];
@@ -14,13 +28,55 @@ const API = {
                 console.error(`GET ${endpoint} returned non-JSON response`);
                 return [];
             }
-            return await response.json();
+            const data = await response.json();
+            const etag = response.headers.get('ETag');
+            const lastModified = response.headers.get('Last-Modified');
+            if (etag || lastModified) {
+                this.responseCache.set(endpoint, { etag, lastModified, data: structuredClone(data) });
+            }
+            return data;
         } catch (error) {
             console.error(`GET ${endpoint} failed:`, error);
             return [];
         }
     },
 
+    // Error responses may carry { success: false, error } from the server
+    async errorBody(response) {
+        const contentType = response.headers.get('content-type');
+        if (contentType && contentType.includes('application/json')) {
+            try {
+                return { success: false, ...(await response.json()) };
+            } catch (e) {
+                // fall through
+            }
+        }
+        return { success: false };
+    },
+
+    // Keyset-paginated GET: resolves to { data, nextCursor }
+    async getPage(endpoint, params = {}) {
+        const query = new URLSearchParams();
+        Object.entries(params).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') query.set(key, value);
+        });
+        const result = await this.get(`${endpoint}?${query}`);
+        return { data: result.data || [], nextCursor: result.nextCursor || null };
+    },
+
+    // Follow nextCursor until the last page. onPage(rows) may return false to stop early.
+    async getAllPages(endpoint, params = {}, onPage = null) {
+        const rows = [];
+        let cursor = params.cursor || null;
+        do {
+            const page = await this.getPage(endpoint, { limit: this.pageSize, ...params, cursor });
+            if (onPage && onPage(page.data) === false) break;
+            rows.push(...page.data);
+            cursor = page.nextCursor;
+        } while (cursor);
+        return rows;
+    },
+
     async post(endpoint, data) {
         try {
             const response = await fetch(`${this.baseUrl}/api/${endpoint}`, {
@@ -30,7 +86,7 @@ const API = {
             });
             if (!response.ok) {
                 console.error(`POST ${endpoint} failed with status: ${response.status}`);
-                return { success: false };
+                return await this.errorBody(response);
             }
             const contentType = response.headers.get('content-type');
             if (!contentType || !contentType.includes('application/json')) {
@@ -53,7 +109,7 @@ const API = {
             });
             if (!response.ok) {
                 console.error(`PUT ${endpoint} failed with status: ${response.status}`);
-                return { success: false };
+                return await this.errorBody(response);
             }
             const contentType = response.headers.get('content-type');
             if (!contentType || !contentType.includes('application/json')) {
@@ -97,6 +153,8 @@ const API = {
     // Customers
     async getCustomers() { return this.get('customers'); },
     async saveCustomer(customer) { return this.post('customers', customer); },
+    async getCustomerOrders(id, params = {}) { return this.get(`customers/${id}/orders?${new URLSearchParams(params)}`); },
+    async searchCustomers(q, limit = 10) { return this.get(`customers/search?${new URLSearchParams({ q, limit })}`); },
     async deleteCustomer(id) { return this.delete(`customers/${id}`); },
 
     // Orders
@@ -110,6 +168,9 @@ const API = {
     async getHistory() { return this.get('history'); },
     async deleteHistory(id) { return this.delete(`history/${id}`); },
 
+    // Search
+    async searchOrders(q, params = {}) { return this.get(`search?${new URLSearchParams({ q, ...params })}`); },
+
     // Combos
     async getCombos() { return this.get('combos'); },
     async saveCombo(combo) { return this.post('combos', combo); },
@@ -118,6 +179,8 @@ const API = {
     // Recipes
     async getRecipes() { return this.get('recipes'); },
     async saveRecipe(recipe) { return this.post('recipes', recipe); },
+    async getRecipeCost(id) { return this.get(`recipes/${id}/cost`); },
+    async getRecipeCosts() { return this.get('recipes/costs'); },
     async deleteRecipe(id) { return this.delete(`recipes/${id}`); },
 
     // Transactions
@@ -132,19 +195,59 @@ const API = {
 
     // Stats
     async getStats() { return this.get('stats'); },
+    async getFinance(params = {}) { return this.get(`analytics/finance?${new URLSearchParams(params)}`); },
+    async getItemAnalytics(params = {}) { return this.get(`analytics/items?${new URLSearchParams(params)}`); },
+
+    // Incremental sync
+    async sync(since = null) { return this.get(since === null ? 'sync' : `sync?since=${encodeURIComponent(since)}`); },
 
     // Export/Import
     async exportData() { return this.get('export'); },
+    exportUrl(params = {}) { return `${this.baseUrl}/api/export?${new URLSearchParams(params)}`; },
     async importData(data) { return this.post('import', data); },
+    // Upload a backup file as-is and follow the NDJSON progress events
+    async importFile(file, onProgress) {
+        const type = file.name.endsWith('.gz') ? 'application/gzip'
+            : file.name.endsWith('.ndjson') ? 'application/x-ndjson' : 'application/json';
+        try {
+            const response = await fetch(`${this.baseUrl}/api/import?progress=1`, {
+                method: 'POST',
+                headers: { 'Content-Type': type },
+                body: file
+            });
+            if (!response.ok) return await this.errorBody(response);
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let buffer = '', last = { success: false };
+            for (;;) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += value;
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                for (const line of lines.filter(Boolean)) {
+                    last = JSON.parse(line);
+                    if (onProgress && last.stage) onProgress(last);
+                }
+            }
+            return last;
+        } catch (error) {
+            console.error('Import failed:', error);
+            return { success: false };
+        }
+    },
 
     // Grocery Inventory
     async getGrocery() { return this.get('grocery'); },
     async saveGrocery(item) { return this.post('grocery', item); },
+    async bulkSaveGrocery(items) { return this.post('grocery/bulk', items); },
+    async getGroceryAlerts(params = {}) { return this.get(`grocery/alerts?${new URLSearchParams(params)}`); },
     async deleteGrocery(id) { return this.delete(`grocery/${id}`); },
 
     // Grocery Usage
     async getGroceryUsage() { return this.get('grocery/usage'); },
     async recordGroceryUsage(usage) { return this.post('grocery/usage', usage); },
+    async recordGroceryUsageBatch(batch) { return this.post('grocery/usage/batch', batch); },
+    async getGroceryConsumption(params = {}) { return this.get(`grocery/consumption?${new URLSearchParams(params)}`); },
     async deleteGroceryUsage(id) { return this.delete(`grocery/usage/${id}`); },
 
     // Debug
@@ -172,20 +275,58 @@ const DataStore = {
         darkMode: false
     },
 
+    // Collections that can grow without bound: the first page is loaded up front and
+    // the rest is paged in the background once the first screen has rendered
+    pagedCollections: [
+        ['orders', 'orders'],
+        ['customers', 'customers'],
+        ['transactions', 'transactions'],
+        ['orderHistory', 'history']
+    ],
+    loadGeneration: 0,
+    backgroundLoad: null,
+
+    // Server table -> [DataStore key, sort field, descending], mirroring the API list order
+    syncCollections: {
+        inventory: ['inventory', 'name', false],
+        customers: ['customers', 'total_spent', true],
+        orders: ['orders', 'created_at', true],
+        order_history: ['orderHistory', 'delivered_at', true],
+        combos: ['combos', 'name', false],
+        recipes: ['recipes', 'name', false],
+        transactions: ['transactions', 'date', true],
+        offers: ['offers', 'created_at', true],
+        grocery: ['grocery', 'created_at', true]
+    },
+    syncToken: null,
+
     async loadAll() {
+        const generation = ++this.loadGeneration;
+        this.backgroundLoad = null;
         try {
-            [this.inventory, this.orders, this.combos, this.recipes, 
-             this.customers, this.transactions, this.offers, this.orderHistory, this.grocery] = await Promise.all([
+            // Take the sync position first so changes made during the load are picked up by sync()
+            const { token } = await API.sync();
+            const [inventory, combos, recipes, offers, grocery, ...firstPages] = await Promise.all([
                 API.getInventory(),
-                API.getOrders(),
                 API.getCombos(),
                 API.getRecipes(),
-                API.getCustomers(),
-                API.getTransactions(),
                 API.getOffers(),
-                API.getHistory(),
-                API.getGrocery()
+                API.getGrocery(),
+                ...this.pagedCollections.map(([, endpoint]) => API.getPage(endpoint, { limit: API.pageSize }))
             ]);
+            this.inventory = inventory;
+            this.combos = combos;
+            this.recipes = recipes;
+            this.offers = offers;
+            this.grocery = grocery.data || [];
+            
+            const remaining = [];
+            this.pagedCollections.forEach(([key, endpoint], i) => {
+                this[key] = firstPages[i].data;
+                if (firstPages[i].nextCursor) {
+                    remaining.push([key, endpoint, firstPages[i].nextCursor]);
+                }
+            });
             
             // Load settings from localStorage (client-side preference)
             const savedSettings = localStorage.getItem('settings');
@@ -193,8 +334,14 @@ const DataStore = {
                 this.settings = { ...this.settings, ...JSON.parse(savedSettings) };
             }
             
-            // Auto-backup data to localStorage after successful load
-            this.backupToLocalStorage();
+            this.syncToken = token ?? null;
+            
+            if (remaining.length) {
+                this.backgroundLoad = this.loadRemainingPages(generation, remaining);
+            } else {
+                // Auto-backup data to localStorage after successful load
+                this.backupToLocalStorage();
+            }
             
             return true;
         } catch (error) {
@@ -205,6 +352,75 @@ const DataStore = {
         }
     },
 
+    async loadRemainingPages(generation, remaining) {
+        // A newer loadAll() supersedes this one; stop appending to its arrays
+        const isCurrent = () => generation === this.loadGeneration;
+        await Promise.all(remaining.map(([key, endpoint, cursor]) =>
+            API.getAllPages(endpoint, { cursor }, rows => {
+                if (!isCurrent()) return false;
+                this[key] = this[key].concat(rows);
+            })
+        ));
+        if (!isCurrent()) return;
+        
+        this.backgroundLoad = null;
+        this.backupToLocalStorage();
+        const activeTab = document.querySelector('.nav-item.active');
+        if (activeTab) {
+            Navigation.refreshTab(activeTab.dataset.tab);
+        }
+    },
+
+    // Pull only the rows changed since the last load/sync and merge them in place
+    async sync() {
+        if (this.syncToken === null) {
+            return this.loadAll();
+        }
+        if (this.backgroundLoad) {
+            await this.backgroundLoad;
+        }
+        
+        let changed = false;
+        let hasMore = true;
+        while (hasMore) {
+            const result = await API.sync(this.syncToken);
+            if (!result || result.token === undefined) {
+                console.warn('Sync failed, keeping current data');
+                return false;
+            }
+            changed = this.applyChanges(result.changes) || changed;
+            this.syncToken = result.token;
+            hasMore = result.hasMore;
+        }
+        
+        if (changed) {
+            this.backupToLocalStorage();
+        }
+        return true;
+    },
+
+    applyChanges(changes) {
+        let changed = false;
+        Object.entries(changes || {}).forEach(([table, { upserted = [], deleted = [] }]) => {
+            const spec = this.syncCollections[table];
+            if (!spec) return;
+            const [key, sortField, descending] = spec;
+            
+            const replaced = new Set([...deleted, ...upserted.map(row => row.id)]);
+            const merged = this[key].filter(row => !replaced.has(row.id)).concat(upserted);
+            // Same order as the server: NULL sort keys smallest, id breaks ties
+            merged.sort((a, b) => {
+                const x = a[sortField], y = b[sortField];
+                let cmp = x === y ? 0 : x == null ? -1 : y == null ? 1 : x < y ? -1 : x > y ? 1 : 0;
+                if (cmp === 0) cmp = a.id < b.id ? -1 : a.id > b.id ? 1 : 0;
+                return descending ? -cmp : cmp;
+            });
+            this[key] = merged;
+            changed = true;
+        });
+        return changed;
+    },
+
     saveSettings() {
         localStorage.setItem('settings', JSON.stringify(this.settings));
     },
@@ -221,6 +437,7 @@ const DataStore = {
                 offers: this.offers,
                 orderHistory: this.orderHistory,
                 grocery: this.grocery,
+                syncToken: this.syncToken,
                 timestamp: new Date().toISOString()
             };
             localStorage.setItem('data_backup', JSON.stringify(backup));
@@ -244,6 +461,7 @@ const DataStore = {
                 this.offers = data.offers || [];
                 this.orderHistory = data.orderHistory || [];
                 this.grocery = data.grocery || [];
+                this.syncToken = data.syncToken ?? null;
                 console.log('Data restored from localStorage backup from', data.timestamp);
                 Toast.warning('Offline Mode', 'Using cached data. Server may be unavailable.');
             }
@@ -270,13 +488,6 @@ const Utils = {
         return new Date().toLocaleString('en-US', { timeZone: this.TEXAS_TIMEZONE });
     },
     
-    getTexasISOString() {
-        // Get current time in Texas timezone as ISO-like string
-        const now = new Date();
-        const texasTime = new Date(now.toLocaleString('en-US', { timeZone: this.TEXAS_TIMEZONE }));
-        return texasTime.toISOString();
-    },
-    
     formatCurrency(amount) {
         return '$' + Number(amount).toFixed(2);
     },
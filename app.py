@@ -1,11 +1,24 @@
 """
 90's JAR - Flask Backend with PostgreSQL (Production) / SQLite (Local)
 """
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, request, jsonify, g, stream_with_context
 from flask_cors import CORS
 import os
 import json
-from datetime import datetime
+import base64
+import csv
+import io
+import re
+import functools
+import gzip
+import hashlib
+import itertools
+import secrets
+import zlib
+import threading
+import time
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import logging
 
 # Set up logging
@@ -26,221 +39,1545 @@ except Exception as e:
 
 import sqlite3
 
-app = Flask(__name__, static_folder='.')
+from assets import register_assets
+
+# Brotli is optional; responses fall back to gzip without it
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+# Static files are served by the asset pipeline, not Flask's static folder
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
 # Database setup - Use PostgreSQL if DATABASE_URL is set, otherwise SQLite
 DATABASE_URL = os.environ.get('DATABASE_URL')
 DB_FILE = 'jar_database.db'
+USE_POSTGRES = bool(DATABASE_URL and HAS_POSTGRES)
+
+# Business data tables, in the order they are exported and synced
+DATA_TABLES = ('inventory', 'customers', 'orders', 'order_history', 'combos', 'recipes',
+               'transactions', 'offers', 'grocery', 'grocery_usage')
+
+# Columns stored as JSON text and decoded before they are returned
+JSON_COLUMNS = {
+    'orders': ('items',),
+    'order_history': ('items',),
+    'combos': ('items',),
+    'recipes': ('ingredients', 'steps')
+}
 
 logger.info(f"DATABASE_URL set: {bool(DATABASE_URL)}")
 logger.info(f"HAS_POSTGRES: {HAS_POSTGRES}")
-logger.info(f"Using PostgreSQL: {bool(DATABASE_URL and HAS_POSTGRES)}")
+logger.info(f"Using PostgreSQL: {USE_POSTGRES}")
+
+# ===== Connection Pool =====
+# Each worker process keeps its own pool so connections are never shared across a fork
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30))
+
+# SQLite tuning for shops running without Postgres. WAL lets readers carry on while one
+# writer commits, and busy_timeout makes a second writer wait instead of failing with
+# "database is locked".
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 256))
+if SQLITE_JOURNAL_MODE not in ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF'):
+    raise ValueError(f'Unsupported SQLITE_JOURNAL_MODE: {SQLITE_JOURNAL_MODE}')
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    raise ValueError(f'Unsupported SQLITE_SYNCHRONOUS: {SQLITE_SYNCHRONOUS}')
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available within the checkout timeout"""
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived database connections"""
+
+    def __init__(self, connect, min_size=1, max_size=5, timeout=10.0, check_interval=30.0):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, last_used) pairs, most recently used last
+        self._size = 0
+        self._waiting = 0
+        self._metrics = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'health_check_failures': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        """Open a connection for a slot already reserved in self._size"""
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._metrics['connections_opened'] += 1
+        return conn
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check out a connection, waiting up to self.timeout seconds for one to free up"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = last_used = None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        if conn is None:
+            conn = self._open()
+        elif time.monotonic() - last_used > self.check_interval and not self._is_healthy(conn):
+            logger.warning("Discarding unhealthy pooled connection")
+            self._close_quietly(conn)
+            with self._cond:
+                self._metrics['health_check_failures'] += 1
+            conn = self._open()
+
+        waited_ms = (time.monotonic() - start) * 1000
+        with self._cond:
+            self._metrics['checkouts'] += 1
+            self._metrics['total_wait_ms'] += waited_ms
+            self._metrics['max_wait_ms'] = max(self._metrics['max_wait_ms'], waited_ms)
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back anything left uncommitted"""
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close_quietly(conn)
+        with self._cond:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        """Pool size and wait metrics"""
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting
+            })
+        checkouts = stats['checkouts']
+        stats['avg_wait_ms'] = stats['total_wait_ms'] / checkouts if checkouts else 0.0
+        return stats
+
+def connect_db():
+    """Open a new database connection - PostgreSQL in production, SQLite locally"""
+    if USE_POSTGRES:
+        return psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    # Pooled connections move between request threads but are only used by one at a time.
+    # Writes take the lock up front (BEGIN IMMEDIATE) so a busy writer waits out
+    # busy_timeout rather than failing when it upgrades from a read.
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           isolation_level='IMMEDIATE', cached_statements=SQLITE_STATEMENT_CACHE)
+    conn.row_factory = sqlite3.Row
+    # SQLite only enforces REFERENCES ... ON DELETE CASCADE when asked to
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+    conn.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Get this worker's connection pool, creating it on first use after a fork"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(connect_db, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                                       timeout=DB_POOL_TIMEOUT, check_interval=DB_POOL_CHECK_INTERVAL)
+                _pool_pid = pid
+    return _pool
 
 def get_db():
-    """Get database connection - PostgreSQL in production, SQLite locally"""
-    if DATABASE_URL and HAS_POSTGRES:
-        conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
-        return conn, True  # Return conn and is_postgres flag
+    """Get the current request's pooled connection - PostgreSQL in production, SQLite locally"""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db, USE_POSTGRES  # Return conn and is_postgres flag
+
+@app.teardown_appcontext
+def release_db(exc):
+    """Hand the request's connection back to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    logger.error(f"Pool timeout: {e}")
+    return jsonify({'success': False, 'error': 'Database busy, please retry'}), 503
+
+# ===== Query Layer =====
+# Statements are written once with ? placeholders and compiled per dialect on first use.
+# Postgres gets %s placeholders, leaving quoted literals alone, and runs them as server-side
+# prepared statements so repeated writes skip parsing and planning. upsert() and
+# insert_many() build the INSERT ... ON CONFLICT form both dialects understand.
+@functools.lru_cache(maxsize=1024)
+def compile_query(query, is_postgres):
+    """The statement text for this dialect, memoized"""
+    if not is_postgres:
+        return query
+    # Odd parts are '...' literals: only their % needs escaping for psycopg
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    return ''.join(part.replace('%', '%%') if i % 2 else part.replace('%', '%%').replace('?', '%s')
+                   for i, part in enumerate(parts))
+
+def run_sql(cur, is_postgres, query, params=()):
+    """Execute a ? statement on either dialect; Postgres prepares it once per connection"""
+    if is_postgres:
+        cur.execute(compile_query(query, True), params, prepare=True)
+    else:
+        cur.execute(query, params)
+    return cur
+
+def run_sql_many(cur, is_postgres, query, rows):
+    """Execute a ? statement once per parameter row, batched by the driver"""
+    cur.executemany(compile_query(query, is_postgres), rows)
+
+@functools.lru_cache(maxsize=256)
+def upsert_statement(table, columns, key, update):
+    sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+           f" ON CONFLICT ({', '.join(key)}) ")
+    if update:
+        return sql + 'DO UPDATE SET ' + ', '.join(f'{col} = excluded.{col}' for col in update)
+    return sql + 'DO NOTHING'
+
+def upsert(cur, is_postgres, table, row, key=('id',), update=None):
+    """Insert row (column -> value); if the key exists, overwrite the update columns instead
+    (every non-key column by default), or leave the row alone when update is empty"""
+    columns = tuple(row)
+    if update is None:
+        update = tuple(col for col in columns if col not in key)
+    run_sql(cur, is_postgres, upsert_statement(table, columns, tuple(key), tuple(update)), tuple(row.values()))
+
+def insert_many(cur, is_postgres, table, columns, rows, key=None):
+    """Insert rows (value tuples in column order) in one batch; with key, existing rows are skipped"""
+    if not rows:
+        return
+    if key is None:
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
     else:
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row
-        return conn, False
+        sql = upsert_statement(table, tuple(columns), tuple(key), ())
+    run_sql_many(cur, is_postgres, sql, rows)
 
 def execute_query(query, params=(), fetch=False, fetchone=False, commit=False):
-    """Execute a query with proper database handling"""
+    """Execute a query on the request's connection"""
     conn, is_postgres = get_db()
-    
-    if is_postgres:
-        cur = conn.cursor()
-        # Convert ? placeholders to %s for PostgreSQL
-        query = query.replace('?', '%s')
-    else:
-        cur = conn.cursor()
+    cur = conn.cursor()
     
     try:
-        cur.execute(query, params)
+        run_sql(cur, is_postgres, query, params)
         
         if fetch:
-            result = cur.fetchall()
-            if is_postgres:
-                result = [dict(row) if hasattr(row, 'keys') else row for row in result]
-            else:
-                result = [dict(row) for row in result]
-            conn.close()
-            return result
+            return [dict(row) for row in cur.fetchall()]
         elif fetchone:
             result = cur.fetchone()
             if result:
                 result = dict(result)
-            conn.close()
             return result
         elif commit:
             conn.commit()
-            conn.close()
             return True
         else:
-            conn.close()
             return None
     except Exception as e:
-        conn.close()
+        conn.rollback()
         logger.error(f"Query error: {e}")
         raise e
 
-def init_db():
-    """Initialize database with tables"""
-    conn, is_postgres = get_db()
-    cur = conn.cursor()
+# ===== Query Cache =====
+# Per-worker cache for expensive read endpoints. Entries expire after their TTL and are
+# dropped as soon as this worker writes to a table they read; writes made by other
+# workers are picked up when the TTL runs out.
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 15))
+ANALYTICS_CACHE_TTL = float(os.environ.get('ANALYTICS_CACHE_TTL', 300))
+
+class QueryCache:
+    """TTL cache with table-based invalidation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expires_at, tables, value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[2]
+
+    def set(self, key, value, ttl, tables):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, frozenset(tables), value)
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[1].intersection(tables)]:
+                del self._entries[key]
+
+query_cache = QueryCache()
+
+# Per-table change versions used for ETags. They are re-read from change_log at most once
+# per TABLE_VERSION_TTL seconds (or right after this worker writes), so conditional GETs
+# inside that window are answered without touching the database.
+TABLE_VERSION_TTL = float(os.environ.get('TABLE_VERSION_TTL', 1))
+
+class TableVersions:
+    """Latest change_log seq per table, plus when this worker first saw it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._modified = {}
+        self._checked_at = None
+
+    def get(self, tables):
+        with self._lock:
+            stale = self._checked_at is None or time.monotonic() - self._checked_at > TABLE_VERSION_TTL
+        if stale:
+            self.refresh()
+        with self._lock:
+            return (tuple(self._versions.get(t, 0) for t in tables),
+                    max(self._modified.get(t, SERVER_STARTED_AT) for t in tables))
+
+    def refresh(self):
+        columns = ', '.join(f"(SELECT COALESCE(MAX(seq), 0) FROM change_log WHERE table_name = '{t}') AS {t}"
+                            for t in DATA_TABLES)
+        row = execute_query(f'SELECT {columns}', fetchone=True)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for table in DATA_TABLES:
+                if self._versions.get(table) != row[table]:
+                    self._versions[table] = row[table]
+                    self._modified[table] = now
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = None
+
+SERVER_STARTED_AT = datetime.now(timezone.utc).replace(microsecond=0)
+table_versions = TableVersions()
+
+def invalidates(*tables):
+    """Drop cached results that depend on these tables after the wrapped write route runs"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                query_cache.invalidate(*tables)
+                table_versions.invalidate()
+        return wrapper
+    return decorator
+
+# ===== List Queries =====
+# Keyset pagination for list endpoints: table -> (sort column, descending). The row id
+# breaks ties so every row has a unique position.
+LIST_SORT_KEYS = {
+    'inventory': ('name', False),
+    'customers': ('total_spent', True),
+    'orders': ('created_at', True),
+    'order_history': ('delivered_at', True),
+    'combos': ('name', False),
+    'recipes': ('name', False),
+    'transactions': ('date', True),
+    'offers': ('created_at', True),
+    'grocery': ('created_at', True),
+    'grocery_usage': ('used_date', True)
+}
+
+# Column used by the ?from=&to= date range filter
+LIST_DATE_COLUMNS = {
+    'customers': 'last_order',
+    'orders': 'created_at',
+    'order_history': 'delivered_at',
+    'transactions': 'date',
+    'offers': 'start_date',
+    'grocery': 'purchase_date',
+    'grocery_usage': 'used_date'
+}
+
+# Columns accepted as equality filters (comma separated values match any)
+LIST_FILTERS = {
+    'inventory': ('category',),
+    'orders': ('status',),
+    'order_history': ('status',),
+    'recipes': ('category',),
+    'transactions': ('type', 'category'),
+    'grocery': ('category',),
+    'grocery_usage': ('grocery_id', 'purpose')
+}
+
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+class InvalidRequest(Exception):
+    """Raised for malformed query parameters; reported to the client as a 400"""
+
+@app.errorhandler(InvalidRequest)
+def handle_invalid_request(e):
+    return jsonify({'success': False, 'error': str(e)}), 400
+
+_table_columns = {}
+
+def get_table_columns(table):
+    """Column names of a table, read once per worker"""
+    if table not in _table_columns:
+        conn, is_postgres = get_db()
+        cur = conn.cursor()
+        cur.execute(f'SELECT * FROM {table} LIMIT 0')
+        _table_columns[table] = [col[0] for col in cur.description]
+    return _table_columns[table]
+
+def encode_cursor(key, row_id):
+    raw = json.dumps([key, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        key, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return key, row_id
+    except Exception:
+        raise InvalidRequest('Invalid cursor')
+
+def is_paginated():
+    return 'limit' in request.args or 'cursor' in request.args
+
+def keyset_condition(sort_col, descending, key, row_id):
+    """WHERE clause selecting rows after (key, row_id) in the list order.
+    NULL sort keys order as the smallest value, matching ORDER BY ... NULLS FIRST/LAST below."""
+    if descending:
+        if key is None:
+            return f'({sort_col} IS NULL AND id < ?)', [row_id]
+        return f'({sort_col} < ? OR ({sort_col} = ? AND id < ?) OR {sort_col} IS NULL)', [key, key, row_id]
+    if key is None:
+        return f'(({sort_col} IS NULL AND id > ?) OR {sort_col} IS NOT NULL)', [row_id]
+    return f'({sort_col} > ? OR ({sort_col} = ? AND id > ?))', [key, key, row_id]
+
+def query_list(table):
+    """Run a list query honouring ?fields=, ?from=&to=, equality filters and, when
+    ?limit= or ?cursor= is given, keyset pagination. Returns (rows, next_cursor)."""
+    args = request.args
+    sort_col, descending = LIST_SORT_KEYS[table]
+    
+    select = '*'
+    if args.get('fields'):
+        columns = get_table_columns(table)
+        wanted = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in wanted if f not in columns]
+        if unknown:
+            raise InvalidRequest(f"Unknown fields: {', '.join(unknown)}")
+        # id and the sort key are always returned so the cursor can be built
+        select = ', '.join(dict.fromkeys(['id', sort_col] + wanted))
     
-    logger.info(f"init_db called - using PostgreSQL: {is_postgres}")
+    where, params = [], []
+    date_col = LIST_DATE_COLUMNS.get(table)
+    if date_col and args.get('from'):
+        where.append(f'{date_col} >= ?')
+        params.append(args['from'])
+    if date_col and args.get('to'):
+        to = args['to']
+        if len(to) == 10:
+            # A bare YYYY-MM-DD includes the whole day
+            try:
+                to = (datetime.strptime(to, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            except ValueError:
+                raise InvalidRequest(f'Invalid date: {to}')
+            where.append(f'{date_col} < ?')
+        else:
+            where.append(f'{date_col} <= ?')
+        params.append(to)
+    for col in LIST_FILTERS.get(table, ()):
+        if args.get(col):
+            values = [v for v in args[col].split(',') if v]
+            where.append(f"{col} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    
+    limit = None
+    if is_paginated():
+        try:
+            limit = min(max(int(args.get('limit', LIST_DEFAULT_LIMIT)), 1), LIST_MAX_LIMIT)
+        except ValueError:
+            raise InvalidRequest('limit must be an integer')
+        if args.get('cursor'):
+            key, row_id = decode_cursor(args['cursor'])
+            condition, cursor_params = keyset_condition(sort_col, descending, key, row_id)
+            where.append(condition)
+            params.extend(cursor_params)
+    
+    direction = 'DESC NULLS LAST' if descending else 'ASC NULLS FIRST'
+    id_direction = 'DESC' if descending else 'ASC'
+    query = f'SELECT {select} FROM {table}'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += f' ORDER BY {sort_col} {direction}, id {id_direction}'
+    if limit is not None:
+        query += f' LIMIT {limit + 1}'
+    
+    rows = execute_query(query, tuple(params), fetch=True)
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][sort_col], rows[-1]['id'])
+    return rows, next_cursor
+
+def list_response(rows, next_cursor, envelope=False):
+    """Plain list for legacy callers, {data, nextCursor} when paginating"""
+    if is_paginated():
+        body = {'data': rows, 'nextCursor': next_cursor}
+        if envelope:
+            body['success'] = True
+        return jsonify(body)
+    if envelope:
+        return jsonify({'success': True, 'data': rows})
+    return jsonify(rows)
+
+# ===== Line Items =====
+# Order, combo and recipe line items live in child tables so they can be filtered and
+# aggregated in SQL. The parent's JSON column is still written as the document copy used
+# by backups, but list endpoints rebuild items from the child rows.
+# Each field is (client key, column, type); values that don't fit the column type are kept
+# in the row's "extra" JSON together with any keys not listed here, so items round-trip.
+ORDER_ITEM_FIELDS = (
+    ('itemId', 'item_id', str),
+    ('name', 'name', str),
+    ('price', 'price', float),
+    ('quantity', 'quantity', float),
+    ('total', 'total', float),
+    ('weight', 'weight', float),
+    ('weightDisplay', 'weight_display', str),
+    ('isCombo', 'is_combo', bool),
+    ('isManual', 'is_manual', bool),
+    ('comboDescription', 'combo_description', str)
+)
+COMBO_ITEM_FIELDS = (
+    ('itemId', 'item_id', str),
+    ('name', 'name', str),
+    ('price', 'price', float),
+    ('quantity', 'quantity', float),
+    ('total', 'total', float)
+)
+RECIPE_INGREDIENT_FIELDS = (
+    ('name', 'name', str),
+    ('quantity', 'quantity', str),
+    ('cost', 'cost', float)
+)
+
+ORDER_ITEM_COLUMNS = ', '.join(['order_id', 'position'] + [col for _, col, _ in ORDER_ITEM_FIELDS] + ['extra'])
+ORDER_HISTORY_COLUMNS = ('id', 'order_id', 'customer_name', 'customer_phone', 'customer_email', 'customer_address',
+                         'items', 'subtotal', 'discount', 'total', 'deadline', 'notes', 'status', 'created_at',
+                         'delivered_at', 'customer_id')
+
+# (parent table, JSON column) -> (child table, parent key column, fields)
+LINE_ITEM_TABLES = {
+    ('orders', 'items'): ('order_items', 'order_id', ORDER_ITEM_FIELDS),
+    ('order_history', 'items'): ('order_history_items', 'order_id', ORDER_ITEM_FIELDS),
+    ('combos', 'items'): ('combo_items', 'combo_id', COMBO_ITEM_FIELDS),
+    ('recipes', 'ingredients'): ('recipe_ingredients', 'recipe_id', RECIPE_INGREDIENT_FIELDS)
+}
+
+def line_item_row(parent_id, position, item, fields):
+    """Split a client item dict into column values plus an extra JSON blob"""
+    values = [parent_id, position]
+    extra = dict(item)
+    for key, _, kind in fields:
+        value = extra.get(key)
+        if value is None:
+            # Absent keys stay absent; an explicit null is kept in extra
+            values.append(None)
+            continue
+        if kind is bool and isinstance(value, bool):
+            values.append(int(value))
+        elif kind is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+            values.append(value)
+        elif kind is str and isinstance(value, str):
+            values.append(value)
+        else:
+            values.append(None)
+            continue
+        del extra[key]
+    values.append(json.dumps(extra) if extra else None)
+    return tuple(values)
+
+def write_line_items(cur, is_postgres, table, column, parent_id, items):
+    """Replace a parent's child rows with the given items"""
+    child, parent_key, fields = LINE_ITEM_TABLES[(table, column)]
+    run_sql(cur, is_postgres, f'DELETE FROM {child} WHERE {parent_key} = ?', (parent_id,))
+    columns = [parent_key, 'position'] + [col for _, col, _ in fields] + ['extra']
+    insert_many(cur, is_postgres, child, columns,
+                [line_item_row(parent_id, position, item, fields) for position, item in enumerate(items or [])])
+
+def line_item_from_row(row, fields):
+    item = {}
+    for key, col, kind in fields:
+        if row[col] is not None:
+            item[key] = bool(row[col]) if kind is bool else row[col]
+    if row['extra']:
+        item.update(json.loads(row['extra']))
+    return item
+
+def expand_rows(table, rows):
+    """Attach line items from the child tables and decode the remaining JSON columns"""
+    handled = set()
+    for (parent, column), (child, parent_key, fields) in LINE_ITEM_TABLES.items():
+        if parent != table:
+            continue
+        handled.add(column)
+        wanted = [row for row in rows if column in row]
+        if not wanted:
+            continue
+        items_by_parent = {row['id']: [] for row in wanted}
+        ids = list(items_by_parent)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            children = execute_query(
+                f"SELECT * FROM {child} WHERE {parent_key} IN ({', '.join('?' * len(chunk))}) "
+                f"ORDER BY {parent_key}, position", tuple(chunk), fetch=True)
+            for child_row in children:
+                items_by_parent[child_row[parent_key]].append(line_item_from_row(child_row, fields))
+        for row in wanted:
+            row[column] = items_by_parent[row['id']]
+    for col in JSON_COLUMNS.get(table, ()):
+        if col in handled:
+            continue
+        for row in rows:
+            if col in row:
+                row[col] = json.loads(row[col]) if row[col] else []
+    return rows
+
+def backfill_line_items(cur, is_postgres, tables=None):
+    """Migration step: copy existing JSON line items into the child tables"""
+    for (table, column) in LINE_ITEM_TABLES:
+        if tables is not None and table not in tables:
+            continue
+        cur.execute(f'SELECT id, {column} FROM {table}')
+        for row in cur.fetchall():
+            try:
+                items = json.loads(row[column]) if row[column] else []
+            except ValueError:
+                logger.warning(f"Skipping unreadable {table}.{column} for {row['id']}")
+                continue
+            if isinstance(items, list):
+                write_line_items(cur, is_postgres, table, column, row['id'], items)
+
+# ===== Order Placement =====
+def decrement_stock(cur, is_postgres, items):
+    """Take ordered quantities off inventory, only where enough stock is left.
+    Returns shortages as [{itemId, name, requested, available}]; empty when every line fit.
+    Items no longer in inventory are skipped, as before."""
+    wanted, names = {}, {}
+    for item in items:
+        if item.get('isCombo') or item.get('isManual'):
+            continue
+        wanted[item['itemId']] = wanted.get(item['itemId'], 0) + item['quantity']
+        names.setdefault(item['itemId'], item.get('name'))
+    if not wanted:
+        return []
     
+    short = guarded_decrement(cur, is_postgres, 'inventory', 'stock', wanted)
+    return [{'itemId': item_id, 'name': names[item_id], 'requested': wanted[item_id], 'available': available}
+            for item_id, available in short.items() if available is not None]
+
+def guarded_decrement(cur, is_postgres, table, column, wanted):
+    """Subtract wanted[id] from table.column on every row that has enough left.
+    Returns {id: available} for the rows that were short (None if the row doesn't exist)."""
     if is_postgres:
-        # PostgreSQL syntax
-        cur.execute('''CREATE TABLE IF NOT EXISTS inventory (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            category TEXT NOT NULL,
-            cost_price REAL NOT NULL,
-            selling_price REAL NOT NULL,
-            stock INTEGER NOT NULL DEFAULT 0,
-            unit TEXT DEFAULT 'pcs',
-            description TEXT,
-            shelf_life INTEGER,
-            created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS customers (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            phone TEXT,
-            email TEXT,
-            address TEXT,
-            notes TEXT,
-            total_orders INTEGER DEFAULT 0,
-            total_spent REAL DEFAULT 0,
-            created_at TEXT,
-            last_order TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS orders (
-            id TEXT PRIMARY KEY,
-            order_id TEXT,
-            customer_name TEXT NOT NULL,
-            customer_phone TEXT,
-            customer_email TEXT,
-            customer_address TEXT,
-            items TEXT,
-            subtotal REAL,
-            discount REAL DEFAULT 0,
-            total REAL,
-            deadline TEXT,
-            notes TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TEXT,
-            delivered_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS order_history (
-            id TEXT PRIMARY KEY,
-            order_id TEXT,
-            customer_name TEXT NOT NULL,
-            customer_phone TEXT,
-            customer_email TEXT,
-            customer_address TEXT,
-            items TEXT,
-            subtotal REAL,
-            discount REAL DEFAULT 0,
-            total REAL,
-            deadline TEXT,
-            notes TEXT,
-            status TEXT,
-            created_at TEXT,
-            delivered_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS combos (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT,
-            price REAL NOT NULL,
-            items TEXT,
-            regular_total REAL,
-            savings REAL,
-            created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS recipes (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            category TEXT,
-            batch_size TEXT,
-            total_time TEXT,
-            ingredients TEXT,
-            steps TEXT,
-            notes TEXT,
-            total_ingredient_cost REAL DEFAULT 0,
-            created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS transactions (
-            id TEXT PRIMARY KEY,
-            type TEXT NOT NULL,
-            category TEXT,
-            amount REAL NOT NULL,
-            date TEXT,
-            description TEXT,
-            created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS offers (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            type TEXT,
-            value REAL,
-            start_date TEXT,
-            end_date TEXT,
-            active INTEGER DEFAULT 1,
-            created_at TEXT
-        )''')
+        # One round trip for the whole basket
+        values = ', '.join(['(?::text, ?::numeric)'] * len(wanted))
+        run_sql(cur, is_postgres, f'''
+            UPDATE {table} AS t SET {column} = t.{column} - v.qty
+            FROM (VALUES {values}) AS v (id, qty)
+            WHERE t.id = v.id AND t.{column} >= v.qty
+            RETURNING t.id
+        ''', [value for pair in wanted.items() for value in pair])
+        updated = {row['id'] for row in cur.fetchall()}
+        failed = [row_id for row_id in wanted if row_id not in updated]
+    else:
+        # SQLite runs in-process, so a reused statement per line costs no round trips
+        failed = []
+        for row_id, qty in wanted.items():
+            run_sql(cur, is_postgres, f'UPDATE {table} SET {column} = {column} - ? WHERE id = ? AND {column} >= ?',
+                    (qty, row_id, qty))
+            if cur.rowcount == 0:
+                failed.append(row_id)
+    if not failed:
+        return {}
+    
+    run_sql(cur, is_postgres, f"SELECT id, {column} FROM {table} WHERE id IN ({', '.join('?' * len(failed))})", failed)
+    available = {row['id']: row[column] for row in cur.fetchall()}
+    return {row_id: available.get(row_id) for row_id in failed}
+
+def customer_lookup_key(name):
+    """Unique key orders are matched to customers on: the name, ignoring case and spacing"""
+    return ' '.join((name or '').split()).lower() or None
+
+def upsert_order_customer(cur, is_postgres, data, now):
+    """Id of the order's customer, creating them or filling in missing contact details.
+    Their totals are left to adjust_customer_stats()."""
+    lookup_key = customer_lookup_key(data['customerName'])
+    if lookup_key is None:
+        return None
+    run_sql(cur, is_postgres, '''
+        INSERT INTO customers (id, name, phone, email, address, total_orders, total_spent, created_at, lookup_key)
+        VALUES (?, ?, ?, ?, ?, 0, 0, ?, ?)
+        ON CONFLICT (lookup_key) DO UPDATE SET
+            phone = COALESCE(NULLIF(excluded.phone, ''), customers.phone),
+            email = COALESCE(NULLIF(excluded.email, ''), customers.email),
+            address = COALESCE(NULLIF(excluded.address, ''), customers.address)
+    ''', (generate_id(), data['customerName'], data.get('customerPhone', ''),
+          data.get('customerEmail', ''), data.get('customerAddress', ''), now, lookup_key))
+    run_sql(cur, is_postgres, 'SELECT id FROM customers WHERE lookup_key = ?', (lookup_key,))
+    return cur.fetchone()['id']
+
+def backfill_customer_keys(cur, is_postgres):
+    """Migration step: give each distinct customer name its lookup key. Older duplicates of
+    the same name keep a NULL key and are no longer matched by new orders."""
+    cur.execute('SELECT id, name FROM customers ORDER BY created_at, id')
+    seen, updates, duplicates = set(), [], 0
+    for row in cur.fetchall():
+        key = customer_lookup_key(row['name'])
+        if key is None or key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        updates.append((key, row['id']))
+    if updates:
+        run_sql_many(cur, is_postgres, 'UPDATE customers SET lookup_key = ? WHERE id = ?', updates)
+    if duplicates:
+        logger.warning(f"{duplicates} customers share a name with an older customer and were left unkeyed")
+
+# ===== Customer Stats =====
+# customers.total_orders / total_spent / last_order cover the customer's active and completed
+# orders, linked through customer_id. Every order write adjusts them by its own delta;
+# reconcile_customer_stats() recomputes them all (`flask --app app reconcile-customer-stats`).
+CUSTOMER_ORDERS = '''
+    SELECT customer_id, total, created_at FROM orders
+    UNION ALL
+    SELECT customer_id, total, created_at FROM order_history
+'''
+
+def adjust_customer_stats(cur, is_postgres, customer_id, orders, spent):
+    """Add an order change to a customer's totals and refresh their last order date"""
+    if customer_id is None:
+        return
+    run_sql(cur, is_postgres, f'''
+        UPDATE customers SET
+            total_orders = COALESCE(total_orders, 0) + ?,
+            total_spent = COALESCE(total_spent, 0) + ?,
+            last_order = (SELECT MAX(created_at) FROM ({CUSTOMER_ORDERS}) o WHERE o.customer_id = customers.id)
+        WHERE id = ?
+    ''', (orders, spent, customer_id))
+
+def order_stats(cur, is_postgres, table, order_id):
+    """(customer_id, total) an order currently counts toward, or None if it doesn't exist"""
+    run_sql(cur, is_postgres, f'SELECT customer_id, total FROM {table} WHERE id = ?', (order_id,))
+    row = cur.fetchone()
+    return (row['customer_id'], float(row['total'] or 0)) if row else None
+
+def move_customer_stats(cur, is_postgres, old, new):
+    """Shift totals from an order's previous (customer_id, total) to its current one"""
+    old_customer, old_total = old or (None, 0.0)
+    new_customer, new_total = new or (None, 0.0)
+    if old and new and old_customer == new_customer:
+        adjust_customer_stats(cur, is_postgres, new_customer, 0, new_total - old_total)
+        return
+    if old:
+        adjust_customer_stats(cur, is_postgres, old_customer, -1, -old_total)
+    if new:
+        adjust_customer_stats(cur, is_postgres, new_customer, 1, new_total)
+
+def backfill_order_customers(cur, is_postgres, tables=('orders', 'order_history')):
+    """Link unlinked orders to customers by lookup key"""
+    cur.execute('SELECT id, lookup_key FROM customers WHERE lookup_key IS NOT NULL')
+    customers = {row['lookup_key']: row['id'] for row in cur.fetchall()}
+    for table in tables:
+        cur.execute(f'SELECT id, customer_name FROM {table} WHERE customer_id IS NULL')
+        updates = [(customers.get(customer_lookup_key(row['customer_name'])), row['id']) for row in cur.fetchall()]
+        if updates:
+            run_sql_many(cur, is_postgres, f'UPDATE {table} SET customer_id = ? WHERE id = ?', updates)
+
+def reconcile_customer_stats(cur, is_postgres):
+    """Recompute every customer's totals from their orders in one statement"""
+    cur.execute(f'''
+        UPDATE customers SET (total_orders, total_spent, last_order) = (
+            SELECT COUNT(*), COALESCE(SUM(total), 0), MAX(created_at)
+            FROM ({CUSTOMER_ORDERS}) o WHERE o.customer_id = customers.id
+        )
+    ''')
+    return cur.rowcount
+
+# ===== Customer Search =====
+# Typeahead over name, phone and email. Postgres matches substrings through a pg_trgm GIN
+# index; SQLite keeps a contentless FTS5 index in step with triggers and matches word
+# prefixes. customers has a TEXT primary key whose implicit rowid VACUUM may renumber, so
+# the FTS rows are keyed on customer_search_keys, a stable INTEGER PRIMARY KEY per
+# customer. Phones are indexed as digits only so "(682) 274" and "682274" both find them.
+# Either falls back to a LIKE scan when the extension or FTS5 is unavailable.
+CUSTOMER_SEARCH_DEFAULT_LIMIT = 10
+CUSTOMER_SEARCH_MAX_LIMIT = 50
+CUSTOMER_SEARCH_COLUMNS = 'c.id, c.name, c.phone, c.email, c.address, c.total_orders, c.total_spent, c.last_order'
+PHONE_PUNCTUATION = (' ', '-', '(', ')', '+', '.')
+
+def sqlite_digits(expr):
+    """SQL stripping phone punctuation from expr; SQLite has no regexp_replace"""
+    for ch in PHONE_PUNCTUATION:
+        expr = f"REPLACE({expr}, '{ch}', '')"
+    return expr
+
+CUSTOMER_SEARCH_TEXT = {
+    True: r"(LOWER(name) || ' ' || REGEXP_REPLACE(COALESCE(phone, ''), '\D', '', 'g') || ' ' || LOWER(COALESCE(email, '')))",
+    False: "(LOWER(name) || ' ' || " + sqlite_digits("COALESCE(phone, '')") + " || ' ' || LOWER(COALESCE(email, '')))"
+}
+CUSTOMER_FTS_VALUES = '{0}.name, ' + sqlite_digits("COALESCE({0}.phone, '')") + ', {0}.email'
+CUSTOMER_FTS_KEY = '(SELECT search_id FROM customer_search_keys WHERE customer_id = {0}.id)'
+CUSTOMER_FTS_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers BEGIN
+        INSERT INTO customer_search_keys (customer_id) VALUES (new.id);
+        INSERT INTO customers_fts (rowid, name, phone, email) VALUES ({CUSTOMER_FTS_KEY.format('new')}, {CUSTOMER_FTS_VALUES.format('new')});
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers BEGIN
+        INSERT INTO customers_fts (customers_fts, rowid, name, phone, email) VALUES ('delete', {CUSTOMER_FTS_KEY.format('old')}, {CUSTOMER_FTS_VALUES.format('old')});
+        DELETE FROM customer_search_keys WHERE customer_id = old.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE OF name, phone, email ON customers BEGIN
+        INSERT INTO customers_fts (customers_fts, rowid, name, phone, email) VALUES ('delete', {CUSTOMER_FTS_KEY.format('old')}, {CUSTOMER_FTS_VALUES.format('old')});
+        INSERT INTO customers_fts (rowid, name, phone, email) VALUES ({CUSTOMER_FTS_KEY.format('new')}, {CUSTOMER_FTS_VALUES.format('new')});
+    END''',
+]
+
+_customer_search_indexed = None
+
+def create_customer_search_index(cur, is_postgres):
+    """Migration step: trigram index on Postgres, FTS5 table and triggers on SQLite. Hosts
+    that can't provide either keep working on the LIKE fallback."""
+    if is_postgres:
+        cur.execute('SAVEPOINT customer_search')
+        try:
+            cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cur.execute(f'CREATE INDEX IF NOT EXISTS idx_customers_search_trgm ON customers '
+                        f'USING GIN ({CUSTOMER_SEARCH_TEXT[True]} gin_trgm_ops)')
+            cur.execute('RELEASE SAVEPOINT customer_search')
+        except Exception as e:
+            cur.execute('ROLLBACK TO SAVEPOINT customer_search')
+            logger.warning(f"pg_trgm unavailable, customer search will scan: {e}")
+        return
+    try:
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5 "
+                    "(name, phone, email, content='', prefix='2 3')")
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 unavailable, customer search will scan: {e}")
+        return
+    cur.execute('CREATE TABLE IF NOT EXISTS customer_search_keys '
+                '(search_id INTEGER PRIMARY KEY, customer_id TEXT NOT NULL UNIQUE)')
+    for trigger in CUSTOMER_FTS_TRIGGERS:
+        cur.execute(trigger)
+    cur.execute('INSERT INTO customer_search_keys (customer_id) SELECT id FROM customers')
+    cur.execute(f"INSERT INTO customers_fts (rowid, name, phone, email) "
+                f"SELECT k.search_id, {CUSTOMER_FTS_VALUES.format('c')} "
+                f"FROM customers c JOIN customer_search_keys k ON k.customer_id = c.id")
+
+def rebuild_customer_search_index(cur, is_postgres):
+    """Migration step: recreate the SQLite FTS index keyed on customer_search_keys rather
+    than the implicit customers rowid"""
+    if is_postgres:
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        cur.execute(f'DROP TRIGGER IF EXISTS customers_fts_{trigger}')
+    cur.execute('DROP TABLE IF EXISTS customers_fts')
+    cur.execute('DROP TABLE IF EXISTS customer_search_keys')
+    create_customer_search_index(cur, is_postgres)
+
+def customer_search_indexed(cur, is_postgres):
+    """Whether the trigram index / FTS table exists; checked once per worker"""
+    global _customer_search_indexed
+    if _customer_search_indexed is None:
+        if is_postgres:
+            cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        else:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customers_fts'")
+        _customer_search_indexed = cur.fetchone() is not None
+    return _customer_search_indexed
+
+def customer_search_terms(q):
+    """Lowercased search words; phone-like input collapses to its digits"""
+    if re.fullmatch(r'[\d\s()+.-]+', q) and any(ch.isdigit() for ch in q):
+        return [re.sub(r'\D', '', q)]
+    return re.findall(r'\w+', q.lower())
+
+def find_customers(cur, is_postgres, q, limit):
+    """Best matches first: name prefixes, then closeness, then the busiest customers"""
+    terms = customer_search_terms(q)
+    if not terms:
+        return []
+    indexed = customer_search_indexed(cur, is_postgres)
+    if not is_postgres and indexed:
+        match = ' '.join('"' + term + '"*' for term in terms)
+        cur.execute(f'''
+            SELECT {CUSTOMER_SEARCH_COLUMNS} FROM customers_fts f
+            JOIN customer_search_keys k ON k.search_id = f.rowid
+            JOIN customers c ON c.id = k.customer_id
+            WHERE customers_fts MATCH ?
+            ORDER BY bm25(customers_fts, 10.0, 5.0, 1.0), c.total_orders DESC, c.id
+            LIMIT ?
+        ''', (match, limit))
+        return [dict(row) for row in cur.fetchall()]
+    
+    text = CUSTOMER_SEARCH_TEXT[is_postgres]
+    where = ' AND '.join([f'{text} LIKE ?'] * len(terms))
+    params = ['%' + term + '%' for term in terms]
+    order = 'CASE WHEN LOWER(c.name) LIKE ? THEN 0 ELSE 1 END'
+    params.append(terms[0] + '%')
+    if is_postgres and indexed:
+        order += f', similarity({text}, ?) DESC'
+        params.append(' '.join(terms))
+    run_sql(cur, is_postgres, f'''
+        SELECT {CUSTOMER_SEARCH_COLUMNS} FROM customers c
+        WHERE {where}
+        ORDER BY {order}, c.total_orders DESC, c.id
+        LIMIT ?
+    ''', params + [limit])
+    return [dict(row) for row in cur.fetchall()]
+
+# ===== Order Search =====
+# One order_search row per order and completed order, holding the searchable text: order
+# number, customer name and phone digits, item names and notes. The write paths keep it in
+# step (index_orders / unindex_orders). Postgres ranks a weighted tsvector generated from
+# those columns; SQLite keeps an external-content FTS5 table over it with triggers, keyed on
+# an explicit INTEGER PRIMARY KEY because VACUUM may renumber implicit rowids.
+ORDER_SEARCH_SOURCES = {'orders': 'order_items', 'order_history': 'order_history_items'}
+ORDER_SEARCH_SCOPES = {'all': ('orders', 'order_history'), 'orders': ('orders',), 'history': ('order_history',)}
+ORDER_SEARCH_DEFAULT_LIMIT = 20
+ORDER_SEARCH_MAX_LIMIT = 100
+ORDER_SEARCH_PHONE = {
+    True: r"REGEXP_REPLACE(COALESCE(o.customer_phone, ''), '\D', '', 'g')",
+    False: sqlite_digits("COALESCE(o.customer_phone, '')")
+}
+ORDER_SEARCH_ITEM_NAMES = {True: "STRING_AGG(i.name, ' ' ORDER BY i.position)", False: "GROUP_CONCAT(i.name, ' ')"}
+ORDER_SEARCH_DOCUMENT = '''(
+    setweight(to_tsvector('simple', COALESCE(order_number, '') || ' ' || COALESCE(customer, '')), 'A') ||
+    setweight(to_tsvector('simple', COALESCE(items, '')), 'B') ||
+    setweight(to_tsvector('simple', COALESCE(notes, '')), 'C')
+)'''
+ORDER_SEARCH_TABLE = {
+    'postgres': '''CREATE TABLE IF NOT EXISTS order_search (
+        source TEXT NOT NULL,
+        order_id TEXT NOT NULL,
+        created_at TEXT,
+        order_number TEXT,
+        customer TEXT,
+        items TEXT,
+        notes TEXT,
+        PRIMARY KEY (source, order_id)
+    )''',
+    'sqlite': '''CREATE TABLE IF NOT EXISTS order_search (
+        search_id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        order_id TEXT NOT NULL,
+        created_at TEXT,
+        order_number TEXT,
+        customer TEXT,
+        items TEXT,
+        notes TEXT,
+        UNIQUE (source, order_id)
+    )'''
+}
+ORDER_SEARCH_FTS_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS order_search_fts_insert AFTER INSERT ON order_search BEGIN
+        INSERT INTO order_search_fts (rowid, order_number, customer, items, notes)
+        VALUES (new.search_id, new.order_number, new.customer, new.items, new.notes);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS order_search_fts_delete AFTER DELETE ON order_search BEGIN
+        INSERT INTO order_search_fts (order_search_fts, rowid, order_number, customer, items, notes)
+        VALUES ('delete', old.search_id, old.order_number, old.customer, old.items, old.notes);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS order_search_fts_update AFTER UPDATE ON order_search BEGIN
+        INSERT INTO order_search_fts (order_search_fts, rowid, order_number, customer, items, notes)
+        VALUES ('delete', old.search_id, old.order_number, old.customer, old.items, old.notes);
+        INSERT INTO order_search_fts (rowid, order_number, customer, items, notes)
+        VALUES (new.search_id, new.order_number, new.customer, new.items, new.notes);
+    END''',
+]
+
+_order_search_indexed = None
+
+def create_order_search_index(cur, is_postgres):
+    """Migration step: the generated tsvector and its GIN index on Postgres, the FTS5 table
+    and its triggers on SQLite"""
+    if is_postgres:
+        cur.execute(f'ALTER TABLE order_search ADD COLUMN IF NOT EXISTS document TSVECTOR '
+                    f'GENERATED ALWAYS AS {ORDER_SEARCH_DOCUMENT} STORED')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_order_search_document ON order_search USING GIN (document)')
+        return
+    try:
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS order_search_fts USING fts5 "
+                    "(order_number, customer, items, notes, content='order_search', content_rowid='search_id', prefix='2 3')")
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 unavailable, order search will scan: {e}")
+        return
+    for trigger in ORDER_SEARCH_FTS_TRIGGERS:
+        cur.execute(trigger)
+
+def rebuild_order_search_index(cur, is_postgres):
+    """Migration step: recreate the SQLite search table with its integer key and refill it"""
+    if is_postgres:
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        cur.execute(f'DROP TRIGGER IF EXISTS order_search_fts_{trigger}')
+    cur.execute('DROP TABLE IF EXISTS order_search_fts')
+    cur.execute('DROP TABLE IF EXISTS order_search')
+    cur.execute(ORDER_SEARCH_TABLE['sqlite'])
+    create_order_search_index(cur, is_postgres)
+    rebuild_order_search(cur, is_postgres)
+
+def index_orders(cur, is_postgres, source, ids=None):
+    """(Re)write the search rows for these orders of source, or for all of them"""
+    if ids is not None and not ids:
+        return
+    where = f"o.id IN ({', '.join('?' * len(ids))})" if ids is not None else 'TRUE'
+    run_sql(cur, is_postgres, f'''
+        INSERT INTO order_search (source, order_id, created_at, order_number, customer, items, notes)
+        SELECT '{source}', o.id, o.created_at, o.order_id,
+               o.customer_name || ' ' || {ORDER_SEARCH_PHONE[is_postgres]},
+               (SELECT {ORDER_SEARCH_ITEM_NAMES[is_postgres]} FROM {ORDER_SEARCH_SOURCES[source]} i WHERE i.order_id = o.id),
+               o.notes
+        FROM {source} o WHERE {where}
+        ON CONFLICT (source, order_id) DO UPDATE SET
+            created_at = excluded.created_at, order_number = excluded.order_number,
+            customer = excluded.customer, items = excluded.items, notes = excluded.notes
+    ''', tuple(ids or ()))
+
+def unindex_orders(cur, is_postgres, source, ids):
+    run_sql(cur, is_postgres, f"DELETE FROM order_search WHERE source = ? AND order_id IN ({', '.join('?' * len(ids))})",
+            (source, *ids))
+
+def rebuild_order_search(cur, is_postgres, sources=tuple(ORDER_SEARCH_SOURCES)):
+    """Recompute the search rows of these sources from the order tables"""
+    for source in sources:
+        run_sql(cur, is_postgres, 'DELETE FROM order_search WHERE source = ?', (source,))
+        index_orders(cur, is_postgres, source)
+
+def order_search_indexed(cur, is_postgres):
+    """Whether SQLite has the FTS table; Postgres always has its tsvector"""
+    global _order_search_indexed
+    if _order_search_indexed is None:
+        if is_postgres:
+            _order_search_indexed = True
+        else:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_search_fts'")
+            _order_search_indexed = cur.fetchone() is not None
+    return _order_search_indexed
+
+def find_orders(cur, is_postgres, q, sources, limit, offset):
+    """(source, id) of matching orders, best match first and newest among equals"""
+    terms = customer_search_terms(q)
+    if not terms:
+        return []
+    source_list = ', '.join('?' * len(sources))
+    if is_postgres:
+        run_sql(cur, is_postgres, f'''
+            SELECT s.source, s.order_id FROM order_search s, to_tsquery('simple', ?) query
+            WHERE s.document @@ query AND s.source IN ({source_list})
+            ORDER BY ts_rank(s.document, query) DESC, s.created_at DESC, s.order_id
+            LIMIT ? OFFSET ?
+        ''', (' & '.join(term + ':*' for term in terms), *sources, limit, offset))
+    elif order_search_indexed(cur, is_postgres):
+        cur.execute(f'''
+            SELECT s.source, s.order_id FROM order_search_fts f
+            JOIN order_search s ON s.search_id = f.rowid
+            WHERE order_search_fts MATCH ? AND s.source IN ({source_list})
+            ORDER BY bm25(order_search_fts, 10.0, 10.0, 5.0, 1.0), s.created_at DESC, s.order_id
+            LIMIT ? OFFSET ?
+        ''', (' '.join('"' + term + '"*' for term in terms), *sources, limit, offset))
+    else:
+        text = "LOWER(COALESCE(order_number, '') || ' ' || customer || ' ' || COALESCE(items, '') || ' ' || COALESCE(notes, ''))"
+        cur.execute(f'''
+            SELECT source, order_id FROM order_search
+            WHERE {' AND '.join([f'{text} LIKE ?'] * len(terms))} AND source IN ({source_list})
+            ORDER BY created_at DESC, order_id
+            LIMIT ? OFFSET ?
+        ''', (*['%' + term + '%' for term in terms], *sources, limit, offset))
+    return [(row['source'], row['order_id']) for row in cur.fetchall()]
+
+# ===== Daily Sales Rollup =====
+# One row per local day of completed orders, kept in step with order_history so period
+# reports read a few hundred rows instead of the whole history. Days follow
+# ANALYTICS_TIMEZONE; run `flask --app app rebuild-daily-sales` after changing it.
+ANALYTICS_TIMEZONE = os.environ.get('ANALYTICS_TIMEZONE', 'America/Chicago')
+
+def utc_now():
+    """Timestamp for a stored created_at/updated_at/delivered_at, always in UTC"""
+    return datetime.now(timezone.utc).isoformat()
+
+def shop_today():
+    """Today's date in ANALYTICS_TIMEZONE, where the shop's days start and end"""
+    return datetime.now(ZoneInfo(ANALYTICS_TIMEZONE)).date()
+
+def to_utc(value):
+    """A client-sent ISO timestamp converted to UTC (naive values are taken as UTC),
+    or None if it isn't one"""
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat()
+
+def local_day(bucket, tz):
+    """Local date for a grouped timestamp prefix. Date-only values are already local;
+    timestamps are UTC (utc_now() on the server, client values converted by to_utc()).
+    Rows written before timestamps carried an offset are read as UTC too."""
+    if len(bucket) == 10:
+        return date.fromisoformat(bucket)
+    hour = datetime.strptime(f'{bucket[:10]} {bucket[11:13]}', '%Y-%m-%d %H').replace(tzinfo=timezone.utc)
+    return hour.astimezone(tz).date()
+
+DAILY_SALES_UPSERT = '''
+    INSERT INTO daily_sales (sale_date, orders, revenue, discount, units) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (sale_date) DO UPDATE SET
+        orders = daily_sales.orders + excluded.orders,
+        revenue = daily_sales.revenue + excluded.revenue,
+        discount = daily_sales.discount + excluded.discount,
+        units = daily_sales.units + excluded.units
+'''
+
+# Completed orders with their sale time and units sold
+SOLD_ORDERS = '''
+    SELECT COALESCE(h.delivered_at, h.created_at) AS sold_at, h.total, h.discount,
+           (SELECT COALESCE(SUM(i.quantity), 0) FROM order_history_items i WHERE i.order_id = h.id) AS units
+    FROM order_history h
+'''
+
+def record_daily_sales(cur, is_postgres, history_id, sign=1):
+    """Add a completed order to its day in daily_sales, or take it off again with sign=-1"""
+    run_sql(cur, is_postgres, f'{SOLD_ORDERS} WHERE h.id = ?', (history_id,))
+    row = cur.fetchone()
+    if not row or not row['sold_at']:
+        return
+    try:
+        day = local_day(row['sold_at'][:13], ZoneInfo(ANALYTICS_TIMEZONE))
+    except ValueError:
+        return
+    run_sql(cur, is_postgres, DAILY_SALES_UPSERT,
+            (day.isoformat(), sign, sign * float(row['total'] or 0),
+             sign * float(row['discount'] or 0), sign * float(row['units'] or 0)))
+
+def rebuild_daily_sales(cur, is_postgres):
+    """Recompute daily_sales from order_history"""
+    cur.execute(f'''
+        SELECT SUBSTR(sold_at, 1, 13) AS bucket, COUNT(*) AS orders, SUM(total) AS revenue,
+               SUM(discount) AS discount, SUM(units) AS units
+        FROM ({SOLD_ORDERS}) sold
+        WHERE sold_at IS NOT NULL
+        GROUP BY SUBSTR(sold_at, 1, 13)
+    ''')
+    tz, days = ZoneInfo(ANALYTICS_TIMEZONE), {}
+    for row in cur.fetchall():
+        try:
+            day = local_day(row['bucket'], tz).isoformat()
+        except ValueError:
+            continue
+        totals = days.setdefault(day, [0, 0.0, 0.0, 0.0])
+        totals[0] += row['orders']
+        totals[1] += float(row['revenue'] or 0)
+        totals[2] += float(row['discount'] or 0)
+        totals[3] += float(row['units'] or 0)
+    cur.execute('DELETE FROM daily_sales')
+    if days:
+        insert_many(cur, is_postgres, 'daily_sales', ('sale_date', 'orders', 'revenue', 'discount', 'units'),
+                    [(day, *totals) for day, totals in days.items()])
+
+# ===== Grocery Usage =====
+GROCERY_USAGE_FIELDS = ('used_date', 'used_by', 'purpose', 'notes')
+
+CONSUMPTION_UPSERT = '''
+    INSERT INTO grocery_consumption (grocery_id, purpose, uses, quantity, last_used) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (grocery_id, purpose) DO UPDATE SET
+        uses = grocery_consumption.uses + excluded.uses,
+        quantity = grocery_consumption.quantity + excluded.quantity,
+        last_used = CASE WHEN grocery_consumption.last_used IS NULL OR excluded.last_used > grocery_consumption.last_used
+                         THEN excluded.last_used ELSE grocery_consumption.last_used END
+'''
+
+def record_consumption(cur, is_postgres, usages, sign=1):
+    """Add usage rows to the per-grocery, per-purpose totals, or take them off with sign=-1"""
+    if sign > 0:
+        run_sql_many(cur, is_postgres, CONSUMPTION_UPSERT, [
+            (u['grocery_id'], u.get('purpose') or '', 1, float(u['quantity_used']), u.get('used_date') or u.get('created_at'))
+            for u in usages])
+    else:
+        run_sql_many(cur, is_postgres, '''
+            UPDATE grocery_consumption SET uses = uses - 1, quantity = quantity - ?
+            WHERE grocery_id = ? AND purpose = ?
+        ''', [(float(u['quantity_used']), u['grocery_id'], u.get('purpose') or '') for u in usages])
+        cur.execute('DELETE FROM grocery_consumption WHERE uses <= 0')
+
+def apply_grocery_usage(cur, is_postgres, usages, now):
+    """Record usage rows and take each grocery's total off its quantity, only where enough
+    is left. Returns shortages; when there are any the caller rolls back."""
+    wanted = {}
+    for usage in usages:
+        wanted[usage['grocery_id']] = wanted.get(usage['grocery_id'], 0) + usage['quantity_used']
+    short = guarded_decrement(cur, is_postgres, 'grocery', 'quantity', wanted)
+    if short:
+        return [{'groceryId': grocery_id, 'requested': wanted[grocery_id], 'available': available}
+                for grocery_id, available in short.items()]
+    
+    ids = list(wanted)
+    run_sql(cur, is_postgres, f"UPDATE grocery SET updated_at = ? WHERE id IN ({', '.join('?' * len(ids))})",
+            [now] + ids)
+    for usage in usages:
+        usage['id'] = generate_id()
+        usage['created_at'] = now
+    insert_many(cur, is_postgres, 'grocery_usage',
+                ('id', 'grocery_id', 'quantity_used', 'used_date', 'used_by', 'purpose', 'notes', 'created_at'),
+                [(u['id'], u['grocery_id'], u['quantity_used'], u.get('used_date'), u.get('used_by'),
+                  u.get('purpose'), u.get('notes'), now) for u in usages])
+    record_consumption(cur, is_postgres, usages)
+    return []
+
+def rebuild_grocery_consumption(cur, is_postgres):
+    """Recompute grocery_consumption from grocery_usage"""
+    cur.execute('DELETE FROM grocery_consumption')
+    cur.execute('''
+        INSERT INTO grocery_consumption (grocery_id, purpose, uses, quantity, last_used)
+        SELECT u.grocery_id, COALESCE(u.purpose, ''), COUNT(*), SUM(u.quantity_used), MAX(COALESCE(u.used_date, u.created_at))
+        FROM grocery_usage u JOIN grocery g ON g.id = u.grocery_id
+        GROUP BY u.grocery_id, COALESCE(u.purpose, '')
+    ''')
+
+# ===== Recipe Costing =====
+# Ingredients are priced from the latest purchase of the grocery item with the same name
+# (case-insensitive): its cost over the quantity bought, i.e. what is left plus what has
+# been used. Per-recipe breakdowns are memoized and tagged with the grocery names they
+# read, so a grocery write only recomputes the recipes that use it.
+UNIT_FACTORS = {
+    'mg': ('g', 0.001), 'g': ('g', 1), 'gm': ('g', 1), 'gms': ('g', 1), 'gram': ('g', 1), 'grams': ('g', 1),
+    'kg': ('g', 1000), 'kgs': ('g', 1000),
+    'ml': ('ml', 1), 'l': ('ml', 1000), 'lt': ('ml', 1000), 'ltr': ('ml', 1000),
+    'litre': ('ml', 1000), 'liter': ('ml', 1000), 'litres': ('ml', 1000), 'liters': ('ml', 1000),
+    'pc': ('pcs', 1), 'pcs': ('pcs', 1), 'piece': ('pcs', 1), 'pieces': ('pcs', 1), 'nos': ('pcs', 1)
+}
+
+def parse_amount(text):
+    """'500 g' -> (500.0, 'g'), '1.5kg' -> (1500.0, 'g'), '2' -> (2.0, None); None if unreadable"""
+    match = re.match(r'\s*(\d+(?:\.\d+)?)(?:\s*/\s*(\d+))?\s*([a-zA-Z]*)', str(text or ''))
+    if not match:
+        return None
+    amount = float(match[1]) / (float(match[2]) if match[2] else 1)
+    unit = match[3].lower()
+    if not unit:
+        return amount, None
+    if unit not in UNIT_FACTORS:
+        return None
+    base, factor = UNIT_FACTORS[unit]
+    return amount * factor, base
+
+def batch_units(batch_size):
+    """Units one batch makes: the leading number of the batch size ("20 jars" -> 20)"""
+    match = re.match(r'\s*(\d+(?:\.\d+)?)', batch_size or '')
+    return float(match[1]) if match and float(match[1]) > 0 else None
+
+def grocery_prices(cur, is_postgres, keys):
+    """{lowercased name: latest purchase's price per base unit} for the given grocery names"""
+    if not keys:
+        return {}
+    run_sql(cur, is_postgres, f'''
+        SELECT g.id, g.item_name, LOWER(g.item_name) AS name_key, g.unit, g.cost,
+               g.quantity + COALESCE((SELECT SUM(c.quantity) FROM grocery_consumption c WHERE c.grocery_id = g.id), 0) AS bought,
+               COALESCE(g.purchase_date, g.created_at, '') AS bought_on
+        FROM grocery g WHERE LOWER(g.item_name) IN ({', '.join('?' * len(keys))})
+    ''', list(keys))
+    prices = {}
+    for row in sorted(cur.fetchall(), key=lambda r: (r['bought_on'], r['id'])):
+        base, factor = UNIT_FACTORS.get((row['unit'] or '').lower(), (None, 1))
+        bought = float(row['bought'] or 0) * factor
+        if row['cost'] and bought > 0:
+            prices[row['name_key']] = {'groceryId': row['id'], 'base': base, 'factor': factor,
+                                       'pricePerBase': float(row['cost']) / bought}
+    return prices
+
+def cost_recipe(cur, is_postgres, recipe_id):
+    """Cost of one batch, ingredient by ingredient. Ingredients that can't be matched to a
+    grocery price in a compatible unit keep the cost entered with the recipe."""
+    run_sql(cur, is_postgres, 'SELECT id, name, batch_size FROM recipes WHERE id = ?', (recipe_id,))
+    recipe = cur.fetchone()
+    if not recipe:
+        return None, set()
+    run_sql(cur, is_postgres, 'SELECT name, quantity, cost FROM recipe_ingredients WHERE recipe_id = ? ORDER BY position',
+            (recipe_id,))
+    ingredients = cur.fetchall()
+    keys = {(ing['name'] or '').lower() for ing in ingredients if ing['name']}
+    prices = grocery_prices(cur, is_postgres, keys)
+    
+    lines = []
+    for ing in ingredients:
+        price = prices.get((ing['name'] or '').lower())
+        amount = parse_amount(ing['quantity'])
+        cost = None
+        if price and amount:
+            quantity, base = amount
+            if base is None:
+                # A bare number is in the grocery item's own unit
+                quantity, base = quantity * price['factor'], price['base']
+            if base == price['base']:
+                cost = quantity * price['pricePerBase']
+        lines.append({
+            'name': ing['name'],
+            'quantity': ing['quantity'],
+            'groceryId': price['groceryId'] if price else None,
+            'cost': round(cost if cost is not None else float(ing['cost'] or 0), 2),
+            'priced': cost is not None
+        })
+    
+    batch_cost = round(sum(line['cost'] for line in lines), 2)
+    units = batch_units(recipe['batch_size'])
+    return {
+        'recipeId': recipe['id'],
+        'name': recipe['name'],
+        'batchSize': recipe['batch_size'],
+        'batchCost': batch_cost,
+        'unitsPerBatch': units,
+        'unitCost': round(batch_cost / units, 4) if units else None,
+        'ingredients': lines
+    }, keys
+
+def recipe_cost(cur, is_postgres, recipe_id):
+    """Memoized cost_recipe"""
+    cache_key = ('recipe_cost', recipe_id)
+    result = query_cache.get(cache_key)
+    if result is None:
+        result, keys = cost_recipe(cur, is_postgres, recipe_id)
+        if result:
+            query_cache.set(cache_key, result, ANALYTICS_CACHE_TTL,
+                            ['recipe_costs', f'recipe:{recipe_id}'] + [f'grocery:{key}' for key in keys])
+    return result
+
+def reprice_recipes(cur, is_postgres, grocery_names):
+    """Recompute and store total_ingredient_cost for the recipes using these groceries"""
+    keys = {name.lower() for name in grocery_names if name}
+    if not keys:
+        return
+    query_cache.invalidate(*(f'grocery:{key}' for key in keys))
+    run_sql(cur, is_postgres,
+            f"SELECT DISTINCT recipe_id FROM recipe_ingredients WHERE LOWER(name) IN ({', '.join('?' * len(keys))})",
+            list(keys))
+    changed = False
+    for recipe_id in [row['recipe_id'] for row in cur.fetchall()]:
+        result = recipe_cost(cur, is_postgres, recipe_id)
+        if result:
+            run_sql(cur, is_postgres, '''
+                UPDATE recipes SET total_ingredient_cost = ?
+                WHERE id = ? AND (total_ingredient_cost IS NULL OR total_ingredient_cost <> ?)
+            ''', (result['batchCost'], recipe_id, result['batchCost']))
+            changed = changed or cur.rowcount > 0
+    if changed:
+        query_cache.invalidate('recipes')
+
+# ===== HTTP Caching & Compression =====
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'application/x-ndjson')
+
+def negotiate_encoding():
+    """Best content encoding the client accepts, or None"""
+    accepted = request.accept_encodings
+    if HAS_BROTLI and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def conditional(*tables):
+    """Strong ETag / Last-Modified for a GET route that only reads these tables.
+    A matching If-None-Match gets a 304 straight from the in-memory table versions."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            versions, last_modified = table_versions.get(tables)
+            digest = hashlib.sha1(repr((request.full_path, versions)).encode()).hexdigest()[:24]
+            # Compressed variants carry their encoding as a suffix, see compress_response()
+            candidates = [digest, f'{digest}-gzip', f'{digest}-br']
+            matched = next((tag for tag in candidates if tag in request.if_none_match), None)
+            if matched is None and not request.if_none_match and request.if_modified_since:
+                if last_modified <= request.if_modified_since:
+                    matched = digest
+            if matched is not None:
+                response = app.response_class(status=304)
+                response.set_etag(matched)
+                response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'no-cache'
+                response.vary.add('Accept-Encoding')
+                return response
+            
+            response = app.make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                encoding = response.headers.get('Content-Encoding')
+                response.set_etag(f'{digest}-{encoding}' if encoding else digest)
+                response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli-compress sizeable text responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+# ===== Schema Migrations =====
+# Ordered, idempotent migrations: (version, description, steps). A step is either a
+# SQL string shared by both dialects, a {'postgres': ..., 'sqlite': ...} dict, or a
+# callable taking (cur, is_postgres) for data backfills.
+def add_column(table, column, definition):
+    """Migration step: ALTER TABLE ... ADD COLUMN, skipped when the column already exists"""
+    def step(cur, is_postgres):
+        if is_postgres:
+            cur.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}')
+            return
+        # SQLite has no ADD COLUMN IF NOT EXISTS
+        cur.execute(f'PRAGMA table_info({table})')
+        if column not in {row['name'] for row in cur.fetchall()}:
+            cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+def seed_sample_data(cur, is_postgres):
+    """Migration step: sample inventory and combos, for a database with no inventory yet"""
+    cur.execute('SELECT COUNT(*) AS count FROM inventory')
+    
+    if cur.fetchone()['count'] == 0:
+        logger.info("Adding sample inventory data")
+        now = utc_now()
         
-        cur.execute('''CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )''')
+        sample_items = [
+            ('pickle1', 'Mango Pickle (Avakaya)', 'pickles', 2.50, 5.00, 20, '90g jar', 'Traditional Telugu style mango pickle', 180),
+            ('pickle2', 'Lemon Pickle', 'pickles', 2.50, 5.00, 15, '90g jar', 'Tangy homemade lemon pickle', 180),
+            ('pickle3', 'Gongura Pickle', 'pickles', 2.50, 5.00, 15, '90g jar', 'Authentic Andhra gongura pickle', 180),
+            ('pickle4', 'Prawns Pickle', 'pickles', 3.00, 5.00, 10, '90g jar', 'Spicy prawns pickle', 90),
+            ('pickle5', 'Chicken Pickle', 'pickles', 3.00, 5.00, 10, '90g jar', 'Delicious chicken pickle', 90),
+            ('pickle6', 'Mutton Pickle', 'pickles', 3.50, 5.00, 8, '90g jar', 'Rich mutton pickle', 90),
+            ('snack1', 'Chakkalu', 'snacks', 3.00, 6.00, 25, 'packet', 'Crispy rice flour chakralu', 30),
+            ('snack2', 'Janthikalu', 'snacks', 3.00, 6.00, 25, 'packet', 'Traditional janthikalu snack', 30),
+            ('snack3', 'Boondi', 'snacks', 2.50, 5.00, 20, 'packet', 'Crispy gram flour boondi', 30),
+            ('snack4', 'Gavvalu', 'snacks', 3.00, 6.00, 20, 'packet', 'Shell shaped sweet snack', 30),
+            ('snack5', 'Gulabilu', 'snacks', 3.50, 7.00, 15, 'packet', 'Rose shaped sweet gulabilu', 30),
+            ('snack6', 'Kobbari Laddu', 'snacks', 4.00, 8.00, 15, 'packet', 'Coconut laddu', 15),
+            ('snack7', 'Ravva Laddu', 'snacks', 3.50, 7.00, 15, 'packet', 'Semolina laddu', 15),
+            ('snack8', 'Kajjikayalu', 'snacks', 4.00, 8.00, 15, 'packet', 'Sweet stuffed kajjikayalu', 15),
+        ]
         
-        # Grocery inventory table
-        cur.execute('''CREATE TABLE IF NOT EXISTS grocery (
-            id TEXT PRIMARY KEY,
-            item_name TEXT NOT NULL,
-            category TEXT NOT NULL,
-            quantity REAL NOT NULL DEFAULT 0,
-            unit TEXT DEFAULT 'kg',
-            purchase_date TEXT,
-            expiry_date TEXT,
-            purchased_by TEXT,
-            location TEXT,
-            cost REAL DEFAULT 0,
-            supplier TEXT,
-            notes TEXT,
-            created_at TEXT,
-            updated_at TEXT
-        )''')
+        insert_many(cur, is_postgres, 'inventory',
+                    ('id', 'name', 'category', 'cost_price', 'selling_price', 'stock', 'unit', 'description', 'shelf_life', 'created_at'),
+                    [(*item, now) for item in sample_items], key=('id',))
         
-        # Grocery usage tracking table
-        cur.execute('''CREATE TABLE IF NOT EXISTS grocery_usage (
-            id TEXT PRIMARY KEY,
-            grocery_id TEXT NOT NULL,
-            quantity_used REAL NOT NULL,
-            used_date TEXT,
-            used_by TEXT,
-            purpose TEXT,
-            notes TEXT,
-            created_at TEXT
-        )''')
+        # Add default combos
+        combos = [
+            ('combo1', 'Any 4 Items Combo', 'Choose any 4 items from our snacks collection!', 22.00, '[]', 24.00, 2.00),
+            ('combo2', 'Any 2 Items Combo', 'Choose any 2 items from our snacks collection!', 15.00, '[]', 12.00, 0.00),
+        ]
         
-    else:
-        # SQLite syntax
-        cur.execute('''CREATE TABLE IF NOT EXISTS inventory (
+        insert_many(cur, is_postgres, 'combos',
+                    ('id', 'name', 'description', 'price', 'items', 'regular_total', 'savings', 'created_at'),
+                    [(*combo, now) for combo in combos], key=('id',))
+        logger.info("Sample data added")
+
+MIGRATIONS = [
+    (1, 'Create base tables', [
+        '''CREATE TABLE IF NOT EXISTS inventory (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
             category TEXT NOT NULL,
@@ -251,9 +1588,8 @@ def init_db():
             description TEXT,
             shelf_life INTEGER,
             created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS customers (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS customers (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
             phone TEXT,
@@ -264,9 +1600,8 @@ def init_db():
             total_spent REAL DEFAULT 0,
             created_at TEXT,
             last_order TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS orders (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS orders (
             id TEXT PRIMARY KEY,
             order_id TEXT,
             customer_name TEXT NOT NULL,
@@ -282,9 +1617,8 @@ def init_db():
             status TEXT DEFAULT 'pending',
             created_at TEXT,
             delivered_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS order_history (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS order_history (
             id TEXT PRIMARY KEY,
             order_id TEXT,
             customer_name TEXT NOT NULL,
@@ -300,9 +1634,8 @@ def init_db():
             status TEXT,
             created_at TEXT,
             delivered_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS combos (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS combos (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
             description TEXT,
@@ -311,9 +1644,8 @@ def init_db():
             regular_total REAL,
             savings REAL,
             created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS recipes (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS recipes (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
             category TEXT,
@@ -324,9 +1656,8 @@ def init_db():
             notes TEXT,
             total_ingredient_cost REAL DEFAULT 0,
             created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS transactions (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS transactions (
             id TEXT PRIMARY KEY,
             type TEXT NOT NULL,
             category TEXT,
@@ -334,9 +1665,8 @@ def init_db():
             date TEXT,
             description TEXT,
             created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS offers (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS offers (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
             type TEXT,
@@ -345,15 +1675,13 @@ def init_db():
             end_date TEXT,
             active INTEGER DEFAULT 1,
             created_at TEXT
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS settings (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS settings (
             key TEXT PRIMARY KEY,
             value TEXT
-        )''')
-        
+        )''',
         # Grocery inventory table
-        cur.execute('''CREATE TABLE IF NOT EXISTS grocery (
+        '''CREATE TABLE IF NOT EXISTS grocery (
             id TEXT PRIMARY KEY,
             item_name TEXT NOT NULL,
             category TEXT NOT NULL,
@@ -368,10 +1696,9 @@ def init_db():
             notes TEXT,
             created_at TEXT,
             updated_at TEXT
-        )''')
-        
+        )''',
         # Grocery usage tracking table
-        cur.execute('''CREATE TABLE IF NOT EXISTS grocery_usage (
+        '''CREATE TABLE IF NOT EXISTS grocery_usage (
             id TEXT PRIMARY KEY,
             grocery_id TEXT NOT NULL,
             quantity_used REAL NOT NULL,
@@ -380,679 +1707,1143 @@ def init_db():
             purpose TEXT,
             notes TEXT,
             created_at TEXT
-        )''')
-    
-    conn.commit()
-    conn.close()
-    
-    logger.info("Database tables created")
-    add_sample_data()
+        )''',
+        seed_sample_data,
+    ]),
+    (2, 'Add secondary indexes for hot queries', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_history_delivered_at ON order_history (delivered_at)',
+        'CREATE INDEX IF NOT EXISTS idx_customers_lower_name ON customers (LOWER(name))',
+        'CREATE INDEX IF NOT EXISTS idx_grocery_usage_grocery_id ON grocery_usage (grocery_id)',
+        'CREATE INDEX IF NOT EXISTS idx_grocery_usage_used_date ON grocery_usage (used_date, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_stock ON inventory (stock)'
+    ]),
+    (3, 'Add keyset pagination indexes', [
+        {'postgres': f"CREATE INDEX IF NOT EXISTS idx_{table}_keyset ON {table} "
+                     f"({col} {'DESC NULLS LAST' if desc else 'ASC NULLS FIRST'}, id {'DESC' if desc else 'ASC'})",
+         'sqlite': f"CREATE INDEX IF NOT EXISTS idx_{table}_keyset ON {table} ({col} {'DESC' if desc else 'ASC'}, id {'DESC' if desc else 'ASC'})"}
+        for table, (col, desc) in LIST_SORT_KEYS.items()
+    ]),
+    (4, 'Add change log for incremental sync', [
+        {'postgres': '''CREATE TABLE IF NOT EXISTS change_log (
+            seq BIGSERIAL PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_id TEXT NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )''',
+         'sqlite': '''CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id TEXT NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )'''},
+        'CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id)',
+        # Each row keeps only its latest change, so the log grows with the number of rows
+        # ever touched rather than the number of writes
+        {'postgres': '''CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM change_log WHERE table_name = TG_TABLE_NAME AND row_id = OLD.id;
+                INSERT INTO change_log (table_name, row_id, deleted) VALUES (TG_TABLE_NAME, OLD.id, 1);
+                RETURN OLD;
+            END IF;
+            DELETE FROM change_log WHERE table_name = TG_TABLE_NAME AND row_id = NEW.id;
+            INSERT INTO change_log (table_name, row_id, deleted) VALUES (TG_TABLE_NAME, NEW.id, 0);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql'''},
+        *[{'postgres': f'DROP TRIGGER IF EXISTS trg_{table}_change_log ON {table}'} for table in DATA_TABLES],
+        *[{'postgres': f'''CREATE TRIGGER trg_{table}_change_log AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION log_change()'''} for table in DATA_TABLES],
+        *[{'sqlite': f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{event.lower()} AFTER {event} ON {table} BEGIN
+            DELETE FROM change_log WHERE table_name = '{table}' AND row_id = {ref}.id;
+            INSERT INTO change_log (table_name, row_id, deleted) VALUES ('{table}', {ref}.id, {deleted});
+        END'''} for table in DATA_TABLES
+          for event, ref, deleted in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0), ('DELETE', 'OLD', 1))]
+    ]),
+    (5, 'Index change_log by table for ETag versions', [
+        'CREATE INDEX IF NOT EXISTS idx_change_log_table_seq ON change_log (table_name, seq)'
+    ]),
+    (6, 'Normalize order, combo and recipe line items', [
+        '''CREATE TABLE IF NOT EXISTS order_items (
+            order_id TEXT NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            item_id TEXT,
+            name TEXT,
+            price REAL,
+            quantity REAL,
+            total REAL,
+            weight REAL,
+            weight_display TEXT,
+            is_combo INTEGER,
+            is_manual INTEGER,
+            combo_description TEXT,
+            extra TEXT,
+            PRIMARY KEY (order_id, position)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS order_history_items (
+            order_id TEXT NOT NULL REFERENCES order_history (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            item_id TEXT,
+            name TEXT,
+            price REAL,
+            quantity REAL,
+            total REAL,
+            weight REAL,
+            weight_display TEXT,
+            is_combo INTEGER,
+            is_manual INTEGER,
+            combo_description TEXT,
+            extra TEXT,
+            PRIMARY KEY (order_id, position)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS combo_items (
+            combo_id TEXT NOT NULL REFERENCES combos (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            item_id TEXT,
+            name TEXT,
+            price REAL,
+            quantity REAL,
+            total REAL,
+            extra TEXT,
+            PRIMARY KEY (combo_id, position)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS recipe_ingredients (
+            recipe_id TEXT NOT NULL REFERENCES recipes (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT,
+            quantity TEXT,
+            cost REAL,
+            extra TEXT,
+            PRIMARY KEY (recipe_id, position)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_item_id ON order_items (item_id)',
+        'CREATE INDEX IF NOT EXISTS idx_order_history_items_item_id ON order_history_items (item_id)',
+        'CREATE INDEX IF NOT EXISTS idx_combo_items_item_id ON combo_items (item_id)',
+        'CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_lower_name ON recipe_ingredients (LOWER(name))',
+        backfill_line_items
+    ]),
+    (7, 'Add unique customer lookup key', [
+        add_column('customers', 'lookup_key', 'TEXT'),
+        backfill_customer_keys,
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_lookup_key ON customers (lookup_key)'
+    ]),
+    (8, 'Index grocery purchase dates for finance analytics', [
+        'CREATE INDEX IF NOT EXISTS idx_grocery_purchase_date ON grocery (purchase_date)'
+    ]),
+    (9, 'Add daily sales rollup', [
+        '''CREATE TABLE IF NOT EXISTS daily_sales (
+            sale_date TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            discount REAL NOT NULL DEFAULT 0,
+            units REAL NOT NULL DEFAULT 0
+        )''',
+        rebuild_daily_sales
+    ]),
+    (10, 'Index order history by creation time for item velocity', [
+        'CREATE INDEX IF NOT EXISTS idx_order_history_created_at ON order_history (created_at)'
+    ]),
+    (11, 'Index grocery expiry and quantity for alerts', [
+        'CREATE INDEX IF NOT EXISTS idx_grocery_expiry_date ON grocery (expiry_date)',
+        'CREATE INDEX IF NOT EXISTS idx_grocery_quantity ON grocery (quantity)'
+    ]),
+    (12, 'Add per-grocery, per-purpose consumption totals', [
+        '''CREATE TABLE IF NOT EXISTS grocery_consumption (
+            grocery_id TEXT NOT NULL REFERENCES grocery (id) ON DELETE CASCADE,
+            purpose TEXT NOT NULL DEFAULT '',
+            uses INTEGER NOT NULL DEFAULT 0,
+            quantity REAL NOT NULL DEFAULT 0,
+            last_used TEXT,
+            PRIMARY KEY (grocery_id, purpose)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_grocery_consumption_purpose ON grocery_consumption (purpose)',
+        rebuild_grocery_consumption
+    ]),
+    (13, 'Index grocery names for recipe costing', [
+        'CREATE INDEX IF NOT EXISTS idx_grocery_lower_item_name ON grocery (LOWER(item_name))'
+    ]),
+    (14, 'Add customer search index', [
+        create_customer_search_index
+    ]),
+    (15, 'Add order full-text search', [
+        ORDER_SEARCH_TABLE,
+        create_order_search_index,
+        rebuild_order_search
+    ]),
+    (16, 'Link orders to customers', [
+        add_column('orders', 'customer_id', 'TEXT REFERENCES customers (id) ON DELETE SET NULL'),
+        add_column('order_history', 'customer_id', 'TEXT REFERENCES customers (id) ON DELETE SET NULL'),
+        'CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders (customer_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_history_customer_id ON order_history (customer_id, created_at)',
+        backfill_order_customers,
+        reconcile_customer_stats
+    ]),
+    (17, 'Add the order number sequence', [
+        {'postgres': 'CREATE SEQUENCE IF NOT EXISTS order_number_seq'},
+        {'sqlite': 'CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)'},
+        {'sqlite': "INSERT INTO sequences (name, value) VALUES ('order_number', 0) ON CONFLICT (name) DO NOTHING"}
+    ]),
+    # Finance ranges filter on these exact expressions (FINANCE_SOURCES, SOLD_ORDERS)
+    (18, 'Index finance sale and expense dates', [
+        'CREATE INDEX IF NOT EXISTS idx_order_history_sold_at ON order_history ((COALESCE(delivered_at, created_at)))',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_spent_at ON transactions ((COALESCE(date, created_at)))'
+    ]),
+    (19, 'Key the customer search index on a stable id', [
+        rebuild_customer_search_index
+    ]),
+    (20, 'Key the order search index on a stable id', [
+        rebuild_order_search_index
+    ]),
+]
 
-def add_sample_data():
-    """Add sample inventory data if empty"""
-    conn, is_postgres = get_db()
-    cur = conn.cursor()
-    
-    if is_postgres:
-        cur.execute('SELECT COUNT(*) as count FROM inventory')
-    else:
-        cur.execute('SELECT COUNT(*) FROM inventory')
-    
-    result = cur.fetchone()
-    count = result['count'] if is_postgres else result[0]
-    
-    if count == 0:
-        logger.info("Adding sample inventory data")
-        now = datetime.now().isoformat()
-        
-        sample_items = [
-            ('pickle1', 'Mango Pickle (Avakaya)', 'pickles', 2.50, 5.00, 20, '90g jar', 'Traditional Telugu style mango pickle', 180),
-            ('pickle2', 'Lemon Pickle', 'pickles', 2.50, 5.00, 15, '90g jar', 'Tangy homemade lemon pickle', 180),
-            ('pickle3', 'Gongura Pickle', 'pickles', 2.50, 5.00, 15, '90g jar', 'Authentic Andhra gongura pickle', 180),
-            ('pickle4', 'Prawns Pickle', 'pickles', 3.00, 5.00, 10, '90g jar', 'Spicy prawns pickle', 90),
-            ('pickle5', 'Chicken Pickle', 'pickles', 3.00, 5.00, 10, '90g jar', 'Delicious chicken pickle', 90),
-            ('pickle6', 'Mutton Pickle', 'pickles', 3.50, 5.00, 8, '90g jar', 'Rich mutton pickle', 90),
-            ('snack1', 'Chakkalu', 'snacks', 3.00, 6.00, 25, 'packet', 'Crispy rice flour chakralu', 30),
-            ('snack2', 'Janthikalu', 'snacks', 3.00, 6.00, 25, 'packet', 'Traditional janthikalu snack', 30),
-            ('snack3', 'Boondi', 'snacks', 2.50, 5.00, 20, 'packet', 'Crispy gram flour boondi', 30),
-            ('snack4', 'Gavvalu', 'snacks', 3.00, 6.00, 20, 'packet', 'Shell shaped sweet snack', 30),
-            ('snack5', 'Gulabilu', 'snacks', 3.50, 7.00, 15, 'packet', 'Rose shaped sweet gulabilu', 30),
-            ('snack6', 'Kobbari Laddu', 'snacks', 4.00, 8.00, 15, 'packet', 'Coconut laddu', 15),
-            ('snack7', 'Ravva Laddu', 'snacks', 3.50, 7.00, 15, 'packet', 'Semolina laddu', 15),
-            ('snack8', 'Kajjikayalu', 'snacks', 4.00, 8.00, 15, 'packet', 'Sweet stuffed kajjikayalu', 15),
-        ]
-        
-        for item in sample_items:
-            if is_postgres:
-                cur.execute('''
-                    INSERT INTO inventory (id, name, category, cost_price, selling_price, stock, unit, description, shelf_life, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO NOTHING
-                ''', (*item, now))
-            else:
-                cur.execute('''
-                    INSERT OR IGNORE INTO inventory (id, name, category, cost_price, selling_price, stock, unit, description, shelf_life, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (*item, now))
-        
-        # Add default combos
-        combos = [
-            ('combo1', 'Any 4 Items Combo', 'Choose any 4 items from our snacks collection!', 22.00, '[]', 24.00, 2.00),
-            ('combo2', 'Any 2 Items Combo', 'Choose any 2 items from our snacks collection!', 15.00, '[]', 12.00, 0.00),
-        ]
-        
-        for combo in combos:
-            if is_postgres:
-                cur.execute('''
-                    INSERT INTO combos (id, name, description, price, items, regular_total, savings, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO NOTHING
-                ''', (*combo, now))
-            else:
-                cur.execute('''
-                    INSERT OR IGNORE INTO combos (id, name, description, price, items, regular_total, savings, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (*combo, now))
-        
-        conn.commit()
-        logger.info("Sample data added")
+def apply_migration_step(cur, step, is_postgres):
+    if callable(step):
+        step(cur, is_postgres)
+    elif isinstance(step, dict):
+        sql = step.get('postgres' if is_postgres else 'sqlite')
+        if sql:
+            cur.execute(sql)
+    else:
+        cur.execute(step)
+
+def run_migrations():
+    """Apply any migrations newer than the recorded schema version"""
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    
+    cur.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT
+    )''')
+    conn.commit()
+    
+    cur.execute('SELECT version FROM schema_version')
+    done = {row['version'] for row in cur.fetchall()}
+    conn.commit()
     
-    conn.close()
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version in done:
+            continue
+        if not is_postgres:
+            # An explicit transaction, since the sqlite3 module autocommits DDL outside one
+            # and a failed migration would stay half-applied. EXCLUSIVE also serializes
+            # processes sharing the file, as the advisory lock does on Postgres.
+            cur.execute('BEGIN EXCLUSIVE')
+        # Another process may have applied it while this one waited for the lock
+        if run_sql(cur, is_postgres, 'SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+            conn.commit()
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        try:
+            for step in steps:
+                apply_migration_step(cur, step, is_postgres)
+            run_sql(cur, is_postgres, 'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, utc_now()))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Migration {version} failed: {e}")
+            raise
+        applied.append(version)
+    
+    return applied
+
+# ===== Database Bootstrap =====
+# The schema is brought up to date once per deployment by `flask --app app db upgrade`, run
+# before gunicorn starts. A worker only checks the recorded version on its first request
+# and bootstraps itself if the command didn't run. Concurrent workers serialize on an
+# advisory lock (Postgres) or an exclusive transaction per migration (SQLite), so each
+# migration is applied once. Sample data is the last step of migration 1: only the bootstrap
+# that creates the schema seeds it, and emptying the inventory later never brings it back.
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+SCHEMA_LOCK_ID = 900001  # pg_advisory_lock key, any constant unique to this app
+SCHEMA_LOCK_TIMEOUT_MS = 60000  # how long a SQLite worker waits for another's migrations
+
+_db_ready = False
+_db_ready_lock = threading.Lock()
+
+def schema_version():
+    """Newest applied migration, 0 for an empty database"""
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT MAX(version) AS version FROM schema_version')
+        return cur.fetchone()['version'] or 0
+    except Exception:
+        # No schema_version table yet
+        conn.rollback()
+        return 0
+
+def init_db():
+    """Apply pending migrations, seeding sample data into a new database"""
+    logger.info(f"init_db called - using PostgreSQL: {USE_POSTGRES}")
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    if is_postgres:
+        cur.execute('SELECT pg_advisory_lock(%s)', (SCHEMA_LOCK_ID,))
+    else:
+        # Wait out another process's migrations instead of failing after the usual busy timeout
+        cur.execute(f'PRAGMA busy_timeout = {SCHEMA_LOCK_TIMEOUT_MS}')
+    try:
+        applied = run_migrations()
+        logger.info(f"Database schema up to date ({len(applied)} migrations applied)")
+    finally:
+        if is_postgres:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (SCHEMA_LOCK_ID,))
+            conn.commit()
+        else:
+            cur.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+
+@app.before_request
+def ensure_database():
+    """Bootstrap the schema on this worker's first API request; afterwards a no-op"""
+    global _db_ready
+    if _db_ready or not request.path.startswith('/api/'):
+        return
+    with _db_ready_lock:
+        if not _db_ready:
+            if schema_version() < SCHEMA_VERSION:
+                init_db()
+            _db_ready = True
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Readiness probe: 200 once the schema is at this release's version"""
+    version = schema_version()
+    ready = version >= SCHEMA_VERSION
+    return jsonify({'ready': ready, 'schemaVersion': version, 'expectedVersion': SCHEMA_VERSION}), 200 if ready else 503
+
+# ===== IDs =====
+# ULID-style ids: a 48-bit millisecond timestamp, a 32-bit per-worker counter and 48 random
+# bits, written as 26 lowercase Crockford base32 characters. They sort by creation time, so
+# inserts land at the right edge of the primary-key B-tree, and the counter keeps ids from one
+# worker strictly increasing within a millisecond without taking a lock.
+ID_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+_id_counter = itertools.count(int.from_bytes(secrets.token_bytes(4), 'big'))
 
 def generate_id():
-    import random
-    import string
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=12))
+    value = (time.time_ns() // 1_000_000) << 80
+    value |= (next(_id_counter) & 0xFFFFFFFF) << 48
+    value |= int.from_bytes(secrets.token_bytes(6), 'big')
+    chars = []
+    for _ in range(26):
+        value, digit = divmod(value, 32)
+        chars.append(ID_ALPHABET[digit])
+    return ''.join(reversed(chars))
 
-# ===== Static Files =====
-@app.route('/')
-def index():
-    return send_file('index.html')
+def next_order_number(cur, is_postgres):
+    """The next human-facing order number (ORD-00042) from the database's sequence"""
+    if is_postgres:
+        cur.execute("SELECT nextval('order_number_seq') AS value")
+    else:
+        cur.execute("UPDATE sequences SET value = value + 1 WHERE name = 'order_number' RETURNING value")
+    return f"ORD-{cur.fetchone()['value']:05d}"
 
-@app.route('/<path:path>')
-def serve_static(path):
-    return send_from_directory('.', path)
+# ===== Static Files =====
+register_assets(app)
 
 # ===== Inventory API =====
 @app.route('/api/inventory', methods=['GET'])
+@conditional('inventory')
 def get_inventory():
-    items = execute_query('SELECT * FROM inventory ORDER BY name', fetch=True)
-    return jsonify(items)
+    items, next_cursor = query_list('inventory')
+    return list_response(items, next_cursor)
 
 @app.route('/api/inventory', methods=['POST'])
+@invalidates('inventory')
 def add_inventory_item():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     item_id = data.get('id') or generate_id()
-    now = datetime.now().isoformat()
+    now = utc_now()
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO inventory (id, name, category, cost_price, selling_price, stock, unit, description, shelf_life, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                name = EXCLUDED.name, category = EXCLUDED.category, cost_price = EXCLUDED.cost_price,
-                selling_price = EXCLUDED.selling_price, stock = EXCLUDED.stock, unit = EXCLUDED.unit,
-                description = EXCLUDED.description, shelf_life = EXCLUDED.shelf_life
-        ''', (item_id, data['name'], data['category'], data['costPrice'], data['sellingPrice'],
-              data['stock'], data.get('unit', 'pcs'), data.get('description', ''), data.get('shelfLife'), now))
-    else:
-        cur.execute('''
-            INSERT OR REPLACE INTO inventory (id, name, category, cost_price, selling_price, stock, unit, description, shelf_life, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (item_id, data['name'], data['category'], data['costPrice'], data['sellingPrice'],
-              data['stock'], data.get('unit', 'pcs'), data.get('description', ''), data.get('shelfLife'), now))
+    upsert(cur, is_postgres, 'inventory', {
+        'id': item_id, 'name': data['name'], 'category': data['category'], 'cost_price': data['costPrice'],
+        'selling_price': data['sellingPrice'], 'stock': data['stock'], 'unit': data.get('unit', 'pcs'),
+        'description': data.get('description', ''), 'shelf_life': data.get('shelfLife'), 'created_at': now
+    }, update=('name', 'category', 'cost_price', 'selling_price', 'stock', 'unit', 'description', 'shelf_life'))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': item_id})
 
 @app.route('/api/inventory/<item_id>', methods=['DELETE'])
+@invalidates('inventory')
 def delete_inventory_item(item_id):
     execute_query('DELETE FROM inventory WHERE id = ?', (item_id,), commit=True)
     return jsonify({'success': True})
 
 @app.route('/api/inventory/<item_id>/stock', methods=['PUT'])
+@invalidates('inventory')
 def update_stock(item_id):
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
-    if is_postgres:
-        cur.execute('UPDATE inventory SET stock = stock + %s WHERE id = %s', (data['change'], item_id))
-    else:
-        cur.execute('UPDATE inventory SET stock = stock + ? WHERE id = ?', (data['change'], item_id))
+    run_sql(cur, is_postgres, 'UPDATE inventory SET stock = stock + ? WHERE id = ?', (data['change'], item_id))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True})
 
 # ===== Customers API =====
 @app.route('/api/customers', methods=['GET'])
+@conditional('customers')
 def get_customers():
-    customers = execute_query('SELECT * FROM customers ORDER BY total_spent DESC', fetch=True)
-    return jsonify(customers)
+    customers, next_cursor = query_list('customers')
+    return list_response(customers, next_cursor)
+
+@app.route('/api/customers/search', methods=['GET'])
+@conditional('customers')
+def search_customers():
+    """Top ?limit= customers whose name, phone or email matches ?q=, best match first.
+    Orders are matched to existing customers by lookup_key, not through this search."""
+    q = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', CUSTOMER_SEARCH_DEFAULT_LIMIT)), 1), CUSTOMER_SEARCH_MAX_LIMIT)
+    except ValueError:
+        raise InvalidRequest('limit must be a number')
+    
+    conn, is_postgres = get_db()
+    rows = find_customers(conn.cursor(), is_postgres, q, limit)
+    return jsonify({'success': True, 'query': q, 'results': rows})
+
+CUSTOMER_ORDERS_DEFAULT_LIMIT = 20
+CUSTOMER_ORDERS_MAX_LIMIT = 200
+
+@app.route('/api/customers/<customer_id>/orders', methods=['GET'])
+@conditional('customers', 'orders', 'order_history')
+def get_customer_orders(customer_id):
+    """A customer's most recent active and completed orders, newest first, with their totals"""
+    try:
+        limit = min(max(int(request.args.get('limit', CUSTOMER_ORDERS_DEFAULT_LIMIT)), 1), CUSTOMER_ORDERS_MAX_LIMIT)
+    except ValueError:
+        raise InvalidRequest('limit must be a number')
+    customer = execute_query('SELECT * FROM customers WHERE id = ?', (customer_id,), fetchone=True)
+    if customer is None:
+        return jsonify({'success': False, 'error': 'Customer not found'}), 404
+    
+    orders = []
+    for table, source in (('orders', 'orders'), ('order_history', 'history')):
+        rows = execute_query(f'SELECT * FROM {table} WHERE customer_id = ? ORDER BY created_at DESC LIMIT ?',
+                             (customer_id, limit), fetch=True)
+        for row in expand_rows(table, rows):
+            row['source'] = source
+            orders.append(row)
+    orders.sort(key=lambda row: row['created_at'] or '', reverse=True)
+    return jsonify({'success': True, 'customer': customer, 'data': orders[:limit]})
 
 @app.route('/api/customers', methods=['POST'])
+@invalidates('customers')
 def add_customer():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     customer_id = data.get('id') or generate_id()
-    now = datetime.now().isoformat()
+    now = utc_now()
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO customers (id, name, phone, email, address, notes, total_orders, total_spent, created_at, last_order)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                name = EXCLUDED.name, phone = EXCLUDED.phone, email = EXCLUDED.email,
-                address = EXCLUDED.address, notes = EXCLUDED.notes
-        ''', (customer_id, data['name'], data.get('phone', ''), data.get('email', ''),
-              data.get('address', ''), data.get('notes', ''), data.get('totalOrders', 0),
-              data.get('totalSpent', 0), now, data.get('lastOrder')))
-    else:
-        cur.execute('''
-            INSERT OR REPLACE INTO customers (id, name, phone, email, address, notes, total_orders, total_spent, created_at, last_order)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (customer_id, data['name'], data.get('phone', ''), data.get('email', ''),
-              data.get('address', ''), data.get('notes', ''), data.get('totalOrders', 0),
-              data.get('totalSpent', 0), now, data.get('lastOrder')))
+    lookup_key = customer_lookup_key(data['name'])
+    run_sql(cur, is_postgres, 'SELECT id FROM customers WHERE lookup_key = ?', (lookup_key,))
+    holder = cur.fetchone()
+    if holder and holder['id'] != customer_id:
+        # Another customer already has this name; keep this one out of order matching
+        lookup_key = None
+    
+    # An upsert rather than SQLite's INSERT OR REPLACE, whose implicit delete would skip the
+    # search index triggers
+    upsert(cur, is_postgres, 'customers', {
+        'id': customer_id, 'name': data['name'], 'phone': data.get('phone', ''), 'email': data.get('email', ''),
+        'address': data.get('address', ''), 'notes': data.get('notes', ''), 'total_orders': data.get('totalOrders', 0),
+        'total_spent': data.get('totalSpent', 0), 'created_at': now, 'last_order': data.get('lastOrder'),
+        'lookup_key': lookup_key
+    }, update=('name', 'phone', 'email', 'address', 'notes', 'lookup_key'))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': customer_id})
 
 @app.route('/api/customers/<customer_id>', methods=['DELETE'])
+@invalidates('customers')
 def delete_customer(customer_id):
     execute_query('DELETE FROM customers WHERE id = ?', (customer_id,), commit=True)
     return jsonify({'success': True})
 
 # ===== Orders API =====
 @app.route('/api/orders', methods=['GET'])
+@conditional('orders')
 def get_orders():
-    orders = execute_query('SELECT * FROM orders ORDER BY created_at DESC', fetch=True)
-    for order in orders:
-        order['items'] = json.loads(order['items']) if order['items'] else []
-    return jsonify(orders)
+    orders, next_cursor = query_list('orders')
+    expand_rows('orders', orders)
+    return list_response(orders, next_cursor)
 
 @app.route('/api/orders', methods=['POST'])
+@invalidates('orders', 'inventory', 'customers')
 def add_order():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     order_id = data.get('id') or generate_id()
-    order_number = data.get('orderId') or f"ORD-{datetime.now().strftime('%H%M%S')}"
-    now = datetime.now().isoformat()
+    now = utc_now()
     items_json = json.dumps(data.get('items', []))
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO orders (id, order_id, customer_name, customer_phone, customer_email, customer_address, items, subtotal, discount, total, deadline, notes, status, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                items = EXCLUDED.items, subtotal = EXCLUDED.subtotal, discount = EXCLUDED.discount,
-                total = EXCLUDED.total, status = EXCLUDED.status, notes = EXCLUDED.notes
-        ''', (order_id, order_number, data['customerName'], data.get('customerPhone', ''),
-              data.get('customerEmail', ''), data.get('customerAddress', ''), items_json,
-              data.get('subtotal', 0), data.get('discount', 0), data.get('total', 0),
-              data.get('deadline'), data.get('notes', ''), data.get('status', 'pending'), now))
-        
-        # Update inventory stock
-        for item in data.get('items', []):
-            if not item.get('isCombo') and not item.get('isManual'):
-                cur.execute('UPDATE inventory SET stock = stock - %s WHERE id = %s', (item['quantity'], item['itemId']))
-        
-        # Update/Create customer
-        cur.execute('SELECT * FROM customers WHERE LOWER(name) = LOWER(%s)', (data['customerName'],))
-        customer = cur.fetchone()
-        
-        if customer:
-            cur.execute('''
-                UPDATE customers SET total_orders = total_orders + 1, total_spent = total_spent + %s, last_order = %s,
-                phone = COALESCE(NULLIF(%s, ''), phone), email = COALESCE(NULLIF(%s, ''), email), address = COALESCE(NULLIF(%s, ''), address)
-                WHERE LOWER(name) = LOWER(%s)
-            ''', (data.get('total', 0), now, data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''), data['customerName']))
-        else:
-            new_customer_id = generate_id()
-            cur.execute('''
-                INSERT INTO customers (id, name, phone, email, address, total_orders, total_spent, created_at, last_order)
-                VALUES (%s, %s, %s, %s, %s, 1, %s, %s, %s)
-            ''', (new_customer_id, data['customerName'], data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''), data.get('total', 0), now, now))
+    # A re-sent order (a retried submit) already took its stock and is already counted in
+    # its customer's totals; it only replaces the stored copy
+    previous = order_stats(cur, is_postgres, 'orders', order_id)
+    
+    if previous:
+        order_number = run_sql(cur, is_postgres, 'SELECT order_id FROM orders WHERE id = ?', (order_id,)).fetchone()['order_id']
     else:
-        cur.execute('''
-            INSERT OR REPLACE INTO orders (id, order_id, customer_name, customer_phone, customer_email, customer_address, items, subtotal, discount, total, deadline, notes, status, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (order_id, order_number, data['customerName'], data.get('customerPhone', ''),
-              data.get('customerEmail', ''), data.get('customerAddress', ''), items_json,
-              data.get('subtotal', 0), data.get('discount', 0), data.get('total', 0),
-              data.get('deadline'), data.get('notes', ''), data.get('status', 'pending'), now))
-        
-        # Update inventory stock
-        for item in data.get('items', []):
-            if not item.get('isCombo') and not item.get('isManual'):
-                cur.execute('UPDATE inventory SET stock = stock - ? WHERE id = ?', (item['quantity'], item['itemId']))
-        
-        # Update/Create customer
-        cur.execute('SELECT * FROM customers WHERE LOWER(name) = LOWER(?)', (data['customerName'],))
-        customer = cur.fetchone()
-        
-        if customer:
-            cur.execute('''
-                UPDATE customers SET total_orders = total_orders + 1, total_spent = total_spent + ?, last_order = ?,
-                phone = COALESCE(NULLIF(?, ''), phone), email = COALESCE(NULLIF(?, ''), email), address = COALESCE(NULLIF(?, ''), address)
-                WHERE LOWER(name) = LOWER(?)
-            ''', (data.get('total', 0), now, data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''), data['customerName']))
-        else:
-            new_customer_id = generate_id()
-            cur.execute('''
-                INSERT INTO customers (id, name, phone, email, address, total_orders, total_spent, created_at, last_order)
-                VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
-            ''', (new_customer_id, data['customerName'], data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''), data.get('total', 0), now, now))
+        # Reserve stock first so an order that can't be filled is rejected before anything is written
+        shortages = decrement_stock(cur, is_postgres, data.get('items', []))
+        if shortages:
+            conn.rollback()
+            return jsonify({'success': False, 'error': 'Insufficient stock', 'shortages': shortages}), 409
+        order_number = data.get('orderId') or next_order_number(cur, is_postgres)
+    
+    customer_id = upsert_order_customer(cur, is_postgres, data, now)
+    
+    upsert(cur, is_postgres, 'orders', {
+        'id': order_id, 'order_id': order_number, 'customer_name': data['customerName'],
+        'customer_phone': data.get('customerPhone', ''), 'customer_email': data.get('customerEmail', ''),
+        'customer_address': data.get('customerAddress', ''), 'items': items_json,
+        'subtotal': data.get('subtotal', 0), 'discount': data.get('discount', 0), 'total': data.get('total', 0),
+        'deadline': data.get('deadline'), 'notes': data.get('notes', ''), 'status': data.get('status', 'pending'),
+        'created_at': now, 'customer_id': customer_id
+    }, update=('items', 'subtotal', 'discount', 'total', 'status', 'notes', 'customer_id'))
+    
+    write_line_items(cur, is_postgres, 'orders', 'items', order_id, data.get('items', []))
+    index_orders(cur, is_postgres, 'orders', [order_id])
+    move_customer_stats(cur, is_postgres, previous, (customer_id, float(data.get('total') or 0)))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': order_id, 'orderId': order_number})
 
 @app.route('/api/orders/<order_id>', methods=['PUT'])
+@invalidates('orders', 'customers')
 def update_order(order_id):
     data = request.json
     items_json = json.dumps(data.get('items', []))
-    now = datetime.now().isoformat()
+    now = utc_now()
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
-    if is_postgres:
-        cur.execute('''
-            UPDATE orders SET customer_name = %s, customer_phone = %s, customer_email = %s, customer_address = %s,
-            items = %s, subtotal = %s, discount = %s, total = %s, deadline = %s, notes = %s
-            WHERE id = %s
-        ''', (data['customerName'], data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''),
-              items_json, data.get('subtotal', 0), data.get('discount', 0), data.get('total', 0),
-              data.get('deadline'), data.get('notes', ''), order_id))
-    else:
-        cur.execute('''
-            UPDATE orders SET customer_name = ?, customer_phone = ?, customer_email = ?, customer_address = ?,
-            items = ?, subtotal = ?, discount = ?, total = ?, deadline = ?, notes = ?
-            WHERE id = ?
-        ''', (data['customerName'], data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''),
-              items_json, data.get('subtotal', 0), data.get('discount', 0), data.get('total', 0),
-              data.get('deadline'), data.get('notes', ''), order_id))
+    previous = order_stats(cur, is_postgres, 'orders', order_id)
+    customer_id = upsert_order_customer(cur, is_postgres, data, now) if previous else None
     
+    run_sql(cur, is_postgres, '''
+        UPDATE orders SET customer_name = ?, customer_phone = ?, customer_email = ?, customer_address = ?,
+        items = ?, subtotal = ?, discount = ?, total = ?, deadline = ?, notes = ?, customer_id = ?
+        WHERE id = ?
+    ''', (data['customerName'], data.get('customerPhone', ''), data.get('customerEmail', ''), data.get('customerAddress', ''),
+          items_json, data.get('subtotal', 0), data.get('discount', 0), data.get('total', 0),
+          data.get('deadline'), data.get('notes', ''), customer_id, order_id))
+    
+    if cur.rowcount:
+        write_line_items(cur, is_postgres, 'orders', 'items', order_id, data.get('items', []))
+        index_orders(cur, is_postgres, 'orders', [order_id])
+        move_customer_stats(cur, is_postgres, previous, (customer_id, float(data.get('total') or 0)))
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': order_id})
 
 @app.route('/api/orders/<order_id>/status', methods=['PUT'])
+@invalidates('orders', 'order_history')
 def update_order_status(order_id):
     data = request.json
     new_status = data['status']
-    # Use client's local datetime if provided, otherwise use server time
-    delivered_at = data.get('deliveredAt') or datetime.now().isoformat()
+    # The client's completion time if it sent one, stored in UTC like every other timestamp
+    delivered_at = to_utc(data.get('deliveredAt')) or utc_now()
     
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     if new_status == 'completed':
         # Move order to history when completed (delivered + payment received)
-        if is_postgres:
-            cur.execute('SELECT * FROM orders WHERE id = %s', (order_id,))
-        else:
-            cur.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
-        
-        order = cur.fetchone()
+        order = run_sql(cur, is_postgres, 'SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
         if order:
             order = dict(order)
-            
-            if is_postgres:
-                cur.execute('''
-                    INSERT INTO order_history (id, order_id, customer_name, customer_phone, customer_email, customer_address, items, subtotal, discount, total, deadline, notes, status, created_at, delivered_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (order['id'], order['order_id'], order['customer_name'], order['customer_phone'], order['customer_email'], order['customer_address'], order['items'], order['subtotal'], order['discount'], order['total'], order['deadline'], order['notes'], 'completed', order['created_at'], delivered_at))
-                cur.execute('DELETE FROM orders WHERE id = %s', (order_id,))
-            else:
-                cur.execute('''
-                    INSERT INTO order_history (id, order_id, customer_name, customer_phone, customer_email, customer_address, items, subtotal, discount, total, deadline, notes, status, created_at, delivered_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (order['id'], order['order_id'], order['customer_name'], order['customer_phone'], order['customer_email'], order['customer_address'], order['items'], order['subtotal'], order['discount'], order['total'], order['deadline'], order['notes'], 'completed', order['created_at'], delivered_at))
-                cur.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+            order.update(status='completed', delivered_at=delivered_at)
+            insert_many(cur, is_postgres, 'order_history', ORDER_HISTORY_COLUMNS,
+                        [tuple(order[col] for col in ORDER_HISTORY_COLUMNS)])
+            run_sql(cur, is_postgres, f'''
+                INSERT INTO order_history_items ({ORDER_ITEM_COLUMNS})
+                SELECT {ORDER_ITEM_COLUMNS} FROM order_items WHERE order_id = ?
+            ''', (order_id,))
+            record_daily_sales(cur, is_postgres, order_id)
+            unindex_orders(cur, is_postgres, 'orders', [order_id])
+            index_orders(cur, is_postgres, 'order_history', [order_id])
+            # Deleting the order cascades to its order_items
+            run_sql(cur, is_postgres, 'DELETE FROM orders WHERE id = ?', (order_id,))
     else:
         # Just update status (pending, processing, shipped, delivered)
-        if is_postgres:
-            cur.execute('UPDATE orders SET status = %s WHERE id = %s', (new_status, order_id))
-        else:
-            cur.execute('UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
+        run_sql(cur, is_postgres, 'UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True})
 
 @app.route('/api/orders/<order_id>', methods=['DELETE'])
+@invalidates('orders', 'customers')
 def delete_order(order_id):
-    execute_query('DELETE FROM orders WHERE id = ?', (order_id,), commit=True)
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    previous = order_stats(cur, is_postgres, 'orders', order_id)
+    unindex_orders(cur, is_postgres, 'orders', [order_id])
+    run_sql(cur, is_postgres, 'DELETE FROM orders WHERE id = ?', (order_id,))
+    move_customer_stats(cur, is_postgres, previous, None)
+    conn.commit()
     return jsonify({'success': True})
 
 # ===== Order History API =====
 @app.route('/api/history', methods=['GET'])
+@conditional('order_history')
 def get_order_history():
-    orders = execute_query('SELECT * FROM order_history ORDER BY delivered_at DESC', fetch=True)
-    for order in orders:
-        order['items'] = json.loads(order['items']) if order['items'] else []
-    return jsonify(orders)
+    orders, next_cursor = query_list('order_history')
+    expand_rows('order_history', orders)
+    return list_response(orders, next_cursor)
 
 @app.route('/api/history/<history_id>', methods=['DELETE'])
+@invalidates('order_history', 'customers')
 def delete_history(history_id):
-    execute_query('DELETE FROM order_history WHERE id = ?', (history_id,), commit=True)
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    previous = order_stats(cur, is_postgres, 'order_history', history_id)
+    record_daily_sales(cur, is_postgres, history_id, sign=-1)
+    unindex_orders(cur, is_postgres, 'order_history', [history_id])
+    run_sql(cur, is_postgres, 'DELETE FROM order_history WHERE id = ?', (history_id,))
+    move_customer_stats(cur, is_postgres, previous, None)
+    conn.commit()
     return jsonify({'success': True})
 
+# ===== Search API =====
+@app.route('/api/search', methods=['GET'])
+@conditional('orders', 'order_history')
+def search_orders():
+    """Orders and completed orders matching ?q= on order number, customer name or phone, item
+    names and notes, best match first. ?scope=all|orders|history, paged with ?limit=/?offset=."""
+    q = request.args.get('q', '').strip()
+    sources = ORDER_SEARCH_SCOPES.get(request.args.get('scope', 'all'))
+    if sources is None:
+        raise InvalidRequest(f"scope must be one of {', '.join(ORDER_SEARCH_SCOPES)}")
+    try:
+        limit = min(max(int(request.args.get('limit', ORDER_SEARCH_DEFAULT_LIMIT)), 1), ORDER_SEARCH_MAX_LIMIT)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        raise InvalidRequest('limit and offset must be numbers')
+    
+    conn, is_postgres = get_db()
+    hits = find_orders(conn.cursor(), is_postgres, q, sources, limit + 1, offset)
+    more, hits = len(hits) > limit, hits[:limit]
+    
+    found = {}
+    for source in sources:
+        ids = [order_id for hit_source, order_id in hits if hit_source == source]
+        if ids:
+            rows = execute_query(f"SELECT * FROM {source} WHERE id IN ({', '.join('?' * len(ids))})", tuple(ids), fetch=True)
+            for row in expand_rows(source, rows):
+                row['source'] = 'history' if source == 'order_history' else 'orders'
+                found[(source, row['id'])] = row
+    
+    return jsonify({
+        'success': True,
+        'query': q,
+        'data': [found[hit] for hit in hits if hit in found],
+        'nextOffset': offset + limit if more else None
+    })
+
 # ===== Combos API =====
 @app.route('/api/combos', methods=['GET'])
+@conditional('combos')
 def get_combos():
-    combos = execute_query('SELECT * FROM combos ORDER BY name', fetch=True)
-    for combo in combos:
-        combo['items'] = json.loads(combo['items']) if combo['items'] else []
-    return jsonify(combos)
+    combos, next_cursor = query_list('combos')
+    expand_rows('combos', combos)
+    return list_response(combos, next_cursor)
 
 @app.route('/api/combos', methods=['POST'])
+@invalidates('combos')
 def add_combo():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     combo_id = data.get('id') or generate_id()
-    now = datetime.now().isoformat()
+    now = utc_now()
     items_json = json.dumps(data.get('items', []))
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO combos (id, name, description, price, items, regular_total, savings, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                name = EXCLUDED.name, description = EXCLUDED.description, price = EXCLUDED.price,
-                items = EXCLUDED.items, regular_total = EXCLUDED.regular_total, savings = EXCLUDED.savings
-        ''', (combo_id, data['name'], data.get('description', ''), data['price'],
-              items_json, data.get('regularTotal', 0), data.get('savings', 0), now))
-    else:
-        cur.execute('''
-            INSERT OR REPLACE INTO combos (id, name, description, price, items, regular_total, savings, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (combo_id, data['name'], data.get('description', ''), data['price'],
-              items_json, data.get('regularTotal', 0), data.get('savings', 0), now))
+    upsert(cur, is_postgres, 'combos', {
+        'id': combo_id, 'name': data['name'], 'description': data.get('description', ''), 'price': data['price'],
+        'items': items_json, 'regular_total': data.get('regularTotal', 0), 'savings': data.get('savings', 0),
+        'created_at': now
+    }, update=('name', 'description', 'price', 'items', 'regular_total', 'savings'))
     
+    write_line_items(cur, is_postgres, 'combos', 'items', combo_id, data.get('items', []))
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': combo_id})
 
 @app.route('/api/combos/<combo_id>', methods=['DELETE'])
+@invalidates('combos')
 def delete_combo(combo_id):
     execute_query('DELETE FROM combos WHERE id = ?', (combo_id,), commit=True)
     return jsonify({'success': True})
 
 # ===== Recipes API =====
 @app.route('/api/recipes', methods=['GET'])
+@conditional('recipes')
 def get_recipes():
-    recipes = execute_query('SELECT * FROM recipes ORDER BY name', fetch=True)
-    for recipe in recipes:
-        recipe['ingredients'] = json.loads(recipe['ingredients']) if recipe['ingredients'] else []
-        recipe['steps'] = json.loads(recipe['steps']) if recipe['steps'] else []
-    return jsonify(recipes)
+    recipes, next_cursor = query_list('recipes')
+    expand_rows('recipes', recipes)
+    return list_response(recipes, next_cursor)
 
 @app.route('/api/recipes', methods=['POST'])
+@invalidates('recipes')
 def add_recipe():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     recipe_id = data.get('id') or generate_id()
-    now = datetime.now().isoformat()
+    now = utc_now()
     ingredients_json = json.dumps(data.get('ingredients', []))
     steps_json = json.dumps(data.get('steps', []))
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO recipes (id, name, category, batch_size, total_time, ingredients, steps, notes, total_ingredient_cost, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                name = EXCLUDED.name, category = EXCLUDED.category, batch_size = EXCLUDED.batch_size,
-                total_time = EXCLUDED.total_time, ingredients = EXCLUDED.ingredients, steps = EXCLUDED.steps,
-                notes = EXCLUDED.notes, total_ingredient_cost = EXCLUDED.total_ingredient_cost
-        ''', (recipe_id, data['name'], data.get('category', 'pickles'), data.get('batchSize', ''),
-              data.get('totalTime', ''), ingredients_json, steps_json, data.get('notes', ''),
-              data.get('totalIngredientCost', 0), now))
-    else:
-        cur.execute('''
-            INSERT OR REPLACE INTO recipes (id, name, category, batch_size, total_time, ingredients, steps, notes, total_ingredient_cost, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (recipe_id, data['name'], data.get('category', 'pickles'), data.get('batchSize', ''),
-              data.get('totalTime', ''), ingredients_json, steps_json, data.get('notes', ''),
-              data.get('totalIngredientCost', 0), now))
+    upsert(cur, is_postgres, 'recipes', {
+        'id': recipe_id, 'name': data['name'], 'category': data.get('category', 'pickles'),
+        'batch_size': data.get('batchSize', ''), 'total_time': data.get('totalTime', ''),
+        'ingredients': ingredients_json, 'steps': steps_json, 'notes': data.get('notes', ''),
+        'total_ingredient_cost': data.get('totalIngredientCost', 0), 'created_at': now
+    }, update=('name', 'category', 'batch_size', 'total_time', 'ingredients', 'steps', 'notes', 'total_ingredient_cost'))
     
+    write_line_items(cur, is_postgres, 'recipes', 'ingredients', recipe_id, data.get('ingredients', []))
+    query_cache.invalidate(f'recipe:{recipe_id}')
+    cost = recipe_cost(cur, is_postgres, recipe_id)
+    run_sql(cur, is_postgres, 'UPDATE recipes SET total_ingredient_cost = ? WHERE id = ?',
+            (cost['batchCost'], recipe_id))
     conn.commit()
-    conn.close()
-    return jsonify({'success': True, 'id': recipe_id})
+    return jsonify({'success': True, 'id': recipe_id, 'cost': cost})
 
 @app.route('/api/recipes/<recipe_id>', methods=['DELETE'])
+@invalidates('recipes')
 def delete_recipe(recipe_id):
     execute_query('DELETE FROM recipes WHERE id = ?', (recipe_id,), commit=True)
+    query_cache.invalidate(f'recipe:{recipe_id}')
     return jsonify({'success': True})
 
+@app.route('/api/recipes/<recipe_id>/cost', methods=['GET'])
+def get_recipe_cost(recipe_id):
+    """Batch and unit cost of a recipe at current grocery prices, with its selling price and margin"""
+    conn, is_postgres = get_db()
+    cost = recipe_cost(conn.cursor(), is_postgres, recipe_id)
+    if cost is None:
+        return jsonify({'success': False, 'error': 'Recipe not found'}), 404
+    product = execute_query('SELECT id, selling_price FROM inventory WHERE LOWER(name) = LOWER(?)',
+                            (cost['name'],), fetchone=True)
+    return jsonify({'success': True, **cost, **recipe_margin(cost['unitCost'], product)})
+
+def recipe_margin(unit_cost, product):
+    """Selling price and margin for a recipe's matching inventory item (same name)"""
+    price = float(product['selling_price']) if product and product['selling_price'] else None
+    if price is None or unit_cost is None:
+        return {'inventoryId': product['id'] if product else None, 'sellingPrice': price,
+                'profitPerUnit': None, 'marginPercent': None}
+    return {'inventoryId': product['id'], 'sellingPrice': price, 'profitPerUnit': round(price - unit_cost, 2),
+            'marginPercent': round((price - unit_cost) / price * 100, 1)}
+
+@app.route('/api/recipes/costs', methods=['GET'])
+@conditional('recipes', 'inventory')
+def get_recipe_costs():
+    """Margin report for every recipe from its stored batch cost, which grocery writes keep current.
+    Batch size is read as a count of the matching inventory item's units (e.g. "20 jars")."""
+    products = {}
+    for row in execute_query('SELECT id, name, selling_price FROM inventory', fetch=True):
+        products.setdefault((row['name'] or '').lower(), row)
+    report = []
+    for recipe in execute_query('SELECT id, name, batch_size, total_ingredient_cost FROM recipes ORDER BY name', fetch=True):
+        units = batch_units(recipe['batch_size'])
+        batch_cost = float(recipe['total_ingredient_cost'] or 0)
+        unit_cost = round(batch_cost / units, 4) if units else None
+        report.append({'recipeId': recipe['id'], 'name': recipe['name'], 'batchSize': recipe['batch_size'],
+                       'batchCost': batch_cost, 'unitsPerBatch': units, 'unitCost': unit_cost,
+                       **recipe_margin(unit_cost, products.get((recipe['name'] or '').lower()))})
+    return jsonify({'success': True, 'data': report})
+
 # ===== Transactions API =====
 @app.route('/api/transactions', methods=['GET'])
+@conditional('transactions')
 def get_transactions():
-    transactions = execute_query('SELECT * FROM transactions ORDER BY date DESC', fetch=True)
-    return jsonify(transactions)
+    transactions, next_cursor = query_list('transactions')
+    return list_response(transactions, next_cursor)
 
 @app.route('/api/transactions', methods=['POST'])
+@invalidates('transactions')
 def add_transaction():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     trans_id = data.get('id') or generate_id()
-    now = datetime.now().isoformat()
+    now = utc_now()
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO transactions (id, type, category, amount, date, description, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', (trans_id, data['type'], data.get('category', 'other'), data['amount'],
-              data.get('date', now[:10]), data.get('description', ''), now))
-    else:
-        cur.execute('''
-            INSERT INTO transactions (id, type, category, amount, date, description, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (trans_id, data['type'], data.get('category', 'other'), data['amount'],
-              data.get('date', now[:10]), data.get('description', ''), now))
+    run_sql(cur, is_postgres, '''
+        INSERT INTO transactions (id, type, category, amount, date, description, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (trans_id, data['type'], data.get('category', 'other'), data['amount'],
+          data.get('date', now[:10]), data.get('description', ''), now))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': trans_id})
 
 @app.route('/api/transactions/<trans_id>', methods=['DELETE'])
+@invalidates('transactions')
 def delete_transaction(trans_id):
     execute_query('DELETE FROM transactions WHERE id = ?', (trans_id,), commit=True)
     return jsonify({'success': True})
 
 # ===== Offers API =====
 @app.route('/api/offers', methods=['GET'])
+@conditional('offers')
 def get_offers():
-    offers = execute_query('SELECT * FROM offers ORDER BY created_at DESC', fetch=True)
-    return jsonify(offers)
+    offers, next_cursor = query_list('offers')
+    return list_response(offers, next_cursor)
 
 @app.route('/api/offers', methods=['POST'])
+@invalidates('offers')
 def add_offer():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     offer_id = data.get('id') or generate_id()
-    now = datetime.now().isoformat()
+    now = utc_now()
     
-    if is_postgres:
-        cur.execute('''
-            INSERT INTO offers (id, name, type, value, start_date, end_date, active, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, 1, %s)
-        ''', (offer_id, data['name'], data.get('type', 'percentage'), data.get('value', 0),
-              data.get('startDate'), data.get('endDate'), now))
-    else:
-        cur.execute('''
-            INSERT INTO offers (id, name, type, value, start_date, end_date, active, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, 1, ?)
-        ''', (offer_id, data['name'], data.get('type', 'percentage'), data.get('value', 0),
-              data.get('startDate'), data.get('endDate'), now))
+    run_sql(cur, is_postgres, '''
+        INSERT INTO offers (id, name, type, value, start_date, end_date, active, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+    ''', (offer_id, data['name'], data.get('type', 'percentage'), data.get('value', 0),
+          data.get('startDate'), data.get('endDate'), now))
     
     conn.commit()
-    conn.close()
     return jsonify({'success': True, 'id': offer_id})
 
 @app.route('/api/offers/<offer_id>', methods=['DELETE'])
+@invalidates('offers')
 def delete_offer(offer_id):
     execute_query('DELETE FROM offers WHERE id = ?', (offer_id,), commit=True)
     return jsonify({'success': True})
 
 # ===== Grocery Inventory API =====
 @app.route('/api/grocery', methods=['GET'])
+@conditional('grocery')
 def get_grocery():
     try:
-        grocery = execute_query('SELECT * FROM grocery ORDER BY created_at DESC', fetch=True)
-        return jsonify({'success': True, 'data': grocery})
+        grocery, next_cursor = query_list('grocery')
+        return list_response(grocery, next_cursor, envelope=True)
+    except InvalidRequest:
+        raise
     except Exception as e:
         logger.error(f"Error getting grocery: {e}")
         return jsonify({'success': True, 'data': []})
 
 @app.route('/api/grocery', methods=['POST'])
+@invalidates('grocery', 'recipes')
 def save_grocery():
     data = request.json
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
     item_id = data.get('id')
-    now = datetime.now().isoformat()
+    now = utc_now()
     
     try:
+        repriced = [data.get('item_name')]
         if item_id:
+            previous = execute_query('SELECT item_name FROM grocery WHERE id = ?', (item_id,), fetchone=True)
+            if previous:
+                repriced.append(previous['item_name'])
             # Update existing item
-            if is_postgres:
-                cur.execute('''
-                    UPDATE grocery SET item_name=%s, category=%s, quantity=%s, unit=%s,
-                    purchase_date=%s, expiry_date=%s, purchased_by=%s, location=%s,
-                    cost=%s, supplier=%s, notes=%s, updated_at=%s
-                    WHERE id=%s
-                ''', (data.get('item_name'), data.get('category'), data.get('quantity', 0),
-                      data.get('unit', 'kg'), data.get('purchase_date'), data.get('expiry_date'),
-                      data.get('purchased_by'), data.get('location'), data.get('cost', 0),
-                      data.get('supplier'), data.get('notes'), now, item_id))
-            else:
-                cur.execute('''
-                    UPDATE grocery SET item_name=?, category=?, quantity=?, unit=?,
-                    purchase_date=?, expiry_date=?, purchased_by=?, location=?,
-                    cost=?, supplier=?, notes=?, updated_at=?
-                    WHERE id=?
-                ''', (data.get('item_name'), data.get('category'), data.get('quantity', 0),
-                      data.get('unit', 'kg'), data.get('purchase_date'), data.get('expiry_date'),
-                      data.get('purchased_by'), data.get('location'), data.get('cost', 0),
-                      data.get('supplier'), data.get('notes'), now, item_id))
+            run_sql(cur, is_postgres, '''
+                UPDATE grocery SET item_name=?, category=?, quantity=?, unit=?,
+                purchase_date=?, expiry_date=?, purchased_by=?, location=?,
+                cost=?, supplier=?, notes=?, updated_at=?
+                WHERE id=?
+            ''', (data.get('item_name'), data.get('category'), data.get('quantity', 0),
+                  data.get('unit', 'kg'), data.get('purchase_date'), data.get('expiry_date'),
+                  data.get('purchased_by'), data.get('location'), data.get('cost', 0),
+                  data.get('supplier'), data.get('notes'), now, item_id))
         else:
             # Insert new item
             item_id = generate_id()
-            if is_postgres:
-                cur.execute('''
-                    INSERT INTO grocery (id, item_name, category, quantity, unit, purchase_date,
-                    expiry_date, purchased_by, location, cost, supplier, notes, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (item_id, data.get('item_name'), data.get('category'), data.get('quantity', 0),
-                      data.get('unit', 'kg'), data.get('purchase_date'), data.get('expiry_date'),
-                      data.get('purchased_by'), data.get('location'), data.get('cost', 0),
-                      data.get('supplier'), data.get('notes'), now, now))
-            else:
-                cur.execute('''
-                    INSERT INTO grocery (id, item_name, category, quantity, unit, purchase_date,
-                    expiry_date, purchased_by, location, cost, supplier, notes, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (item_id, data.get('item_name'), data.get('category'), data.get('quantity', 0),
-                      data.get('unit', 'kg'), data.get('purchase_date'), data.get('expiry_date'),
-                      data.get('purchased_by'), data.get('location'), data.get('cost', 0),
-                      data.get('supplier'), data.get('notes'), now, now))
+            run_sql(cur, is_postgres, '''
+                INSERT INTO grocery (id, item_name, category, quantity, unit, purchase_date,
+                expiry_date, purchased_by, location, cost, supplier, notes, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (item_id, data.get('item_name'), data.get('category'), data.get('quantity', 0),
+                  data.get('unit', 'kg'), data.get('purchase_date'), data.get('expiry_date'),
+                  data.get('purchased_by'), data.get('location'), data.get('cost', 0),
+                  data.get('supplier'), data.get('notes'), now, now))
         
+        reprice_recipes(cur, is_postgres, repriced)
         conn.commit()
-        conn.close()
         return jsonify({'success': True, 'id': item_id})
     except Exception as e:
-        conn.close()
         logger.error(f"Error saving grocery: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+GROCERY_BULK_MAX_ROWS = 5000
+
+def grocery_field(key):
+    """item_name for item_name / Item Name / itemName / item-name"""
+    return re.sub(r'[\s_-]+', '_', snake_case(key.strip()))
+
+def read_grocery_batch():
+    """Rows for a bulk grocery import: a JSON array (or {"items": [...]}), or CSV as the
+    request body or an uploaded `file`. Keys in either format go through grocery_field()."""
+    upload = request.files.get('file')
+    if upload or request.mimetype == 'text/csv':
+        text = (upload.read() if upload else request.get_data()).decode('utf-8-sig')
+        return [{grocery_field(key): (value or '').strip() or None for key, value in row.items() if key}
+                for row in csv.DictReader(io.StringIO(text))]
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise InvalidRequest('Expected a list of grocery items or a CSV file')
+    # Non-object rows are left for grocery_bulk_row to reject
+    return [{grocery_field(key): value for key, value in row.items()} if isinstance(row, dict) else row
+            for row in data]
+
+def grocery_bulk_row(item, today):
+    """Validated (grocery values, cost) for one bulk row; raises ValueError with the reason"""
+    if not isinstance(item, dict):
+        raise ValueError('expected an object')
+    if not item.get('item_name') or not item.get('category'):
+        raise ValueError('item_name and category are required')
+    try:
+        quantity = float(item.get('quantity') or 0)
+        cost = float(item.get('cost') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('quantity and cost must be numbers')
+    if quantity < 0 or cost < 0:
+        raise ValueError('quantity and cost cannot be negative')
+    return (item['item_name'], item['category'], quantity, item.get('unit') or 'kg',
+            item.get('purchase_date') or today, item.get('expiry_date'), item.get('purchased_by'),
+            item.get('location'), cost, item.get('supplier'), item.get('notes')), cost
+
+@app.route('/api/grocery/bulk', methods=['POST'])
+@invalidates('grocery', 'transactions', 'recipes')
+def bulk_save_grocery():
+    """Add many grocery items in one transaction, each with an expense transaction for its
+    cost, as the single-item form does. Invalid rows are skipped and reported per row."""
+    items = read_grocery_batch()
+    if len(items) > GROCERY_BULK_MAX_ROWS:
+        raise InvalidRequest(f'At most {GROCERY_BULK_MAX_ROWS} items per import')
+    
+    now = utc_now()
+    groceries, expenses, results = [], [], []
+    for index, item in enumerate(items):
+        try:
+            values, cost = grocery_bulk_row(item, now[:10])
+        except ValueError as e:
+            results.append({'row': index, 'success': False, 'error': str(e)})
+            continue
+        grocery_id = generate_id()
+        groceries.append((grocery_id,) + values + (now, now))
+        result = {'row': index, 'success': True, 'id': grocery_id}
+        if cost > 0:
+            result['transactionId'] = generate_id()
+            expenses.append((result['transactionId'], 'expense', 'grocery', cost, values[4],
+                             f"Grocery: {values[0]} from {values[9] or 'Unknown'}", now))
+        results.append(result)
+    
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    insert_many(cur, is_postgres, 'grocery',
+                ('id', 'item_name', 'category', 'quantity', 'unit', 'purchase_date', 'expiry_date',
+                 'purchased_by', 'location', 'cost', 'supplier', 'notes', 'created_at', 'updated_at'), groceries)
+    insert_many(cur, is_postgres, 'transactions',
+                ('id', 'type', 'category', 'amount', 'date', 'description', 'created_at'), expenses)
+    reprice_recipes(cur, is_postgres, {row[1] for row in groceries})
+    conn.commit()
+    
+    return jsonify({'success': True, 'added': len(groceries), 'failed': len(results) - len(groceries),
+                    'results': results})
+
 @app.route('/api/grocery/<item_id>', methods=['DELETE'])
+@invalidates('grocery', 'grocery_usage', 'recipes')
 def delete_grocery(item_id):
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
     try:
-        # Delete usage records first
-        execute_query('DELETE FROM grocery_usage WHERE grocery_id = ?', (item_id,), commit=True)
-        # Delete the item
-        execute_query('DELETE FROM grocery WHERE id = ?', (item_id,), commit=True)
+        # The item, its usage records and the recipe costs it fed change together
+        item = run_sql(cur, is_postgres, 'SELECT item_name FROM grocery WHERE id = ?', (item_id,)).fetchone()
+        run_sql(cur, is_postgres, 'DELETE FROM grocery_usage WHERE grocery_id = ?', (item_id,))
+        run_sql(cur, is_postgres, 'DELETE FROM grocery WHERE id = ?', (item_id,))
+        if item:
+            reprice_recipes(cur, is_postgres, [item['item_name']])
+        conn.commit()
         return jsonify({'success': True})
     except Exception as e:
+        conn.rollback()
         logger.error(f"Error deleting grocery: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
 # ===== Grocery Usage API =====
 @app.route('/api/grocery/usage', methods=['GET'])
+@conditional('grocery_usage')
 def get_grocery_usage():
     try:
-        usage = execute_query('SELECT * FROM grocery_usage ORDER BY used_date DESC, created_at DESC', fetch=True)
-        return jsonify({'success': True, 'data': usage})
+        usage, next_cursor = query_list('grocery_usage')
+        return list_response(usage, next_cursor, envelope=True)
+    except InvalidRequest:
+        raise
     except Exception as e:
         logger.error(f"Error getting grocery usage: {e}")
         return jsonify({'success': True, 'data': []})
 
+def read_usage(data, defaults=None):
+    """One usage row from request JSON, with shared batch fields as defaults"""
+    if not isinstance(data, dict) or not data.get('grocery_id'):
+        raise InvalidRequest('Each usage needs a grocery_id')
+    try:
+        quantity = float(data.get('quantity_used', 0))
+    except (TypeError, ValueError):
+        raise InvalidRequest('quantity_used must be a number')
+    if quantity <= 0:
+        raise InvalidRequest('quantity_used must be more than 0')
+    usage = {field: data.get(field, (defaults or {}).get(field)) for field in GROCERY_USAGE_FIELDS}
+    usage.update(grocery_id=data['grocery_id'], quantity_used=quantity)
+    return usage
+
+def usage_shortage_response(conn, shortages):
+    conn.rollback()
+    names = {row['id']: row['item_name'] for row in execute_query(
+        f"SELECT id, item_name FROM grocery WHERE id IN ({', '.join('?' * len(shortages))})",
+        tuple(s['groceryId'] for s in shortages), fetch=True)}
+    for shortage in shortages:
+        shortage['name'] = names.get(shortage['groceryId'])
+    first = shortages[0]
+    error = (f"Only {first['available']} of {first['name']} available" if first['name']
+             else f"Unknown grocery item {first['groceryId']}")
+    return jsonify({'success': False, 'error': error, 'shortages': shortages}), 409
+
 @app.route('/api/grocery/usage', methods=['POST'])
+@invalidates('grocery', 'grocery_usage')
 def record_grocery_usage():
-    data = request.json
+    usage = read_usage(request.json)
     conn, is_postgres = get_db()
     cur = conn.cursor()
     
-    usage_id = generate_id()
-    now = datetime.now().isoformat()
-    grocery_id = data.get('grocery_id')
-    quantity_used = data.get('quantity_used', 0)
+    shortages = apply_grocery_usage(cur, is_postgres, [usage], utc_now())
+    if shortages:
+        return usage_shortage_response(conn, shortages)
+    conn.commit()
+    return jsonify({'success': True, 'id': usage['id']})
+
+@app.route('/api/grocery/usage/batch', methods=['POST'])
+@invalidates('grocery', 'grocery_usage')
+def record_grocery_usage_batch():
+    """Record many usages at once, e.g. everything one recipe batch consumed:
+    {"items": [{"grocery_id", "quantity_used"}, ...], "used_date", "used_by", "purpose", "notes"}.
+    All quantities are taken off together, or none are if any item is short."""
+    data = request.json
+    if isinstance(data, list):
+        data = {'items': data}
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        raise InvalidRequest('Expected a list of usage items')
+    usages = [read_usage(item, data) for item in data['items']]
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
     
+    shortages = apply_grocery_usage(cur, is_postgres, usages, utc_now())
+    if shortages:
+        return usage_shortage_response(conn, shortages)
+    conn.commit()
+    return jsonify({'success': True, 'ids': [u['id'] for u in usages]})
+
+@app.route('/api/grocery/consumption', methods=['GET'])
+@conditional('grocery', 'grocery_usage')
+def get_grocery_consumption():
+    """Usage totals per grocery item and purpose, most used first; ?grocery_id= or ?purpose= to filter"""
+    where, params = [], []
+    for field in ('grocery_id', 'purpose'):
+        if field in request.args:
+            where.append(f'c.{field} = ?')
+            params.append(request.args[field])
+    rows = execute_query(f"""
+        SELECT c.grocery_id, g.item_name, g.category, g.unit, c.purpose, c.uses, c.quantity, c.last_used
+        FROM grocery_consumption c JOIN grocery g ON g.id = c.grocery_id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY c.uses DESC, c.quantity DESC
+    """, tuple(params), fetch=True)
+    return jsonify({'success': True, 'data': rows})
+
+GROCERY_REORDER_LEVEL = float(os.environ.get('GROCERY_REORDER_LEVEL', 1))
+GROCERY_EXPIRY_WARNING_DAYS = 7
+GROCERY_FORECAST_DAYS = 30
+GROCERY_ALERT_COLUMNS = 'id, item_name, category, quantity, unit, expiry_date'
+
+@app.route('/api/grocery/alerts', methods=['GET'])
+def get_grocery_alerts():
+    """Expired items, items expiring within ?days= (default 7), items at or below ?reorder=
+    (default GROCERY_REORDER_LEVEL), and a depletion forecast from the last 30 days of usage"""
     try:
-        # Insert usage record
-        if is_postgres:
-            cur.execute('''
-                INSERT INTO grocery_usage (id, grocery_id, quantity_used, used_date, used_by, purpose, notes, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (usage_id, grocery_id, quantity_used, data.get('used_date'),
-                  data.get('used_by'), data.get('purpose'), data.get('notes'), now))
-            
-            # Update grocery quantity
-            cur.execute('''
-                UPDATE grocery SET quantity = quantity - %s, updated_at = %s WHERE id = %s
-            ''', (quantity_used, now, grocery_id))
-        else:
-            cur.execute('''
-                INSERT INTO grocery_usage (id, grocery_id, quantity_used, used_date, used_by, purpose, notes, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (usage_id, grocery_id, quantity_used, data.get('used_date'),
-                  data.get('used_by'), data.get('purpose'), data.get('notes'), now))
-            
-            # Update grocery quantity
-            cur.execute('''
-                UPDATE grocery SET quantity = quantity - ?, updated_at = ? WHERE id = ?
-            ''', (quantity_used, now, grocery_id))
+        days = int(request.args.get('days', GROCERY_EXPIRY_WARNING_DAYS))
+        reorder = float(request.args.get('reorder', GROCERY_REORDER_LEVEL))
+    except ValueError:
+        raise InvalidRequest('days and reorder must be numbers')
+    today = shop_today()
+    cache_key = ('grocery_alerts', today, days, reorder)
+    
+    alerts = query_cache.get(cache_key)
+    if alerts is None:
+        expired = execute_query(f"""
+            SELECT {GROCERY_ALERT_COLUMNS} FROM grocery
+            WHERE expiry_date > '' AND expiry_date < ? ORDER BY expiry_date
+        """, (today.isoformat(),), fetch=True)
+        expiring = execute_query(f"""
+            SELECT {GROCERY_ALERT_COLUMNS} FROM grocery
+            WHERE expiry_date >= ? AND expiry_date < ? ORDER BY expiry_date
+        """, (today.isoformat(), (today + timedelta(days=days + 1)).isoformat()), fetch=True)
+        low_stock = execute_query(f"""
+            SELECT {GROCERY_ALERT_COLUMNS} FROM grocery WHERE quantity <= ? ORDER BY quantity
+        """, (reorder,), fetch=True)
         
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'id': usage_id})
-    except Exception as e:
-        conn.close()
-        logger.error(f"Error recording usage: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+        usage = execute_query(f"""
+            SELECT g.id, g.item_name, g.category, g.quantity, g.unit, SUM(u.quantity_used) AS used
+            FROM grocery_usage u JOIN grocery g ON g.id = u.grocery_id
+            WHERE COALESCE(u.used_date, u.created_at) >= ?
+            GROUP BY g.id, g.item_name, g.category, g.quantity, g.unit
+        """, ((today - timedelta(days=GROCERY_FORECAST_DAYS)).isoformat(),), fetch=True)
+        forecast = []
+        for row in usage:
+            daily = float(row.pop('used') or 0) / GROCERY_FORECAST_DAYS
+            if daily <= 0:
+                continue
+            days_left = max(float(row['quantity'] or 0), 0) / daily
+            forecast.append({**row, 'dailyUsage': round(daily, 3), 'daysLeft': round(days_left, 1),
+                             'depletesOn': (today + timedelta(days=int(days_left))).isoformat()})
+        forecast.sort(key=lambda f: f['daysLeft'])
+        
+        alerts = {
+            'success': True,
+            'expired': expired,
+            'expiringSoon': expiring,
+            'lowStock': low_stock,
+            'forecast': forecast,
+            'counts': {
+                'expired': len(expired),
+                'expiringSoon': len(expiring),
+                'lowStock': len(low_stock),
+                'runningOut': sum(1 for f in forecast if f['daysLeft'] <= days)
+            }
+        }
+        query_cache.set(cache_key, alerts, ANALYTICS_CACHE_TTL, ('grocery', 'grocery_usage'))
+    return jsonify(alerts)
 
 @app.route('/api/grocery/usage/<usage_id>', methods=['DELETE'])
+@invalidates('grocery', 'grocery_usage')
 def delete_grocery_usage(usage_id):
     try:
         # Get the usage record first to restore quantity
@@ -1062,26 +2853,18 @@ def delete_grocery_usage(usage_id):
             conn, is_postgres = get_db()
             cur = conn.cursor()
             
-            now = datetime.now().isoformat()
+            now = utc_now()
             
             # Restore the quantity to grocery item
-            if is_postgres:
-                cur.execute('''
-                    UPDATE grocery SET quantity = quantity + %s, updated_at = %s WHERE id = %s
-                ''', (usage['quantity_used'], now, usage['grocery_id']))
-            else:
-                cur.execute('''
-                    UPDATE grocery SET quantity = quantity + ?, updated_at = ? WHERE id = ?
-                ''', (usage['quantity_used'], now, usage['grocery_id']))
+            run_sql(cur, is_postgres, 'UPDATE grocery SET quantity = quantity + ?, updated_at = ? WHERE id = ?',
+                    (usage['quantity_used'], now, usage['grocery_id']))
+            
+            record_consumption(cur, is_postgres, [usage], sign=-1)
             
             # Delete the usage record
-            if is_postgres:
-                cur.execute('DELETE FROM grocery_usage WHERE id = %s', (usage_id,))
-            else:
-                cur.execute('DELETE FROM grocery_usage WHERE id = ?', (usage_id,))
+            run_sql(cur, is_postgres, 'DELETE FROM grocery_usage WHERE id = ?', (usage_id,))
             
             conn.commit()
-            conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1091,125 +2874,642 @@ def delete_grocery_usage(usage_id):
 # ===== Dashboard Stats API =====
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    conn, is_postgres = get_db()
-    cur = conn.cursor()
+    tz = ZoneInfo(ANALYTICS_TIMEZONE)
+    today = shop_today()
+    cache_key = ('stats', today)
     
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    if is_postgres:
-        cur.execute('SELECT COUNT(*) as count FROM orders WHERE created_at LIKE %s', (f'{today}%',))
-        today_orders = cur.fetchone()['count']
-        
-        cur.execute("SELECT COUNT(*) as count FROM orders WHERE status != 'delivered'")
-        pending_orders = cur.fetchone()['count']
-        
-        cur.execute('SELECT COALESCE(SUM(total), 0) as sum FROM orders WHERE created_at LIKE %s', (f'{today}%',))
-        today_revenue = cur.fetchone()['sum']
-        
-        # Today's Income = Completed orders delivered today (payment received)
-        cur.execute('SELECT COALESCE(SUM(total), 0) as sum FROM order_history WHERE delivered_at LIKE %s', (f'{today}%',))
-        today_income = cur.fetchone()['sum']
-        
-        cur.execute('SELECT COUNT(*) as count FROM inventory WHERE stock <= 5')
-        low_stock = cur.fetchone()['count']
-        
-        cur.execute('SELECT COUNT(*) as count FROM customers')
-        total_customers = cur.fetchone()['count']
-        
-        cur.execute('SELECT COALESCE(SUM(total), 0) as sum FROM orders')
-        orders_revenue = cur.fetchone()['sum']
-        
-        cur.execute('SELECT COALESCE(SUM(total), 0) as sum FROM order_history')
-        history_revenue = cur.fetchone()['sum']
-        
-        cur.execute("SELECT COALESCE(SUM(amount), 0) as sum FROM transactions WHERE type = 'expense'")
-        total_expenses = cur.fetchone()['sum']
-    else:
-        cur.execute('SELECT COUNT(*) FROM orders WHERE created_at LIKE ?', (f'{today}%',))
-        today_orders = cur.fetchone()[0]
-        
-        cur.execute('SELECT COUNT(*) FROM orders WHERE status != "delivered"')
-        pending_orders = cur.fetchone()[0]
+    stats = query_cache.get(cache_key)
+    if stats is None:
+        # Half-open UTC range for the local day, compared as ISO text so the
+        # created_at/delivered_at indexes apply
+        day_start = datetime(today.year, today.month, today.day, tzinfo=tz)
+        today_start, tomorrow = (
+            (day_start + timedelta(days=days)).astimezone(timezone.utc).isoformat() for days in (0, 1))
+        row = execute_query('''
+            SELECT
+                (SELECT COUNT(*) FROM orders WHERE created_at >= ? AND created_at < ?) AS today_orders,
+                (SELECT COUNT(*) FROM orders WHERE status != 'delivered') AS pending_orders,
+                (SELECT COALESCE(SUM(total), 0) FROM orders WHERE created_at >= ? AND created_at < ?) AS today_revenue,
+                (SELECT COALESCE(SUM(total), 0) FROM order_history WHERE delivered_at >= ? AND delivered_at < ?) AS today_income,
+                (SELECT COUNT(*) FROM inventory WHERE stock <= 5) AS low_stock,
+                (SELECT COUNT(*) FROM customers) AS total_customers,
+                (SELECT COALESCE(SUM(total), 0) FROM orders) AS orders_revenue,
+                (SELECT COALESCE(SUM(revenue), 0) FROM daily_sales) AS history_revenue,
+                (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'expense') AS total_expenses
+        ''', (today_start, tomorrow) * 3, fetchone=True)
         
-        cur.execute('SELECT COALESCE(SUM(total), 0) FROM orders WHERE created_at LIKE ?', (f'{today}%',))
-        today_revenue = cur.fetchone()[0]
-        
-        # Today's Income = Completed orders delivered today (payment received)
-        cur.execute('SELECT COALESCE(SUM(total), 0) FROM order_history WHERE delivered_at LIKE ?', (f'{today}%',))
-        today_income = cur.fetchone()[0]
-        
-        cur.execute('SELECT COUNT(*) FROM inventory WHERE stock <= 5')
-        low_stock = cur.fetchone()[0]
-        
-        cur.execute('SELECT COUNT(*) FROM customers')
-        total_customers = cur.fetchone()[0]
+        stats = {
+            'todayOrders': row['today_orders'],
+            'pendingOrders': row['pending_orders'],
+            'todayRevenue': row['today_revenue'],
+            # Today's Income = Completed orders delivered today (payment received)
+            'todayIncome': row['today_income'],
+            'lowStockCount': row['low_stock'],
+            'totalCustomers': row['total_customers'],
+            'totalRevenue': row['orders_revenue'] + row['history_revenue'],
+            'totalExpenses': row['total_expenses']
+        }
+        query_cache.set(cache_key, stats, STATS_CACHE_TTL,
+                        ('orders', 'order_history', 'inventory', 'customers', 'transactions'))
+    
+    return jsonify(stats)
+
+# ===== Analytics API =====
+FINANCE_PERIODS = ('day', 'week', 'month')
+
+# (kind, table, timestamp expression, amount, extra condition)
+FINANCE_SOURCES = [
+    ('income', 'order_history', 'COALESCE(delivered_at, created_at)', 'total', ''),
+    ('expenses', 'transactions', 'COALESCE(date, created_at)', 'amount', "AND type = 'expense'"),
+    ('expenses', 'grocery', 'purchase_date', 'cost', ''),
+]
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise InvalidRequest(f'Invalid {name} date: {value}')
+
+def finance_buckets(tz, start, end):
+    """{local date: {'income', 'expenses'}}, grouped in SQL by UTC hour so the local
+    day boundaries follow the timezone's DST rules"""
+    sources = FINANCE_SOURCES
+    if tz.key == ANALYTICS_TIMEZONE:
+        # Income straight from the rollup, already in local days
+        sources = [('income', 'daily_sales', 'sale_date', 'revenue', '')] + sources[1:]
+    days = {}
+    for kind, table, column, amount, condition in sources:
+        where, params = [], []
+        # Pad the indexed text range by a day each side; exact local-day bounds are applied below
+        if start:
+            where.append(f'{column} >= ?')
+            params.append((start - timedelta(days=1)).isoformat())
+        if end:
+            where.append(f'{column} < ?')
+            params.append((end + timedelta(days=2)).isoformat())
+        rows = execute_query(f'''
+            SELECT SUBSTR({column}, 1, 13) AS bucket, SUM({amount}) AS amount
+            FROM {table}
+            WHERE {column} IS NOT NULL {condition} {''.join(f'AND {w} ' for w in where)}
+            GROUP BY SUBSTR({column}, 1, 13)
+        ''', tuple(params), fetch=True)
+        for row in rows:
+            try:
+                day = local_day(row['bucket'], tz)
+            except ValueError:
+                continue
+            if (start and day < start) or (end and day > end):
+                continue
+            totals = days.setdefault(day, {'income': 0.0, 'expenses': 0.0})
+            totals[kind] += float(row['amount'] or 0)
+    return days
+
+def period_key(day, period):
+    if period == 'week':
+        return (day - timedelta(days=(day.weekday() + 1) % 7)).isoformat()  # weeks start on Sunday
+    if period == 'month':
+        return day.strftime('%Y-%m')
+    return day.isoformat()
+
+@app.route('/api/analytics/finance', methods=['GET'])
+@conditional('order_history', 'transactions', 'grocery')
+def get_finance():
+    """Income (completed orders), expenses (expense transactions plus grocery cost) and profit,
+    bucketed by local day, week (from Sunday) and month. ?from= / ?to= are inclusive local
+    dates, ?period= picks buckets, ?tz= overrides ANALYTICS_TIMEZONE."""
+    tz_name = request.args.get('tz', ANALYTICS_TIMEZONE)
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise InvalidRequest(f'Unknown timezone: {tz_name}')
+    start, end = parse_date_arg('from'), parse_date_arg('to')
+    periods = request.args.get('period', ','.join(FINANCE_PERIODS)).split(',')
+    if any(p not in FINANCE_PERIODS for p in periods):
+        raise InvalidRequest(f"period must be one of: {', '.join(FINANCE_PERIODS)}")
+    
+    cache_key = ('finance', tz_name, start, end)
+    days = query_cache.get(cache_key)
+    if days is None:
+        days = finance_buckets(tz, start, end)
+        query_cache.set(cache_key, days, ANALYTICS_CACHE_TTL, ('order_history', 'transactions', 'grocery'))
+    
+    def summary(income, expenses):
+        return {'income': round(income, 2), 'expenses': round(expenses, 2), 'profit': round(income - expenses, 2)}
+    
+    result = {
+        'success': True,
+        'timezone': tz_name,
+        'from': start.isoformat() if start else None,
+        'to': end.isoformat() if end else None,
+        'totals': summary(sum(d['income'] for d in days.values()), sum(d['expenses'] for d in days.values()))
+    }
+    for period in periods:
+        buckets = {}
+        for day in sorted(days):
+            totals = buckets.setdefault(period_key(day, period), [0.0, 0.0])
+            totals[0] += days[day]['income']
+            totals[1] += days[day]['expenses']
+        result[period] = [{'period': key, **summary(*totals)} for key, totals in buckets.items()]
+    return jsonify(result)
+
+ITEMS_DEFAULT_LIMIT = 10
+ITEMS_MAX_LIMIT = 100
+
+ITEM_LINES_QUERY = ' UNION ALL '.join(f'''
+    SELECT i.item_id, i.name, i.quantity, i.total, i.order_id, o.created_at
+    FROM {items} i JOIN {parent} o ON o.id = i.order_id
+    WHERE o.created_at >= ? AND o.created_at < ?'''
+    for items, parent in (('order_items', 'orders'), ('order_history_items', 'order_history')))
+
+# Per item: window totals, plus units over the trailing 7 and 30 days. Active orders and
+# history both count, dated by when the order was placed (when stock left the shelf).
+ITEM_SALES_QUERY = f'''
+    SELECT MAX(item_id) AS item_id, MAX(name) AS name,
+           SUM(CASE WHEN created_at >= ? THEN quantity ELSE 0 END) AS units,
+           SUM(CASE WHEN created_at >= ? THEN total ELSE 0 END) AS revenue,
+           COUNT(DISTINCT CASE WHEN created_at >= ? THEN order_id END) AS orders,
+           SUM(CASE WHEN created_at >= ? THEN quantity ELSE 0 END) AS units_7,
+           SUM(CASE WHEN created_at >= ? THEN quantity ELSE 0 END) AS units_30
+    FROM ({ITEM_LINES_QUERY}
+    ) lines
+    GROUP BY COALESCE(item_id, name)
+'''
+
+@app.route('/api/analytics/items', methods=['GET'])
+def get_item_analytics():
+    """Best sellers by units and by revenue between ?from= and ?to= (inclusive; default all time
+    up to today), and for every inventory item its 7/30-day average daily sales and days of
+    stock left. ?limit= caps the best-seller lists."""
+    start, end = parse_date_arg('from'), parse_date_arg('to') or shop_today()
+    try:
+        limit = min(max(int(request.args.get('limit', ITEMS_DEFAULT_LIMIT)), 1), ITEMS_MAX_LIMIT)
+    except ValueError:
+        raise InvalidRequest('limit must be a number')
+    
+    cache_key = ('items', start, end, limit)
+    result = query_cache.get(cache_key)
+    if result is None:
+        window_start = start.isoformat() if start else ''
+        week_start = (end - timedelta(days=6)).isoformat()
+        month_start = (end - timedelta(days=29)).isoformat()
+        scan_start = min(window_start, month_start)
+        scan_end = (end + timedelta(days=1)).isoformat()
+        rows = execute_query(ITEM_SALES_QUERY, (window_start,) * 3 + (week_start, month_start) + (scan_start, scan_end) * 2, fetch=True)
+        inventory = {row['id']: row for row in execute_query('SELECT id, name, category, stock FROM inventory', fetch=True)}
         
-        cur.execute('SELECT COALESCE(SUM(total), 0) FROM orders')
-        orders_revenue = cur.fetchone()[0]
+        sellers, sales = [], {}
+        for row in rows:
+            if row['item_id']:
+                sales[row['item_id']] = row
+            if not row['units'] and not row['revenue']:
+                continue
+            item = inventory.get(row['item_id'])
+            sellers.append({
+                'itemId': row['item_id'],
+                'name': item['name'] if item else row['name'],
+                'category': item['category'] if item else None,
+                'units': float(row['units'] or 0),
+                'revenue': round(float(row['revenue'] or 0), 2),
+                'orders': row['orders']
+            })
         
-        cur.execute('SELECT COALESCE(SUM(total), 0) FROM order_history')
-        history_revenue = cur.fetchone()[0]
+        velocity = []
+        for item in inventory.values():
+            sold = sales.get(item['id'])
+            avg_7 = float(sold['units_7'] or 0) / 7 if sold else 0.0
+            avg_30 = float(sold['units_30'] or 0) / 30 if sold else 0.0
+            # The faster of the two rates, so a recent surge shortens the estimate
+            rate = max(avg_7, avg_30)
+            stock = float(item['stock'] or 0)
+            velocity.append({
+                'itemId': item['id'],
+                'name': item['name'],
+                'category': item['category'],
+                'stock': stock,
+                'avgDaily7': round(avg_7, 3),
+                'avgDaily30': round(avg_30, 3),
+                'daysOfStock': round(stock / rate, 1) if rate > 0 else None
+            })
+        velocity.sort(key=lambda v: (v['daysOfStock'] is None, v['daysOfStock'] or 0, v['name']))
         
-        cur.execute('SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE type = "expense"')
-        total_expenses = cur.fetchone()[0]
+        result = {
+            'success': True,
+            'from': start.isoformat() if start else None,
+            'to': end.isoformat(),
+            'byUnits': sorted(sellers, key=lambda s: (-s['units'], -s['revenue'], s['name'] or ''))[:limit],
+            'byRevenue': sorted(sellers, key=lambda s: (-s['revenue'], -s['units'], s['name'] or ''))[:limit],
+            'velocity': velocity
+        }
+        query_cache.set(cache_key, result, ANALYTICS_CACHE_TTL, ('orders', 'order_history', 'inventory'))
+    return jsonify(result)
+
+# ===== Sync API =====
+SYNC_BATCH_SIZE = 1000
+# Postgres hands out sequence values before commit, so a slow transaction can commit a
+# lower seq after a client has already synced past it. Re-sending a small window of
+# recent changes covers that; upserts and tombstones are idempotent on the client.
+SYNC_OVERLAP = 100 if USE_POSTGRES else 0
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Rows inserted, updated or deleted since a previous sync token"""
+    since = request.args.get('since')
+    if not since:
+        # No token yet: hand out the current position for the client to sync from
+        row = execute_query('SELECT COALESCE(MAX(seq), 0) AS seq FROM change_log', fetchone=True)
+        return jsonify({'token': str(row['seq']), 'changes': {}, 'hasMore': False})
+    try:
+        since = int(since)
+    except ValueError:
+        raise InvalidRequest('Invalid sync token')
     
-    conn.close()
+    log = execute_query(
+        'SELECT seq, table_name, row_id, deleted FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?',
+        (max(since - SYNC_OVERLAP, 0), SYNC_BATCH_SIZE + 1), fetch=True)
+    has_more = len(log) > SYNC_BATCH_SIZE
+    log = log[:SYNC_BATCH_SIZE]
+    token = max([since] + [entry['seq'] for entry in log])
     
-    return jsonify({
-        'todayOrders': today_orders,
-        'pendingOrders': pending_orders,
-        'todayRevenue': today_revenue,
-        'todayIncome': today_income,
-        'lowStockCount': low_stock,
-        'totalCustomers': total_customers,
-        'totalRevenue': orders_revenue + history_revenue,
-        'totalExpenses': total_expenses
-    })
+    changes = {}
+    upserted_ids = {}
+    for entry in log:
+        table = entry['table_name']
+        changes.setdefault(table, {'upserted': [], 'deleted': []})
+        if entry['deleted']:
+            changes[table]['deleted'].append(entry['row_id'])
+        else:
+            upserted_ids.setdefault(table, []).append(entry['row_id'])
+    
+    for table, ids in upserted_ids.items():
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows.extend(execute_query(f"SELECT * FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})",
+                                      tuple(chunk), fetch=True))
+        found = {row['id'] for row in rows}
+        changes[table]['upserted'] = expand_rows(table, rows)
+        # Logged as written but gone by now: deleted after the log was read
+        changes[table]['deleted'].extend(row_id for row_id in ids if row_id not in found)
+    
+    return jsonify({'token': str(token), 'changes': changes, 'hasMore': has_more})
 
 # ===== Export/Import API =====
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def iter_table_rows(table, since=None):
+    """Yield a table's rows in batches; Postgres reads through a server-side (named) cursor"""
+    conn, is_postgres = get_db()
+    if is_postgres:
+        cur = conn.cursor(name=f'export_{table}')
+        cur.itersize = EXPORT_BATCH_SIZE
+    else:
+        cur = conn.cursor()
+    
+    if since is None:
+        cur.execute(f'SELECT * FROM {table}')
+    else:
+        # Not run_sql(): a named cursor doesn't take prepare=True
+        cur.execute(compile_query(f'''
+            SELECT t.* FROM {table} t
+            JOIN change_log c ON c.table_name = ? AND c.row_id = t.id
+            WHERE c.seq > ? AND c.deleted = 0
+        ''', is_postgres), (table, since))
+    try:
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        cur.close()
+
+def export_ndjson(tables, since, token):
+    """One JSON object per line: a header, then {"table", "row"} and {"table", "deleted"} records"""
+    yield json.dumps({'export': {'version': 1, 'tables': list(tables), 'since': since, 'token': str(token)}}) + '\n'
+    for table in tables:
+        for row in iter_table_rows(table, since):
+            yield json.dumps({'table': table, 'row': row}) + '\n'
+        if since is not None:
+            for entry in execute_query('SELECT row_id FROM change_log WHERE table_name = ? AND seq > ? AND deleted = 1',
+                                       (table, since), fetch=True):
+                yield json.dumps({'table': table, 'deleted': entry['row_id']}) + '\n'
+
+def export_json(tables):
+    """The classic {table: [rows]} backup document, written out a row at a time"""
+    yield '{'
+    for i, table in enumerate(tables):
+        yield ('' if i == 0 else ', ') + json.dumps(table) + ': ['
+        for j, row in enumerate(iter_table_rows(table)):
+            yield ('' if j == 0 else ', ') + json.dumps(row)
+        yield ']'
+    yield '}'
+
+def buffered(chunks, size=EXPORT_CHUNK_BYTES):
+    """Coalesce small string chunks into ~size byte blocks"""
+    buf, length = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buf).encode()
+            buf, length = [], 0
+    if buf:
+        yield ''.join(buf).encode()
+
+def gzip_stream(blocks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route('/api/export', methods=['GET'])
+@conditional(*DATA_TABLES)
 def export_data():
-    data = {}
-    for table in ['inventory', 'customers', 'orders', 'order_history', 'combos', 'recipes', 'transactions', 'offers', 'grocery', 'grocery_usage']:
-        data[table] = execute_query(f'SELECT * FROM {table}', fetch=True)
-    return jsonify(data)
+    """Stream a backup. ?format=json (default) or ndjson, ?tables=a,b to pick tables,
+    ?since=<sync token> (ndjson only) for changes since an earlier export, ?download=1
+    to save as a file. Compressed on the fly when the client accepts gzip."""
+    args = request.args
+    tables = DATA_TABLES
+    if args.get('tables'):
+        tables = [t.strip() for t in args['tables'].split(',') if t.strip()]
+        unknown = [t for t in tables if t not in DATA_TABLES]
+        if unknown:
+            raise InvalidRequest(f"Unknown tables: {', '.join(unknown)}")
+    
+    fmt = args.get('format', 'json')
+    since = args.get('since')
+    if since is not None:
+        if fmt != 'ndjson':
+            raise InvalidRequest('since= requires format=ndjson')
+        try:
+            since = int(since)
+        except ValueError:
+            raise InvalidRequest('Invalid sync token')
+    
+    if fmt == 'ndjson':
+        token = execute_query('SELECT COALESCE(MAX(seq), 0) AS seq FROM change_log', fetchone=True)['seq']
+        body, mimetype, extension = export_ndjson(tables, since, token), 'application/x-ndjson', 'ndjson'
+    elif fmt == 'json':
+        body, mimetype, extension = export_json(tables), 'application/json', 'json'
+    else:
+        raise InvalidRequest(f'Unknown format: {fmt}')
+    
+    blocks = buffered(body)
+    gzipped = bool(request.accept_encodings['gzip'])
+    if gzipped:
+        blocks = gzip_stream(blocks)
+    response = app.response_class(stream_with_context(blocks), mimetype=mimetype)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    if args.get('download'):
+        filename = f"90s_jar_backup_{datetime.now().strftime('%Y-%m-%d')}.{extension}"
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
-@app.route('/api/import', methods=['POST'])
-def import_data():
-    data = request.json
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_DERIVED_COLUMNS = {  # recomputed after the swap
+    'customers': ('lookup_key',),
+    'orders': ('customer_id',),
+    'order_history': ('customer_id',)
+}
+
+_column_info = {}
+
+def get_column_info(table):
+    """{column: (python type, required)} for a table, read once per worker"""
+    if table not in _column_info:
+        conn, is_postgres = get_db()
+        cur = conn.cursor()
+        if is_postgres:
+            cur.execute("""SELECT column_name AS name, data_type AS type, is_nullable = 'NO' AS notnull
+                           FROM information_schema.columns
+                           WHERE table_schema = current_schema() AND table_name = %s
+                           ORDER BY ordinal_position""", (table,))
+        else:
+            cur.execute(f'PRAGMA table_info({table})')
+        info = {}
+        for col in cur.fetchall():
+            kind = col['type'].upper()
+            pytype = int if 'INT' in kind else float if kind in ('REAL', 'DOUBLE PRECISION', 'NUMERIC') else str
+            info[col['name']] = (pytype, bool(col['notnull']) and col['name'] != 'id')
+        _column_info[table] = info
+    return _column_info[table]
+
+def snake_case(key):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', key).lower()
+
+def import_row(table, row, line):
+    """Validate one backup row against the table schema and return its column values"""
+    if not isinstance(row, dict):
+        raise InvalidRequest(f'{table} row {line}: expected an object')
+    info = get_column_info(table)
+    values = {}
+    for key, value in row.items():
+        column = key if key in info else snake_case(key)
+        if column in info and column not in values:
+            values[column] = value
+    if not values.get('id'):
+        raise InvalidRequest(f'{table} row {line}: missing id')
+    values['id'] = str(values['id'])
+    
+    columns = [c for c in info if c not in IMPORT_DERIVED_COLUMNS.get(table, ())]
+    out = []
+    for column in columns:
+        pytype, required = info[column]
+        value = values.get(column)
+        if column in JSON_COLUMNS.get(table, ()) and value is not None and not isinstance(value, str):
+            value = json.dumps(value)
+        elif column in JSON_COLUMNS.get(table, ()) and value:
+            try:
+                json.loads(value)
+            except ValueError:
+                raise InvalidRequest(f'{table} row {line}: {column} is not valid JSON')
+        elif pytype is not str and value not in (None, ''):
+            try:
+                value = float(value)
+                if pytype is int and value.is_integer():
+                    value = int(value)
+            except (TypeError, ValueError):
+                raise InvalidRequest(f'{table} row {line}: {column} must be a number')
+        elif pytype is not str:
+            value = None
+        elif value is not None and not isinstance(value, str):
+            value = str(value)
+        if value is None and required:
+            raise InvalidRequest(f'{table} row {line}: {column} is required')
+        out.append(value)
+    return columns, out
+
+def read_import_records():
+    """(table, row) pairs from the request body: the {table: [rows]} backup document,
+    or NDJSON as written by /api/export?format=ndjson, optionally gzipped"""
+    content_type = request.mimetype
+    gzipped = request.headers.get('Content-Encoding') == 'gzip' or content_type in ('application/gzip', 'application/x-gzip')
+    if content_type == 'application/json' and not gzipped:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise InvalidRequest('Invalid backup file')
+        tables = [t for t in data if t in DATA_TABLES]
+        unknown = [t for t in data if t not in DATA_TABLES]
+        if unknown:
+            raise InvalidRequest(f"Unknown tables: {', '.join(unknown)}")
+        return tables, ((t, row) for t in tables for row in (data[t] or []))
+    
+    stream = gzip.GzipFile(fileobj=request.stream) if gzipped else request.stream
+    lines = (line for line in stream if line.strip())
+    try:
+        first = json.loads(next(lines, b'{}'))
+    except ValueError:
+        raise InvalidRequest('Invalid backup file')
+    if not first:
+        raise InvalidRequest('Empty backup file')
+    header = first.get('export') if isinstance(first, dict) else None
+    if header and header.get('since') is not None:
+        raise InvalidRequest('Incremental exports cannot be restored; import a full export')
+    tables = list(header['tables']) if header else []
+    
+    def records():
+        pending = [] if header else [first]
+        for record in pending:
+            yield record
+        for line in lines:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise InvalidRequest('Invalid line in backup file')
+    
+    def pairs():
+        for record in records():
+            if not isinstance(record, dict) or record.get('table') not in DATA_TABLES or 'row' not in record:
+                if isinstance(record, dict) and 'deleted' in record:
+                    continue
+                raise InvalidRequest(f"Unknown record in backup file: {str(record)[:80]}")
+            if record['table'] not in tables:
+                tables.append(record['table'])
+            yield record['table'], record['row']
+    
+    unknown = [t for t in tables if t not in DATA_TABLES]
+    if unknown:
+        raise InvalidRequest(f"Unknown tables: {', '.join(unknown)}")
+    return tables, pairs()
+
+def write_staging(cur, is_postgres, table, columns, rows):
+    if is_postgres:
+        with cur.copy(f"COPY import_{table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+    else:
+        cur.executemany(f"INSERT INTO import_{table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", rows)
+
+def run_import(tables, records):
+    """Load rows into per-table staging tables in chunked transactions, validating as they
+    arrive, then replace the live tables in a single transaction. Yields progress events."""
     conn, is_postgres = get_db()
     cur = conn.cursor()
+    staged = set()
     
-    # Clear existing data
-    for table in ['inventory', 'customers', 'orders', 'order_history', 'combos', 'recipes', 'transactions', 'offers', 'grocery', 'grocery_usage']:
-        cur.execute(f'DELETE FROM {table}')
+    def stage(table):
+        if table not in staged:
+            cur.execute(f'DROP TABLE IF EXISTS import_{table}')
+            if is_postgres:
+                cur.execute(f'CREATE TEMP TABLE import_{table} (LIKE {table})')
+            else:
+                cur.execute(f'CREATE TEMP TABLE import_{table} AS SELECT * FROM {table} WHERE 0')
+            staged.add(table)
     
-    # Import inventory
-    for item in data.get('inventory', []):
-        if is_postgres:
-            cur.execute('''
-                INSERT INTO inventory (id, name, category, cost_price, selling_price, stock, unit, description, shelf_life, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (item.get('id'), item.get('name'), item.get('category'), 
-                  item.get('cost_price') or item.get('costPrice'), 
-                  item.get('selling_price') or item.get('sellingPrice'), 
-                  item.get('stock'), item.get('unit'), item.get('description'), 
-                  item.get('shelf_life') or item.get('shelfLife'), 
-                  item.get('created_at') or item.get('createdAt')))
-        else:
-            cur.execute('''
-                INSERT INTO inventory (id, name, category, cost_price, selling_price, stock, unit, description, shelf_life, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (item.get('id'), item.get('name'), item.get('category'), 
-                  item.get('cost_price') or item.get('costPrice'), 
-                  item.get('selling_price') or item.get('sellingPrice'), 
-                  item.get('stock'), item.get('unit'), item.get('description'), 
-                  item.get('shelf_life') or item.get('shelfLife'), 
-                  item.get('created_at') or item.get('createdAt')))
+    try:
+        counts, seen = {}, {}
+        buffer, buffer_table, columns = [], None, None
+        
+        def flush():
+            write_staging(cur, is_postgres, buffer_table, columns, buffer)
+            conn.commit()
+            return {'stage': 'loading', 'table': buffer_table, 'rows': counts[buffer_table]}
+        
+        for table, row in records:
+            if buffer and table != buffer_table:
+                yield flush()
+                buffer = []
+            stage(table)
+            buffer_table = table
+            line = counts.get(table, 0) + 1
+            columns, values = import_row(table, row, line)
+            ids = seen.setdefault(table, set())
+            if values[columns.index('id')] in ids:
+                raise InvalidRequest(f"{table} row {line}: duplicate id {values[columns.index('id')]}")
+            ids.add(values[columns.index('id')])
+            buffer.append(values)
+            counts[table] = line
+            if len(buffer) >= IMPORT_CHUNK_SIZE:
+                yield flush()
+                buffer = []
+        if buffer:
+            yield flush()
+        for table in tables:
+            stage(table)
+            counts.setdefault(table, 0)
+        conn.commit()
+        yield {'stage': 'validated', 'counts': counts}
+        
+        # Swap: nothing in the live tables changes until every row has loaded
+        for table in tables:
+            cur.execute(f'DELETE FROM {table}')
+        for table in tables:
+            cols = ', '.join(c for c in get_column_info(table) if c not in IMPORT_DERIVED_COLUMNS.get(table, ()))
+            cur.execute(f'INSERT INTO {table} ({cols}) SELECT {cols} FROM import_{table}')
+        backfill_line_items(cur, is_postgres, tables)
+        if 'customers' in tables:
+            backfill_customer_keys(cur, is_postgres)
+        if {'customers', 'orders', 'order_history'} & set(tables):
+            backfill_order_customers(cur, is_postgres)
+            reconcile_customer_stats(cur, is_postgres)
+        if 'order_history' in tables:
+            rebuild_daily_sales(cur, is_postgres)
+        rebuild_order_search(cur, is_postgres, [t for t in ORDER_SEARCH_SOURCES if t in tables])
+        if 'grocery' in tables or 'grocery_usage' in tables:
+            rebuild_grocery_consumption(cur, is_postgres)
+        conn.commit()
+        query_cache.invalidate(*tables, 'recipe_costs')
+        table_versions.invalidate()
+        yield {'success': True, 'imported': counts}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        for table in staged:
+            cur.execute(f'DROP TABLE IF EXISTS import_{table}')
+        conn.commit()
+
+@app.route('/api/import', methods=['POST'])
+@invalidates(*DATA_TABLES)
+def import_data():
+    """Restore a backup. Tables in the backup replace the live ones; others are left alone.
+    With ?progress=1 the response is NDJSON progress events ending in the result."""
+    tables, records = read_import_records()
+    events = run_import(tables, records)
+    if not request.args.get('progress'):
+        for event in events:
+            result = event
+        return jsonify(result)
     
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True})
+    def stream():
+        try:
+            for event in events:
+                yield json.dumps(event) + '\n'
+        except InvalidRequest as e:
+            yield json.dumps({'success': False, 'error': str(e)}) + '\n'
+        except Exception as e:
+            logger.error(f"Import failed: {e}")
+            yield json.dumps({'success': False, 'error': 'Import failed'}) + '\n'
+    return app.response_class(stream_with_context(stream()), mimetype='application/x-ndjson')
 
 # ===== Debug endpoint =====
 @app.route('/api/debug', methods=['GET'])
@@ -1217,12 +3517,63 @@ def debug_info():
     return jsonify({
         'database_url_set': bool(DATABASE_URL),
         'has_postgres': HAS_POSTGRES,
-        'using_postgres': bool(DATABASE_URL and HAS_POSTGRES),
-        'postgres_import_error': POSTGRES_IMPORT_ERROR
+        'using_postgres': USE_POSTGRES,
+        'postgres_import_error': POSTGRES_IMPORT_ERROR,
+        'pool': get_pool().stats(),
+        'sqlite': None if USE_POSTGRES else sqlite_settings()
     })
 
-# Initialize database on startup
-init_db()
+def sqlite_settings():
+    """The tuning pragmas as the request's SQLite connection actually has them"""
+    conn, _ = get_db()
+    return {pragma: conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size')}
+
+@app.route('/api/debug/pool', methods=['GET'])
+def pool_stats():
+    return jsonify(get_pool().stats())
+
+# ===== CLI Commands =====
+@app.cli.command('rebuild-daily-sales')
+def rebuild_daily_sales_command():
+    """Recompute the daily_sales rollup from order history."""
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    rebuild_daily_sales(cur, is_postgres)
+    conn.commit()
+    query_cache.invalidate('order_history')
+    cur.execute('SELECT COUNT(*) AS days FROM daily_sales')
+    print(f"daily_sales rebuilt: {cur.fetchone()['days']} days")
+
+@app.cli.command('reconcile-customer-stats')
+def reconcile_customer_stats_command():
+    """Recompute every customer's order count, spend and last order date."""
+    conn, is_postgres = get_db()
+    cur = conn.cursor()
+    backfill_order_customers(cur, is_postgres)
+    customers = reconcile_customer_stats(cur, is_postgres)
+    conn.commit()
+    query_cache.invalidate('customers')
+    print(f"customer stats reconciled: {customers} customers")
+
+@app.cli.group('db')
+def db_cli():
+    """Database schema commands."""
+
+@db_cli.command('upgrade')
+def db_upgrade_command():
+    """Apply pending migrations; seeds sample data into a new database."""
+    before = schema_version()
+    init_db()
+    print(f"schema at version {schema_version()} (was {before})")
+
+@db_cli.command('status')
+def db_status_command():
+    """Show the applied and expected schema versions."""
+    version = schema_version()
+    print(f"schema at version {version}, this release expects {SCHEMA_VERSION}")
+    if version < SCHEMA_VERSION:
+        raise SystemExit(1)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,126 @@
+"""
+90's JAR - Static asset pipeline shared by app.py and server.py
+
+The front-end files are read once per process, fingerprinted and compressed up front,
+then served from memory. index.html is rewritten to reference the fingerprinted names
+(e.g. api.3f2a9c1b0d.js), which are cached for a year; the page itself and the plain
+names are revalidated with their ETag. Only the files listed here are served.
+"""
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+import logging
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+# Brotli is optional; assets fall back to gzip without it
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGE = 'index.html'
+ASSET_FILES = ('styles.css', 'api.js', 'modules.js', 'orders.js', 'inventory.js', 'recipes.js',
+               'customers.js', 'grocery.js', 'main.js')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+class Asset:
+    """One file's bytes and precompressed variants, keyed by content encoding"""
+
+    def __init__(self, name, body):
+        self.name = name
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.digest = hashlib.sha256(body).hexdigest()[:10]
+        self.variants = {None: body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if HAS_BROTLI:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    def fingerprinted(self):
+        stem, ext = os.path.splitext(self.name)
+        return f'{stem}.{self.digest}{ext}'
+
+class AssetStore:
+    """Every servable URL path mapped to its (Asset, Cache-Control)"""
+
+    def __init__(self, directory=ASSET_DIR):
+        self.directory = directory
+        self.routes = {}
+        self.mtimes = {}
+
+    def build(self):
+        routes, mtimes, fingerprinted = {}, {}, {}
+        for name in ASSET_FILES:
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                asset = Asset(name, f.read())
+            mtimes[name] = os.path.getmtime(path)
+            fingerprinted[name] = asset.fingerprinted()
+            routes[name] = (asset, REVALIDATE)
+            routes[fingerprinted[name]] = (asset, IMMUTABLE)
+
+        path = os.path.join(self.directory, PAGE)
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        mtimes[PAGE] = os.path.getmtime(path)
+        # Point the page's local <script src> / <link href> at the fingerprinted copies
+        html = re.sub(r'((?:src|href)=")([^"/:]+)(")',
+                      lambda m: m.group(1) + fingerprinted.get(m.group(2), m.group(2)) + m.group(3), html)
+        routes[''] = routes[PAGE] = (Asset(PAGE, html.encode('utf-8')), REVALIDATE)
+
+        self.routes, self.mtimes = routes, mtimes
+        logger.info(f"Built {len(fingerprinted)} static assets")
+
+    def stale(self):
+        """Whether a source file changed since the last build (checked in debug mode only)"""
+        for name, mtime in self.mtimes.items():
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path) or os.path.getmtime(path) != mtime:
+                return True
+        return False
+
+    def response(self, app, path):
+        """The asset at path for this request: a 304, the best encoding the client accepts,
+        or a 404 for anything outside the allow-list"""
+        if app.debug and self.stale():
+            self.build()
+        if path not in self.routes:
+            return app.response_class('Not Found', status=404, mimetype='text/plain')
+        asset, cache_control = self.routes[path]
+
+        accepted = request.accept_encodings
+        encoding = next((enc for enc in ('br', 'gzip') if enc in asset.variants and accepted[enc]), None)
+        etag = f'{asset.digest}-{encoding}' if encoding else asset.digest
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept-Encoding')
+        return response
+
+def register_assets(app):
+    """Serve the page at / and the allow-listed assets, built once for this process"""
+    store = AssetStore()
+    store.build()
+
+    def index():
+        return store.response(app, '')
+
+    def serve_static(path):
+        return store.response(app, path)
+
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/<path:path>', 'serve_static', serve_static)
+    return store
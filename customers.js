@@ -96,7 +96,7 @@ const Customers = {
         
         if (result.success) {
             Toast.success('Saved', `${name} has been saved`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             Modal.close('customerModal');
             this.refresh();
             this.clearForm();
@@ -128,16 +128,19 @@ const Customers = {
         Modal.open('customerModal');
     },
 
-    viewCustomer(customerId) {
-        const customer = DataStore.customers.find(c => c.id === customerId);
+    async viewCustomer(customerId) {
+        let customer = DataStore.customers.find(c => c.id === customerId);
         if (!customer) return;
 
-        // Get customer orders
-        const customerOrders = [...DataStore.orders, ...DataStore.orderHistory].filter(o => 
-            (o.customer_name || o.customerName).toLowerCase() === customer.name.toLowerCase()
-        );
+        // Recent orders and up-to-date totals from the server
+        const result = await API.getCustomerOrders(customerId, { limit: 5 });
+        const customerOrders = result?.success ? result.data : [];
+        if (result?.success) customer = result.customer;
+        const recent = customerOrders.length
+            ? customerOrders.map(o => `  ${o.order_id || o.orderId} - ${Utils.formatCurrency(o.total || 0)} (${o.source === 'history' ? 'completed' : o.status})`).join('\n')
+            : '  None';
 
-        alert(`Customer: ${customer.name}\nPhone: ${customer.phone || 'N/A'}\nEmail: ${customer.email || 'N/A'}\nAddress: ${customer.address || 'N/A'}\nTotal Orders: ${customer.total_orders || customer.totalOrders || 0}\nTotal Spent: ${Utils.formatCurrency(customer.total_spent || customer.totalSpent || 0)}\nNotes: ${customer.notes || 'None'}`);
+        alert(`Customer: ${customer.name}\nPhone: ${customer.phone || 'N/A'}\nEmail: ${customer.email || 'N/A'}\nAddress: ${customer.address || 'N/A'}\nTotal Orders: ${customer.total_orders || customer.totalOrders || 0}\nTotal Spent: ${Utils.formatCurrency(customer.total_spent || customer.totalSpent || 0)}\nNotes: ${customer.notes || 'None'}\n\nRecent Orders:\n${recent}`);
     },
 
     async deleteCustomer(customerId) {
@@ -147,7 +150,7 @@ const Customers = {
         
         if (result.success) {
             Toast.success('Deleted', 'Customer has been deleted');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
         }
@@ -235,7 +238,7 @@ const Finance = {
         
         if (result.success) {
             Toast.success('Added', `${type} of ${Utils.formatCurrency(amount)} recorded`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             Modal.close('transactionModal');
             this.refresh();
             this.clearForm();
@@ -259,7 +262,7 @@ const Finance = {
         
         if (result.success) {
             Toast.success('Deleted', 'Transaction has been deleted');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
         }
     }
@@ -268,18 +271,35 @@ const Finance = {
 // ===== History Module =====
 const History = {
     searchQuery: '',
+    searchResults: null, // server matches for searchQuery, best first
     
     refresh() {
-        this.renderHistory();
+        if (this.searchQuery) {
+            this.search(this.searchQuery);
+        } else {
+            this.renderHistory();
+        }
     },
 
     search(query) {
         this.searchQuery = query.toLowerCase().trim();
+        this.searchResults = null;
+        clearTimeout(this.searchTimer);
         this.renderHistory();
+        if (!this.searchQuery) return;
+        // Search the whole history on the server once typing pauses
+        this.searchTimer = setTimeout(async () => {
+            const query = this.searchQuery;
+            const result = await API.searchOrders(query, { scope: 'history', limit: 100 });
+            if (query !== this.searchQuery) return;
+            this.searchResults = result?.success ? result.data : null;
+            this.renderHistory();
+        }, 250);
     },
 
     clearSearch() {
         this.searchQuery = '';
+        this.searchResults = null;
         document.getElementById('historySearch').value = '';
         this.renderHistory();
     },
@@ -288,8 +308,10 @@ const History = {
         const container = document.getElementById('historyTable');
         let orders = DataStore.orderHistory;
         
-        // Apply search filter
-        if (this.searchQuery) {
+        // Apply search filter; the loaded rows are filtered until the server answers
+        if (this.searchQuery && this.searchResults) {
+            orders = this.searchResults;
+        } else if (this.searchQuery) {
             orders = orders.filter(order => {
                 const searchText = this.searchQuery;
                 const orderId = order.order_id || order.orderId || '';
@@ -739,7 +761,7 @@ const History = {
         
         if (result.success) {
             Toast.success('Deleted', 'History record has been removed');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
         } else {
             Toast.error('Error', 'Failed to delete record');
@@ -829,7 +851,7 @@ const History = {
         if (result.success) {
             Toast.success('Order Created', `New order created for ${newOrder.customerName}`);
             this.closeRepeatModal();
-            await DataStore.loadAll();
+            await DataStore.sync();
             Orders.refresh();
             Dashboard.refresh();
             
@@ -1159,45 +1181,33 @@ const Settings = {
         Toast.success('Settings Saved', 'Your settings have been saved');
     },
 
-    async exportData() {
-        try {
-            const data = await API.exportData();
-            const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
-            const url = URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = `90s_jar_backup_${new Date().toISOString().split('T')[0]}.json`;
-            a.click();
-            URL.revokeObjectURL(url);
-            Toast.success('Exported', 'Data has been exported');
-        } catch (error) {
-            Toast.error('Error', 'Failed to export data');
-        }
+    exportData() {
+        // Let the browser stream the backup straight to disk
+        const a = document.createElement('a');
+        a.href = API.exportUrl({ download: 1 });
+        a.click();
+        Toast.success('Exported', 'Data export has started');
     },
 
     importData() {
         const input = document.createElement('input');
         input.type = 'file';
-        input.accept = '.json';
+        input.accept = '.json,.ndjson,.gz';
         input.onchange = async (e) => {
             const file = e.target.files[0];
             if (!file) return;
 
-            const reader = new FileReader();
-            reader.onload = async (event) => {
-                try {
-                    const data = JSON.parse(event.target.result);
-                    const result = await API.importData(data);
-                    if (result.success) {
-                        await DataStore.loadAll();
-                        Toast.success('Imported', 'Data has been imported');
-                        location.reload();
-                    }
-                } catch (error) {
-                    Toast.error('Error', 'Invalid backup file');
-                }
-            };
-            reader.readAsText(file);
+            const result = await API.importFile(file, (progress) => {
+                if (progress.stage === 'loading') console.log(`Importing ${progress.table}: ${progress.rows} rows`);
+                if (progress.stage === 'validated') Toast.info('Importing', 'Backup checked, replacing data...');
+            });
+            if (result.success) {
+                await DataStore.loadAll();
+                Toast.success('Imported', 'Data has been imported');
+                location.reload();
+            } else {
+                Toast.error('Error', result.error || 'Invalid backup file');
+            }
         };
         input.click();
     },
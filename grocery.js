@@ -4,6 +4,7 @@ const Grocery = {
     categoryFilter: 'all',
     items: [],
     usageHistory: [],
+    consumption: [], // usage totals per item and purpose
     chartColors: {
         'pickles': '#8B4513',
         'snacks': '#D2691E',
@@ -21,16 +22,19 @@ const Grocery = {
 
     async loadData() {
         try {
-            const [groceryRes, usageRes] = await Promise.all([
+            const [groceryRes, usageRes, consumptionRes] = await Promise.all([
                 API.getGrocery(),
-                API.getGroceryUsage()
+                API.getGroceryUsage(),
+                API.getGroceryConsumption()
             ]);
             this.items = groceryRes.data || [];
             this.usageHistory = usageRes.data || [];
+            this.consumption = consumptionRes.data || [];
         } catch (error) {
             console.error('Error loading grocery data:', error);
             this.items = [];
             this.usageHistory = [];
+            this.consumption = [];
         }
     },
 
@@ -210,10 +214,19 @@ const Grocery = {
         return expiry < today;
     },
 
-    updateStats() {
+    // Expired / expiring / low stock lists and usage forecast, worked out by the server
+    alerts: { expired: [], expiringSoon: [], lowStock: [], forecast: [], counts: {} },
+
+    async loadAlerts() {
+        const result = await API.getGroceryAlerts();
+        if (result?.success) this.alerts = result;
+    },
+
+    async updateStats() {
+        await this.loadAlerts();
         const totalItems = this.items.length;
-        const lowStock = this.items.filter(item => item.quantity <= 1).length;
-        const expiringSoon = this.items.filter(item => this.isExpiringSoon(item.expiry_date) || this.isExpired(item.expiry_date)).length;
+        const lowStock = this.alerts.lowStock.length;
+        const expiringSoon = this.alerts.expired.length + this.alerts.expiringSoon.length;
         const totalCost = this.items.reduce((sum, item) => sum + (item.cost || 0), 0);
 
         document.getElementById('totalGroceryItems').textContent = totalItems;
@@ -241,15 +254,15 @@ const Grocery = {
             }
         });
         
-        // Calculate usage per item
+        // Usage per item, from the per-item/per-purpose totals
         const usageByItem = {};
-        this.usageHistory.forEach(usage => {
-            if (!usageByItem[usage.grocery_id]) {
-                usageByItem[usage.grocery_id] = { count: 0, totalQty: 0, purposes: new Set() };
+        this.consumption.forEach(row => {
+            if (!usageByItem[row.grocery_id]) {
+                usageByItem[row.grocery_id] = { count: 0, totalQty: 0, purposes: new Set() };
             }
-            usageByItem[usage.grocery_id].count++;
-            usageByItem[usage.grocery_id].totalQty += usage.quantity_used || 0;
-            if (usage.purpose) usageByItem[usage.grocery_id].purposes.add(usage.purpose);
+            usageByItem[row.grocery_id].count += row.uses;
+            usageByItem[row.grocery_id].totalQty += row.quantity;
+            if (row.purpose) usageByItem[row.grocery_id].purposes.add(row.purpose);
         });
 
         // Calculate usage stats per category
@@ -271,13 +284,10 @@ const Grocery = {
             .sort((a, b) => b.usage.totalQty - a.usage.totalQty)
             .slice(0, 10);
 
-        // Low stock items
-        const lowStockItems = this.items.filter(item => item.quantity <= 1);
-
-        // Expiring items
-        const expiringItems = this.items.filter(item => 
-            this.isExpiringSoon(item.expiry_date) || this.isExpired(item.expiry_date)
-        );
+        // Low stock and expiring items, from the alerts loaded with the stats
+        const lowStockItems = this.alerts.lowStock;
+        const expiringItems = [...this.alerts.expired, ...this.alerts.expiringSoon];
+        const runningOut = this.alerts.forecast.filter(item => item.daysLeft <= 7);
 
         content.innerHTML = `
             <div class="stats-grid">
@@ -364,6 +374,17 @@ const Grocery = {
                             </ul>
                         ` : '<p>No items expiring soon!</p>'}
                     </div>
+
+                    <div class="alert-box warning">
+                        <h4><i class="fas fa-hourglass-half"></i> Running Out (${runningOut.length})</h4>
+                        ${runningOut.length > 0 ? `
+                            <ul class="alert-list">
+                                ${runningOut.map(item => `
+                                    <li>${this.getCategoryEmoji(item.category)} ${item.item_name} - <strong>about ${item.daysLeft} days</strong> left at ${item.dailyUsage} ${item.unit}/day</li>
+                                `).join('')}
+                            </ul>
+                        ` : '<p>Nothing running out this week!</p>'}
+                    </div>
                 </div>
 
                 <!-- Usage by Purpose -->
@@ -380,14 +401,13 @@ const Grocery = {
     getUsageByPurpose() {
         const purposeStats = {};
         
-        this.usageHistory.forEach(usage => {
-            const purpose = usage.purpose || 'General Use';
+        this.consumption.forEach(row => {
+            const purpose = row.purpose || 'General Use';
             if (!purposeStats[purpose]) {
                 purposeStats[purpose] = { count: 0, items: new Set() };
             }
-            purposeStats[purpose].count++;
-            const item = this.items.find(i => i.id === usage.grocery_id);
-            if (item) purposeStats[purpose].items.add(item.item_name);
+            purposeStats[purpose].count += row.uses;
+            purposeStats[purpose].items.add(row.item_name);
         });
 
         const purposes = Object.entries(purposeStats)
@@ -645,7 +665,7 @@ const Grocery = {
             
             Toast.success('Saved', `${itemName} has been saved`);
             Modal.close('groceryModal');
-            await DataStore.loadAll(); // Refresh all data including transactions
+            await DataStore.sync(); // Pull changed rows including transactions
             await this.refresh();
             Dashboard.refresh(); // Update dashboard expenses
         } else {
@@ -673,39 +693,16 @@ const Grocery = {
 
     // Bulk import items
     async bulkImport(items) {
-        let successCount = 0;
-        let failCount = 0;
-        
-        for (const item of items) {
-            try {
-                const result = await API.saveGrocery(item);
-                if (result.success) {
-                    successCount++;
-                    
-                    // Also create expense transaction if has cost
-                    if (item.cost > 0) {
-                        const transaction = {
-                            type: 'expense',
-                            category: 'grocery',
-                            amount: item.cost,
-                            date: item.purchase_date || new Date().toISOString().split('T')[0],
-                            description: `Grocery: ${item.item_name} from ${item.supplier || 'Unknown'}`
-                        };
-                        await API.saveTransaction(transaction);
-                    }
-                } else {
-                    failCount++;
-                }
-            } catch (e) {
-                failCount++;
-            }
-        }
+        // One request: the server adds the items and their expense transactions together
+        const result = await API.bulkSaveGrocery(items);
+        const successCount = result.added || 0;
+        const failCount = result.success ? result.failed : items.length;
         
-        await DataStore.loadAll(); // Refresh all data including transactions
+        await DataStore.sync(); // Pull changed rows including transactions
         await this.refresh();
         Dashboard.refresh(); // Update dashboard
         Toast.success('Import Complete', `Added ${successCount} items${failCount > 0 ? `, ${failCount} failed` : ''}`);
-        return { successCount, failCount };
+        return { successCount, failCount, results: result.results || [] };
     },
 
     viewDetails(itemId) {
@@ -114,7 +114,7 @@ const Inventory = {
         
         if (result.success) {
             Toast.success('Saved', `${name} has been saved`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             Modal.close('inventoryModal');
             this.refresh();
             Dashboard.refresh();
@@ -157,7 +157,7 @@ const Inventory = {
         const result = await API.updateStock(itemId, change);
         
         if (result.success) {
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
         }
@@ -170,7 +170,7 @@ const Inventory = {
         
         if (result.success) {
             Toast.success('Deleted', 'Item has been deleted');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
         }
@@ -320,7 +320,7 @@ const Combos = {
         
         if (result.success) {
             Toast.success('Saved', `${name} combo has been saved`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             Modal.close('comboModal');
             this.refresh();
             this.clearForm();
@@ -363,7 +363,7 @@ const Combos = {
         
         if (result.success) {
             Toast.success('Deleted', 'Combo has been deleted');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
         }
     }
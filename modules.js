@@ -78,6 +78,7 @@ const Dashboard = {
     TIMEZONE: 'America/Chicago', // Texas CST
     
     async refresh() {
+        await this.loadFinance();
         this.updateStats();
         this.updateSummaryCards();
         this.renderPopularItems();
@@ -112,13 +113,6 @@ const Dashboard = {
         return { today, weekStart, monthStart, now };
     },
 
-    // Check if a date string falls on a specific day (in CST)
-    isOnDate(dateStr, targetDate) {
-        const dateCST = this.toTexasDateString(dateStr);
-        const targetCST = targetDate.toLocaleDateString('en-US', { timeZone: this.TIMEZONE });
-        return dateCST === targetCST;
-    },
-    
     // Check if date is in range (CST)
     isInRange(dateStr, startDate, endDate) {
         if (!dateStr) return false;
@@ -127,64 +121,53 @@ const Dashboard = {
         return date >= startDate && date <= endDate;
     },
 
-    // Calculate income for a date range - from order history (completed orders)
+    // Daily income/expense buckets from /api/analytics/finance
+    finance: { days: new Map(), totals: { income: 0, expenses: 0 } },
+
+    // YYYY-MM-DD of a date built from CST wall-clock parts (see getDateRanges)
+    dateKey(date) {
+        return `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}-${String(date.getDate()).padStart(2, '0')}`;
+    },
+
+    async loadFinance() {
+        const { today, weekStart, monthStart } = this.getDateRanges();
+        const sixDaysAgo = new Date(today);
+        sixDaysAgo.setDate(today.getDate() - 6);
+        const from = this.dateKey(new Date(Math.min(weekStart, monthStart, sixDaysAgo)));
+        const [recent, allTime] = await Promise.all([
+            API.getFinance({ from, period: 'day', tz: this.TIMEZONE }),
+            API.getFinance({ period: 'month', tz: this.TIMEZONE })
+        ]);
+        if (recent?.success) this.finance.days = new Map(recent.day.map(d => [d.period, d]));
+        if (allTime?.success) this.finance.totals = allTime.totals;
+    },
+
+    sumFinance(field, startDate, endDate) {
+        const start = this.dateKey(startDate);
+        const end = endDate ? this.dateKey(endDate) : start;
+        let total = 0;
+        this.finance.days.forEach((day, key) => {
+            if (key >= start && key <= end) total += day[field];
+        });
+        return total;
+    },
+
+    // Income for a day, or a date range - from order history (completed orders)
     getIncome(startDate, endDate = null) {
-        return DataStore.orderHistory
-            .filter(o => {
-                const deliveredDate = o.delivered_at || o.deliveredAt || o.created_at || o.createdAt;
-                if (!deliveredDate) return false;
-                if (endDate) {
-                    return this.isInRange(deliveredDate, startDate, endDate);
-                }
-                return this.isOnDate(deliveredDate, startDate);
-            })
-            .reduce((sum, o) => sum + (parseFloat(o.total) || 0), 0);
+        return this.sumFinance('income', startDate, endDate);
     },
 
-    // Calculate expenses for a date range (transactions + grocery)
+    // Expenses for a day, or a date range (transactions + grocery)
     getExpenses(startDate, endDate = null) {
-        // Transaction expenses
-        const transExpenses = (DataStore.transactions || [])
-            .filter(t => {
-                if (t.type !== 'expense') return false;
-                const transDate = t.date || t.created_at || t.createdAt;
-                if (!transDate) return false;
-                if (endDate) {
-                    return this.isInRange(transDate, startDate, endDate);
-                }
-                return this.isOnDate(transDate, startDate);
-            })
-            .reduce((sum, t) => sum + (parseFloat(t.amount) || 0), 0);
-        
-        // Grocery expenses - THIS IS THE MAIN EXPENSE SOURCE
-        const groceryExpenses = (DataStore.grocery || [])
-            .filter(g => {
-                const purchaseDate = g.purchase_date || g.purchaseDate;
-                if (!purchaseDate) return false;
-                if (endDate) {
-                    return this.isInRange(purchaseDate, startDate, endDate);
-                }
-                return this.isOnDate(purchaseDate, startDate);
-            })
-            .reduce((sum, g) => sum + (parseFloat(g.cost) || 0), 0);
-        
-        return transExpenses + groceryExpenses;
+        return this.sumFinance('expenses', startDate, endDate);
     },
     
-    // Get all-time totals (no date filtering)
     getAllTimeIncome() {
-        return DataStore.orderHistory.reduce((sum, o) => sum + (parseFloat(o.total) || 0), 0);
+        return this.finance.totals.income;
     },
     
     getAllTimeExpenses() {
-        const transExpenses = (DataStore.transactions || [])
-            .filter(t => t.type === 'expense')
-            .reduce((sum, t) => sum + (parseFloat(t.amount) || 0), 0);
-        
-        const groceryExpenses = (DataStore.grocery || [])
-            .reduce((sum, g) => sum + (parseFloat(g.cost) || 0), 0);
-        
-        return transExpenses + groceryExpenses;
+        return this.finance.totals.expenses;
     },
 
     // Update the quick summary cards (weekly, monthly, all-time)
@@ -283,41 +266,30 @@ const Dashboard = {
         document.getElementById('lowStockCount').textContent = totalLowStock;
     },
 
-    renderPopularItems() {
+    async renderPopularItems() {
         const container = document.getElementById('popularItems');
         if (!container) return;
         
-        // Collect item sales from both active orders and history
-        const itemSales = {};
-        [...(DataStore.orders || []), ...(DataStore.orderHistory || [])].forEach(order => {
-            (order.items || []).forEach(item => {
-                const name = item.name || item.item_name || 'Unknown';
-                itemSales[name] = (itemSales[name] || 0) + (parseInt(item.quantity) || 1);
-            });
-        });
-
-        const sorted = Object.entries(itemSales).sort((a, b) => b[1] - a[1]).slice(0, 5);
+        const result = await API.getItemAnalytics({ limit: 5, to: this.dateKey(this.getDateRanges().today) });
+        const sorted = result?.success ? result.byUnits : [];
 
         if (sorted.length === 0) {
             container.innerHTML = `<div class="empty-state"><i class="fas fa-chart-bar"></i><p>No sales data yet</p></div>`;
             return;
         }
 
-        container.innerHTML = sorted.map((item, index) => {
-            const invItem = (DataStore.inventory || []).find(i => i.name === item[0]);
-            return `
-                <div class="popular-item">
-                    <div class="popular-item-info">
-                        <span class="popular-item-rank">${index + 1}</span>
-                        <div>
-                            <div class="popular-item-name">${item[0]}</div>
-                            <div class="popular-item-category">${invItem?.category || 'Combo/Custom'}</div>
-                        </div>
+        container.innerHTML = sorted.map((item, index) => `
+            <div class="popular-item">
+                <div class="popular-item-info">
+                    <span class="popular-item-rank">${index + 1}</span>
+                    <div>
+                        <div class="popular-item-name">${item.name}</div>
+                        <div class="popular-item-category">${item.category || 'Combo/Custom'}</div>
                     </div>
-                    <span class="popular-item-sales">${item[1]} sold</span>
                 </div>
-            `;
-        }).join('');
+                <span class="popular-item-sales">${item.units} sold</span>
+            </div>
+        `).join('');
     },
 
     renderUpcomingDeliveries() {
@@ -576,8 +548,8 @@ const Dashboard = {
         const { today, weekStart, monthStart } = this.getDateRanges();
         
         const todayIncome = this.getIncome(today);
-        const weekIncome = this.getIncome(weekStart);
-        const monthIncome = this.getIncome(monthStart);
+        const weekIncome = this.getIncome(weekStart, today);
+        const monthIncome = this.getIncome(monthStart, today);
         const allTimeIncome = this.getAllTimeIncome();
         
         // Get daily breakdown for past 7 days using CST
@@ -660,8 +632,8 @@ const Dashboard = {
         const now = new Date();
         
         const todayExpenses = this.getExpenses(today);
-        const weekExpenses = this.getExpenses(weekStart);
-        const monthExpenses = this.getExpenses(monthStart);
+        const weekExpenses = this.getExpenses(weekStart, today);
+        const monthExpenses = this.getExpenses(monthStart, today);
         const allTimeExpenses = this.getAllTimeExpenses();
         
         // Get daily breakdown for past 7 days using CST
@@ -771,12 +743,12 @@ const Dashboard = {
         const todayExpenses = this.getExpenses(today);
         const todayProfit = todayIncome - todayExpenses;
         
-        const weekIncome = this.getIncome(weekStart);
-        const weekExpenses = this.getExpenses(weekStart);
+        const weekIncome = this.getIncome(weekStart, today);
+        const weekExpenses = this.getExpenses(weekStart, today);
         const weekProfit = weekIncome - weekExpenses;
         
-        const monthIncome = this.getIncome(monthStart);
-        const monthExpenses = this.getExpenses(monthStart);
+        const monthIncome = this.getIncome(monthStart, today);
+        const monthExpenses = this.getExpenses(monthStart, today);
         const monthProfit = monthIncome - monthExpenses;
         
         const allTimeIncome = this.getAllTimeIncome();
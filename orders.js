@@ -142,67 +142,35 @@ const Orders = {
         if (!suggestionsDiv) return;
 
         const q = query.toLowerCase().trim();
+        clearTimeout(this.customerSearchTimer);
         
         if (q.length < 2) {
             suggestionsDiv.style.display = 'none';
             return;
         }
 
-        // Search from customers AND order history for unique customers
-        const existingCustomers = new Map();
-        
-        // Add from customers list
-        DataStore.customers.forEach(c => {
-            const key = (c.name + c.phone).toLowerCase();
-            if (!existingCustomers.has(key)) {
-                existingCustomers.set(key, {
-                    name: c.name,
-                    phone: c.phone || '',
-                    email: c.email || '',
-                    address: c.address || '',
-                    source: 'customer'
-                });
-            }
-        });
-        
-        // Add from order history
-        DataStore.orderHistory.forEach(o => {
-            const name = o.customer_name || o.customerName;
-            const phone = o.customer_phone || o.customerPhone || '';
-            const key = (name + phone).toLowerCase();
-            if (!existingCustomers.has(key)) {
-                existingCustomers.set(key, {
-                    name: name,
-                    phone: phone,
-                    email: o.customer_email || o.customerEmail || '',
-                    address: o.customer_address || o.customerAddress || '',
-                    source: 'history'
-                });
-            }
-        });
-        
-        // Add from current orders
-        DataStore.orders.forEach(o => {
-            const name = o.customer_name || o.customerName;
-            const phone = o.customer_phone || o.customerPhone || '';
-            const key = (name + phone).toLowerCase();
-            if (!existingCustomers.has(key)) {
-                existingCustomers.set(key, {
-                    name: name,
-                    phone: phone,
-                    email: o.customer_email || o.customerEmail || '',
-                    address: o.customer_address || o.customerAddress || '',
-                    source: 'orders'
-                });
-            }
-        });
+        // Wait for a pause in typing, then let the server rank the matches
+        this.customerSearchTimer = setTimeout(() => this.searchCustomers(q), 200);
+    },
 
-        // Filter matching customers
-        const matches = Array.from(existingCustomers.values()).filter(c => 
-            c.name.toLowerCase().includes(q) ||
-            c.phone.toLowerCase().includes(q) ||
-            c.email.toLowerCase().includes(q)
+    async searchCustomers(q) {
+        const suggestionsDiv = document.getElementById('customerSuggestions');
+        const seq = this.customerSearchSeq = (this.customerSearchSeq || 0) + 1;
+        const result = await API.searchCustomers(q, 8);
+        // A newer keystroke already has its own request in flight
+        if (!suggestionsDiv || seq !== this.customerSearchSeq) return;
+
+        const found = result?.success ? result.results : DataStore.customers.filter(c =>
+            (c.name || '').toLowerCase().includes(q) ||
+            (c.phone || '').toLowerCase().includes(q) ||
+            (c.email || '').toLowerCase().includes(q)
         ).slice(0, 8);
+        const matches = found.map(c => ({
+            name: c.name || '',
+            phone: c.phone || '',
+            email: c.email || '',
+            address: c.address || ''
+        }));
 
         if (matches.length === 0) {
             suggestionsDiv.style.display = 'none';
@@ -707,13 +675,16 @@ const Orders = {
         }
         
         if (result.success) {
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.clearOrderForm();
             Modal.close('orderModal');
             this.refresh();
             Dashboard.refresh();
+        } else if (result.shortages) {
+            const lines = result.shortages.map(s => `${s.name}: ${s.available} left`).join(', ');
+            Toast.error('Not Enough Stock', lines);
         } else {
-            Toast.error('Error', 'Failed to save order');
+            Toast.error('Error', result.error || 'Failed to save order');
         }
     },
 
@@ -790,7 +761,7 @@ const Orders = {
         
         if (result.success) {
             Toast.success('Status Updated', `Order status changed to ${nextStatus}`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
             if (nextStatus === 'delivered') {
@@ -807,7 +778,7 @@ const Orders = {
         
         if (result.success) {
             Toast.success('Status Updated', `Order status changed to ${newStatus}`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
             
@@ -850,16 +821,14 @@ const Orders = {
             return;
         }
         
-        // Use Texas CST time so income is recorded for TODAY in Texas timezone
-        const texasDateTime = Utils.getTexasISOString();
-        
-        // Update status to completed and move to history
-        const result = await API.updateOrderStatus(this.viewingOrderId, 'completed', texasDateTime);
+        // Update status to completed and move to history. The timestamp is UTC; the server
+        // buckets it into the shop's day (ANALYTICS_TIMEZONE)
+        const result = await API.updateOrderStatus(this.viewingOrderId, 'completed', new Date().toISOString());
         
         if (result.success) {
             Toast.success('Order Completed', `Order moved to history. Income: ${Utils.formatCurrency(order.total)}`);
             Modal.close('viewOrderModal');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
             History.refresh();
@@ -1358,7 +1327,7 @@ const Orders = {
         
         if (result.success) {
             Toast.success('Deleted', 'Order has been deleted');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
             Dashboard.refresh();
         }
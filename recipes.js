@@ -154,7 +154,7 @@ const Recipes = {
         
         if (result.success) {
             Toast.success('Saved', `${name} recipe has been saved`);
-            await DataStore.loadAll();
+            await DataStore.sync();
             Modal.close('recipeModal');
             this.refresh();
             this.clearForm();
@@ -196,7 +196,7 @@ const Recipes = {
         Modal.open('recipeModal');
     },
 
-    viewRecipe(recipeId) {
+    async viewRecipe(recipeId) {
         const recipe = DataStore.recipes.find(r => r.id === recipeId);
         if (!recipe) return;
 
@@ -208,7 +208,10 @@ const Recipes = {
         document.getElementById('viewRecipeBatchSize').textContent = recipe.batch_size || recipe.batchSize || 'N/A';
         document.getElementById('viewRecipeTime').textContent = recipe.total_time || recipe.totalTime || 'N/A';
         
-        document.getElementById('viewRecipeIngredients').innerHTML = (recipe.ingredients || []).map(ing => 
+        // Costs at today's grocery prices, falling back to the saved figures
+        const cost = await API.getRecipeCost(recipeId);
+        const ingredients = cost?.success ? cost.ingredients : (recipe.ingredients || []);
+        document.getElementById('viewRecipeIngredients').innerHTML = ingredients.map(ing => 
             `<li>${ing.name} - ${ing.quantity} (${Utils.formatCurrency(ing.cost)})</li>`
         ).join('');
         
@@ -217,7 +220,8 @@ const Recipes = {
         ).join('');
         
         document.getElementById('viewRecipeNotes').textContent = recipe.notes || 'No notes';
-        document.getElementById('viewRecipeTotalCost').textContent = Utils.formatCurrency(recipe.total_ingredient_cost || recipe.totalIngredientCost || 0);
+        document.getElementById('viewRecipeTotalCost').textContent = Utils.formatCurrency(
+            cost?.success ? cost.batchCost : (recipe.total_ingredient_cost || recipe.totalIngredientCost || 0));
 
         Modal.open('viewRecipeModal');
     },
@@ -229,7 +233,7 @@ const Recipes = {
         
         if (result.success) {
             Toast.success('Deleted', 'Recipe has been deleted');
-            await DataStore.loadAll();
+            await DataStore.sync();
             this.refresh();
         }
     }
@@ -1,18 +1,13 @@
 """
 Simple Flask server to serve the 90's JAR static website
 """
-from flask import Flask, send_from_directory, send_file
+from flask import Flask
 import os
 
-app = Flask(__name__, static_folder='.')
+from assets import register_assets
 
-@app.route('/')
-def index():
-    return send_file('index.html')
-
-@app.route('/<path:path>')
-def serve_static(path):
-    return send_from_directory('.', path)
+app = Flask(__name__, static_folder=None)
+register_assets(app)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
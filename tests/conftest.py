@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The Flask app on a fresh SQLite file, with per-worker state reset"""
+    monkeypatch.setattr(app_module, 'DB_FILE', str(tmp_path / 'jar_database.db'))
+    monkeypatch.setattr(app_module, '_pool', None)
+    monkeypatch.setattr(app_module, '_db_ready', False)
+    monkeypatch.setattr(app_module, '_customer_search_indexed', None)
+    monkeypatch.setattr(app_module, '_order_search_indexed', None)
+    monkeypatch.setattr(app_module, 'query_cache', app_module.QueryCache())
+    monkeypatch.setattr(app_module, 'table_versions', app_module.TableVersions())
+    return app_module.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
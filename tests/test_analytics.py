@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import app as app_module
+
+# 02:00 in the shop's timezone; read as a UTC hour it would land on the previous day
+LOCAL_2AM = datetime(2026, 3, 10, 2, 0, tzinfo=ZoneInfo(app_module.ANALYTICS_TIMEZONE))
+
+
+@pytest.mark.parametrize('delivered_at', [
+    # What completeOrder sends: new Date().toISOString()
+    LOCAL_2AM.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z'),
+    # A client that keeps its local offset
+    LOCAL_2AM.isoformat(),
+])
+def test_completion_after_local_midnight_counts_for_that_local_day(client, delivered_at):
+    order_id = client.post('/api/orders', json={'customerName': 'Night Owl', 'items': [], 'total': 40}).json['id']
+    response = client.put(f'/api/orders/{order_id}/status', json={'status': 'completed', 'deliveredAt': delivered_at})
+    assert response.json['success']
+
+    with app_module.app.app_context():
+        conn, _ = app_module.get_db()
+        days = [tuple(row) for row in conn.execute('SELECT sale_date, orders, revenue FROM daily_sales')]
+    assert days == [('2026-03-10', 1, 40.0)]
+
+    finance = client.get('/api/analytics/finance?from=2026-03-09&to=2026-03-10&period=day').json
+    assert finance['day'] == [{'period': '2026-03-10', 'income': 40.0, 'expenses': 0.0, 'profit': 40.0}]
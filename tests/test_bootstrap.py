@@ -0,0 +1,10 @@
+def test_bootstrap_seeds_only_a_new_database(app, client):
+    items = client.get('/api/inventory').json
+    assert len(items) == 14
+
+    for item in items:
+        client.delete(f"/api/inventory/{item['id']}")
+    result = app.test_cli_runner().invoke(args=['db', 'upgrade'])
+
+    assert result.exit_code == 0
+    assert client.get('/api/inventory').json == []
@@ -0,0 +1,13 @@
+import app as app_module
+
+
+def test_delete_grocery_rolls_back_when_recipe_repricing_fails(client, monkeypatch):
+    grocery_id = client.post('/api/grocery', json={'item_name': 'Sesame', 'category': 'seeds',
+                                                   'quantity': 2, 'cost': 8}).json['id']
+
+    def fail(*args):
+        raise RuntimeError('repricing failed')
+    monkeypatch.setattr(app_module, 'reprice_recipes', fail)
+
+    assert client.delete(f'/api/grocery/{grocery_id}').json['success'] is False
+    assert [row['id'] for row in client.get('/api/grocery').json['data']] == [grocery_id]